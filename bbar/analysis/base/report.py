@@ -1,8 +1,9 @@
 class Report:
+    "A report turns the results table of a project into a table of {column name: values}"
     def __init__(self, metric, key):
         self.key = key
         self.metric = metric
         self.results = {}
 
-    def report():
-        pass
+    def report(self, table):
+        raise NotImplementedError(f"{type(self).__name__} doesn't implement report()")
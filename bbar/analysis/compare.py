@@ -0,0 +1,178 @@
+import os
+import math
+import tarfile
+import tempfile
+
+from bbar.logging import debug, info, warning
+from bbar.analysis.results_table import Results_Table, require_numpy, np
+
+#DOCUMENT: bbar compare --baseline <path> compares the results of the project with a baseline, configured in [compare]:
+#   test      = "mannwhitney" (default) | "bootstrap", the test for a difference between the baseline and current samples
+#   alpha     = significance level (default 0.05)
+#   threshold = smallest relative change of the mean that counts as a regression or improvement (default 0.05)
+#   higher_is_better = metrics for which higher values are better, all others are better lower
+#   resamples = bootstrap resamples (default 2000), seed = bootstrap seed (default 0)
+#   Rows are matched by SBATCH_n, environment variables, arguments and metric. With a single sample on either side,
+#   no test is possible and the threshold alone decides; use a repetition policy to get samples.
+compare_tests = ["mannwhitney", "bootstrap"]
+
+def mann_whitney(x, y):
+    "Two-sided p-value of the Mann-Whitney U test of x and y, by the normal approximation with tie correction"
+    n1, n2 = len(x), len(y)
+    values = np.concatenate([x, y])
+    order = np.argsort(values, kind="mergesort")
+    sorted_values = values[order]
+    #Average ranks of ties: every value gets the mean of the ranks of its run of equal values
+    _, starts, counts = np.unique(sorted_values, return_index=True, return_counts=True)
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(starts + (counts + 1)/2, counts)
+    u = ranks[:n1].sum() - n1*(n1 + 1)/2
+    n = n1 + n2
+    variance = n1*n2/12*((n + 1) - (counts**3 - counts).sum()/(n*(n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (abs(u - n1*n2/2) - 0.5)/math.sqrt(variance)
+    return min(1.0, math.erfc(max(z, 0)/math.sqrt(2)))
+
+def bootstrap_ratio(x, y, resamples, alpha, rng):
+    "Bootstrap confidence interval of mean(y)/mean(x)"
+    xs = x[rng.integers(0, len(x), (resamples, len(x)))].mean(axis=1)
+    ys = y[rng.integers(0, len(y), (resamples, len(y)))].mean(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = ys/xs
+    return tuple(np.nanpercentile(ratios, [100*alpha/2, 100*(1 - alpha/2)]))
+
+class Comparison:
+    def __init__(self, config):
+        self.test = config.get("test", "mannwhitney")
+        self.alpha = float(config.get("alpha", 0.05))
+        self.threshold = float(config.get("threshold", 0.05))
+        self.higher_is_better = set(config.get("higher_is_better", []))
+        self.resamples = int(config.get("resamples", 2000))
+        self.seed = int(config.get("seed", 0))
+        if self.test not in compare_tests:
+            raise ValueError(f"Unknown [compare] test \"{self.test}\", expected one of {', '.join(compare_tests)}")
+
+    def verdict(self, metric, ratio, significant):
+        change = ratio - 1 if metric not in self.higher_is_better else 1 - ratio
+        if not significant or abs(change) < self.threshold:
+            return "unchanged"
+        return "regression" if change > 0 else "improvement"
+
+    def compare(self, baseline, current):
+        """
+        Matches the rows of the baseline and current Results_Tables, and tests each match for a change.
+        Returns columns: the parameter keys, metric, baseline and current count and mean, change, p or the
+        bootstrap interval of the ratio of means, and the verdict: regression, improvement, unchanged or missing.
+        """
+        table = baseline.concat(current)
+        side = np.r_[np.zeros(len(baseline), dtype=bool), np.ones(len(current), dtype=bool)]
+        keys = table.key_columns() + ["metric"]
+        group, first = table.group_codes(keys)
+        values = table.columns["value"]
+        rng = np.random.default_rng(self.seed)
+
+        result = {k:table.columns[k][first] for k in keys}
+        stats = {name:[] for name in ["baseline_count", "baseline_mean", "count", "mean", "change"]}
+        stats.update({"p": []} if self.test == "mannwhitney" else {"ratio_low": [], "ratio_high": []})
+        stats["verdict"] = []
+        for g in range(len(first)):
+            in_group = group == g
+            x, y = values[in_group & ~side], values[in_group & side]
+            metric = table.columns["metric"][first[g]]
+            stats["baseline_count"].append(len(x))
+            stats["count"].append(len(y))
+            stats["baseline_mean"].append(x.mean() if len(x) else math.nan)
+            stats["mean"].append(y.mean() if len(y) else math.nan)
+            test = {"p": math.nan} if self.test == "mannwhitney" else {"ratio_low": math.nan, "ratio_high": math.nan}
+            if not len(x) or not len(y) or x.mean() == 0:
+                stats["change"].append(math.nan)
+                verdict = "missing"
+            else:
+                ratio = y.mean()/x.mean()
+                stats["change"].append(ratio - 1)
+                significant = True
+                if len(x) > 1 and len(y) > 1:
+                    if self.test == "mannwhitney":
+                        test["p"] = mann_whitney(x, y)
+                        significant = test["p"] < self.alpha
+                    else:
+                        low, high = bootstrap_ratio(x, y, self.resamples, self.alpha, rng)
+                        test.update(ratio_low=low, ratio_high=high)
+                        significant = not low <= 1 <= high
+                verdict = self.verdict(metric, ratio, significant)
+            for k, v in test.items():
+                stats[k].append(v)
+            stats["verdict"].append(verdict)
+        result.update(stats)
+        return result
+
+def extract_archive(path, directory):
+    "Extracts a bbar archive (any of the [archive] formats) into directory"
+    if path.endswith(".tar.zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("Reading a zstd archive requires zstandard, install it with: pip3 install --user zstandard")
+        with open(path, "rb") as f, zstandard.ZstdDecompressor().stream_reader(f) as stream:
+            with tarfile.open(fileobj=stream, mode="r|") as tar:
+                safe_extract(tar, directory)
+    else:
+        with tarfile.open(path) as tar:
+            safe_extract(tar, directory)
+
+def safe_extract(tar, directory):
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(directory, filter="data")
+    else:
+        tar.extractall(directory)
+
+def project_table(directory, metrics):
+    "Extracts the metrics of the current project from the results of the bbar project in directory"
+    from bbar.bbarfile import read_bbarfile
+    from bbar.analysis.extraction import Extraction_Engine
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        #Read-only, so that the baseline's store isn't created, migrated or compacted
+        project = read_bbarfile(None, None, read_only=True)
+        project.bbarfile_data["benchmarks"]["metrics"] = metrics
+        #Plugin metrics need the job states of the baseline's scheduler, which are gone
+        return Results_Table.from_records(Extraction_Engine(project).extract(plugins=False))
+    finally:
+        os.chdir(cwd)
+
+def baseline_table(path, bbar_project):
+    """
+    Loads the results of a baseline: a results table (.npz or .parquet), the directory of a bbar project,
+    or an archive written by bbar archive. Projects and archives are analyzed with the metrics of bbar_project.
+    """
+    require_numpy()
+    metrics = bbar_project.bbarfile_data["benchmarks"].get("metrics", {})
+    if os.path.isfile(path) and path.endswith((".npz", ".parquet")):
+        fmt = "parquet" if path.endswith(".parquet") else "npz"
+        debug(f"Loading baseline results table {path}")
+        return Results_Table.load(path[:-len(fmt)-1], fmt)
+    if os.path.isdir(path):
+        debug(f"Extracting baseline results from project {path}")
+        return project_table(path, metrics)
+    if os.path.isfile(path):
+        with tempfile.TemporaryDirectory() as directory:
+            debug(f"Extracting baseline archive {path} into {directory}")
+            extract_archive(path, directory)
+            return project_table(directory, metrics)
+    raise Exception(f"Baseline {path} does not exist")
+
+def compare_with_baseline(bbar_project, path):
+    "Returns the comparison columns of the results of bbar_project with the baseline at path"
+    from bbar.analysis.results_table import update_results_table
+    comparison = Comparison(bbar_project.bbarfile_data.get("compare", {}))
+    baseline = baseline_table(path, bbar_project)
+    current = update_results_table(bbar_project)
+    if not len(baseline):
+        warning(f"No results found in baseline {path}")
+    columns = comparison.compare(baseline, current)
+    verdicts = list(columns["verdict"])
+    info(f"{verdicts.count('regression')} regression(s), {verdicts.count('improvement')} improvement(s), "
+         f"{verdicts.count('unchanged')} unchanged, {verdicts.count('missing')} missing")
+    return columns
@@ -0,0 +1,179 @@
+import os
+import re
+import mmap
+import glob
+from bisect import bisect_right
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from bbar.constants import command_marker, repetition_marker, warmup_marker, repetition_file_suffix
+from bbar.analysis.plugins import get_metric
+from bbar.logging import debug, warning, traced
+
+#One extracted value, for one repetition of one command (setting) of one batchfile. source is the file it was extracted from, "" for plugins
+Metric_Record = namedtuple("Metric_Record", ("batchfile", "command", "n_procs", "env_vars", "arguments", "metric", "value", "source", "repetition"))
+
+value_types = {"float": float, "int": int, "str": str}
+marker_regex = re.compile(rf"^({command_marker}|{repetition_marker}|{warmup_marker}) (\d+)$".encode(), re.MULTILINE)
+
+class Metric_Spec:
+    """
+    A metric declared in the bbarfile under [benchmarks.metrics.<name>], either:
+        regex  = a regular expression, the value is the named group "value", the first group, or the whole match
+        file   = file to search, relative to the workdir of each command (default: the batchfile output)
+        type   = "float" | "int" | "str" (default "float")
+        select = "first" | "last" | "all" (default "last"), which matches to keep per command
+    or:
+        metric = name of a registered metric plugin, called as metric(batchfile, command, job_stats)
+    """
+    def __init__(self, name, config):
+        self.name = name
+        self.plugin = config.get("metric")
+        self.regex = config.get("regex")
+        if bool(self.plugin) == bool(self.regex):
+            raise Exception(f"Metric {name} needs exactly one of \"regex\" or \"metric\"")
+        self.file = config.get("file")
+        self.type = config.get("type", "float")
+        self.select = config.get("select", "last")
+        if self.type not in value_types:
+            raise Exception(f"Unknown type \"{self.type}\" for metric {name}, expected one of {', '.join(value_types)}")
+        if self.select not in ["first", "last", "all"]:
+            raise Exception(f"Unknown select \"{self.select}\" for metric {name}, expected first, last or all")
+        if self.regex:
+            re.compile(self.regex)
+
+    def convert(self, raw_values):
+        values = [value_types[self.type](v) for v in raw_values]
+        if self.select == "first":
+            return values[:1]
+        if self.select == "last":
+            return values[-1:]
+        return values
+
+def read_metric_specs(config):
+    return [Metric_Spec(name, spec) for name, spec in config["benchmarks"].get("metrics", {}).items()]
+
+def match_value(m):
+    if "value" in m.re.groupindex:
+        return m.group("value")
+    return m.group(1) if m.re.groups else m.group(0)
+
+def scan_file(path, patterns, split_commands):
+    """
+    Streams through path (memory mapped, so multi-GB logs aren't read into memory), and returns
+    {(command index, repetition): {metric name: [raw matches]}}. With split_commands, matches are attributed to the
+    command and repetition whose markers precede them, otherwise (and before the first marker) to command None.
+    Matches in warmup runs get repetition None. Commands without a repetition policy have a single repetition 0.
+    """
+    found = {}
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return found
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            positions, keys = [], []
+            if split_commands:
+                command = None
+                for m in marker_regex.finditer(data):
+                    marker, number = m.group(1).decode(), int(m.group(2))
+                    if marker == command_marker:
+                        command, repetition = number, 0
+                    else:
+                        repetition = number if marker == repetition_marker else None
+                    positions.append(m.start())
+                    keys.append((command, repetition))
+            for name, pattern in patterns:
+                for m in re.finditer(pattern.encode(), data, re.MULTILINE):
+                    i = bisect_right(positions, m.start()) - 1
+                    key = keys[i] if i >= 0 else (None, 0)
+                    found.setdefault(key, {}).setdefault(name, []).append(match_value(m).decode())
+    return found
+
+def repetition_files(path):
+    "The files of each repetition of a file-based metric, see bbar.generic.repetitions, as {repetition: path}"
+    files = {}
+    for p in glob.glob(f"{glob.escape(path)}{repetition_file_suffix}*"):
+        r = p[len(path) + len(repetition_file_suffix):]
+        if r.isdigit():
+            files[int(r)] = p
+    return files
+
+def latest(path_pattern):
+    paths = glob.glob(path_pattern) if "*" in path_pattern else [path_pattern]
+    paths = [p for p in paths if os.path.isfile(p)]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+class Extraction_Engine:
+    "Extracts the metrics declared in the bbarfile from the outputs of all batchfiles of a project"
+    def __init__(self, bbar_project):
+        self.project = bbar_project
+        self.specs = read_metric_specs(bbar_project.bbarfile_data)
+        self.workers = int(bbar_project.bbarfile_data["analysis"]["workers"]) or os.cpu_count()
+
+    def file_tasks(self):
+        """
+        Groups regex metrics by the file they search: (path, batchfile, command index or None, patterns, repetition).
+        The repetition of a file is None if it's taken from markers in the file, see scan_file.
+        """
+        tasks = []
+        regex_specs = [s for s in self.specs if s.regex]
+        output_patterns = [(s.name, s.regex) for s in regex_specs if not s.file]
+        for batchfile in self.project.batchfiles:
+            output = latest(batchfile.get_output())
+            if output and output_patterns:
+                tasks.append((output, batchfile, None, output_patterns, None))
+            for i, command in enumerate(batchfile.commands.commands):
+                by_file = {}
+                for s in regex_specs:
+                    if s.file:
+                        by_file.setdefault(os.path.join(command.workdir, s.file), []).append((s.name, s.regex))
+                for path, patterns in by_file.items():
+                    #With a repetition policy, each repetition's file is kept as <file>.rep<r>
+                    repetitions = repetition_files(path) if getattr(batchfile.commands, "repetitions", None) else {}
+                    tasks += [(p, batchfile, i, patterns, r) for r, p in sorted(repetitions.items())]
+                    if not repetitions and os.path.isfile(path):
+                        tasks.append((path, batchfile, i, patterns, None))
+        return tasks
+
+    def record(self, batchfile, i, spec, values, source="", repetition=0):
+        command = batchfile.commands.commands[i]
+        return [Metric_Record(batchfile.filename, i, batchfile.n_procs, command.env_vars.var_dict,
+                              command.arguments, spec.name, v, source, repetition) for v in values]
+
+    @traced("extract")
+    def extract(self, tasks=None, plugins=True):
+        "Extracts metrics from the files of tasks (default: all of file_tasks()), and from metric plugins"
+        specs = {s.name:s for s in self.specs}
+        tasks = self.file_tasks() if tasks is None else tasks
+        debug(f"Extracting {len(self.specs)} metrics from {len(tasks)} files with {self.workers} workers")
+
+        records = []
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(scan_file, path, patterns, command is None) for path, _, command, patterns, _ in tasks]
+            for (path, batchfile, command, _, file_repetition), future in zip(tasks, futures):
+                try:
+                    found = future.result()
+                except Exception as e:
+                    warning(f"Could not extract metrics from {path}: {e}")
+                    continue
+                for (i, repetition), values in found.items():
+                    i = command if command is not None else i
+                    repetition = file_repetition if file_repetition is not None else repetition
+                    if i is None or i >= len(batchfile.commands.commands) or repetition is None:
+                        continue
+                    for name, raw_values in values.items():
+                        try:
+                            records += self.record(batchfile, i, specs[name], specs[name].convert(raw_values), path, repetition)
+                        except ValueError as e:
+                            warning(f"Bad value for metric {name} in {path}: {e}")
+
+        plugin_specs = [s for s in self.specs if s.plugin]
+        if plugins and plugin_specs:
+            stats = self.project.get_job_stats()
+            for s in plugin_specs:
+                metric = get_metric(s.plugin)
+                for batchfile in self.project.batchfiles:
+                    for i, command in enumerate(batchfile.commands.commands):
+                        value = metric(batchfile, command, stats.get(batchfile.filename, {}))
+                        if value is not None:
+                            records += self.record(batchfile, i, s, [value])
+        return records
@@ -1 +0,0 @@
-from .basic import zero, exit_code, status
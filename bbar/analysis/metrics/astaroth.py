@@ -1,4 +0,0 @@
-def mpitest(batchfile, job):
-    output_file = batchfile.output
-
-    
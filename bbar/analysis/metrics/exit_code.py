@@ -1,6 +1,15 @@
 from bbar.analysis.plugins import register_metric
 
-@register_metric("zero")
-def exit_code(batchfile, job):
-    stats = job.get_stats()
-    return stats["exit_code"]
+@register_metric("exit_code")
+def exit_code(batchfile, command, stats):
+    """
+    The exit code of the job as an int. LOCAL jobs record an int, sacct reports "<code>:<signal>",
+    and a job killed by a signal gets 128 + signal, as in the shell
+    """
+    code = stats.get("exit_code")
+    if code is None or code == "":
+        return None
+    if isinstance(code, int):
+        return code
+    code, _, signal = str(code).partition(":")
+    return int(code) or (128 + int(signal) if signal and int(signal) else 0)
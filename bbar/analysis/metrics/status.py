@@ -1,6 +1,5 @@
 from bbar.analysis.plugins import register_metric
 
 @register_metric("status")
-def status(batchfile, job):
-    stats = job.get_stats()
-    return stats["status"]
+def status(batchfile, command, stats):
+    return stats.get("state")
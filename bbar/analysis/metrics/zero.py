@@ -1,5 +1,5 @@
 from bbar.analysis.plugins import register_metric
 
 @register_metric("zero")
-def zero(**kwargs):
+def zero(batchfile, command, stats):
     return 0
@@ -0,0 +1,34 @@
+import csv
+import sys
+import json
+import math
+
+output_formats = ["text", "csv", "json"]
+
+def format_cell(value):
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
+
+def json_value(value):
+    value = value.item() if hasattr(value, "item") else value
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+def write_table(columns, fmt="text", file=sys.stdout):
+    "Writes a table given as {column name: sequence of values} as aligned text, CSV or a JSON list of rows"
+    names = list(columns)
+    rows = list(zip(*[list(columns[n]) for n in names]))
+    if fmt == "json":
+        json.dump([{n:json_value(v) for n,v in zip(names, row)} for row in rows], file, indent=1)
+        file.write("\n")
+    elif fmt == "csv":
+        writer = csv.writer(file)
+        writer.writerow(names)
+        writer.writerows(rows)
+    elif fmt == "text":
+        cells = [names] + [[format_cell(v) for v in row] for row in rows]
+        widths = [max(len(row[i]) for row in cells) for i in range(len(names))]
+        for row in cells:
+            file.write("  ".join([c.ljust(w) for c,w in zip(row, widths)]).rstrip()+"\n")
+    else:
+        raise ValueError(f"Unknown output format \"{fmt}\", expected one of {', '.join(output_formats)}")
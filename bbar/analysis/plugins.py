@@ -12,7 +12,7 @@ def register_report(name):
     """Decorator factory for registering a new plugin"""
     def decorator(report):
         debug(f"Registering report {name}")
-        _PLUGINS[system_plugin_importpath][name] = ReportPlugin(name=name, report=report)
+        _ANALYZER_PLUGINS[system_reports_plugin_importpath][name] = ReportPlugin(name=name, report=report)
         return report
     return decorator
 
@@ -23,7 +23,7 @@ def register_custom_report(name):
 
 def list_reports():
     """List all reports"""
-    return sorted(list(_ANALYZER_PLUGINS))
+    return sorted(list(_ANALYZER_PLUGINS[system_reports_plugin_importpath]))
 
 def get_report(name, importpath=system_reports_plugin_importpath):
     """Get a given plugin"""
@@ -42,7 +42,7 @@ def register_metric(name):
     """Decorator factory for registering a new plugin"""
     def decorator(metric):
         debug(f"Registering metric {name}")
-        _PLUGINS[system_plugin_importpath][name] = MetricPlugin(name=name, metric=metric)
+        _METRICS[system_metrics_plugin_importpath][name] = MetricPlugin(name=name, metric=metric)
         return metric
     return decorator
 
@@ -53,7 +53,7 @@ def register_custom_metric(name):
 
 def list_metrics():
     """List all metrics"""
-    return sorted(list(_METRICS))
+    return sorted(list(_METRICS[system_metrics_plugin_importpath]))
 
 def get_metric(name, importpath=system_metrics_plugin_importpath):
     """Get a given plugin"""
@@ -0,0 +1,74 @@
+import numpy as np
+
+from bbar.analysis.base import Report
+from bbar.analysis.plugins import register_report
+
+#DOCUMENT: scaling report, for each setting (env vars and arguments) along the scale-up axis SBATCH_n:
+#   p          = n/n0, the process count relative to the smallest scale point n0
+#   speedup    strong: T(n0)/T(n) for runtimes, X(n)/X(n0) for throughputs
+#              weak:   p*efficiency (scaled speedup)
+#   efficiency strong: speedup/p
+#              weak:   T(n0)/T(n) for runtimes, X(n)/(p*X(n0)) for throughputs
+#   karp_flatt the experimentally determined serial fraction (1/speedup - 1/p)/(1 - 1/p)
+#   step_efficiency is the efficiency relative to the previous scale point, and node_efficiency for inter-node
+#   points is relative to the last intra-node point (the fullest single node), so that intra-node and
+#   inter-node scaling can be told apart.
+@register_report("scaling")
+class Scaling_Report(Report):
+    def __init__(self, metric, key="SBATCH_n", kind="runtime", mode="strong", max_procs_per_node=1):
+        super().__init__(metric, key)
+        if kind not in ["runtime", "throughput"]:
+            raise Exception(f"Unknown metric kind \"{kind}\" for scaling report, expected runtime or throughput")
+        if mode not in ["strong", "weak"]:
+            raise Exception(f"Unknown scaling mode \"{mode}\" for scaling report, expected strong or weak")
+        self.kind = kind
+        self.mode = mode
+        self.max_procs_per_node = int(max_procs_per_node)
+
+    def efficiency(self, value, base_value, p):
+        "Parallel efficiency of value at relative process count p, against base_value"
+        ratio = base_value/value if self.kind == "runtime" else value/base_value
+        return ratio/p if self.mode == "strong" or self.kind == "throughput" else ratio
+
+    def report(self, table):
+        table = table.select(table.columns["metric"] == self.metric)
+        if not len(table):
+            raise Exception(f"No values for metric {self.metric} in the results table")
+        setting_keys = [k for k in table.key_columns() if k != self.key]
+        medians = table.aggregate(keys=setting_keys + [self.key])
+
+        columns = {k:[] for k in setting_keys + [self.key, "SBATCH_N", "domain", self.metric, "speedup",
+                                                 "efficiency", "karp_flatt", "step_efficiency", "node_efficiency"]}
+        settings = {}
+        for i in range(len(medians["count"])):
+            settings.setdefault(tuple(medians[k][i] for k in setting_keys), []).append(i)
+
+        for setting, rows in settings.items():
+            rows = sorted(rows, key=lambda i: medians[self.key][i])
+            n = np.array([medians[self.key][i] for i in rows], dtype=np.float64)
+            values = np.array([medians["median"][i] for i in rows])
+            nodes = np.ceil(n/self.max_procs_per_node).astype(np.int64)
+            p = n/n[0]
+            efficiency = np.array([self.efficiency(v, values[0], pi) for v, pi in zip(values, p)])
+            speedup = efficiency*p
+            with np.errstate(divide="ignore", invalid="ignore"):
+                karp_flatt = np.where(p > 1, (1/speedup - 1/p)/(1 - 1/p), np.nan)
+            step = [np.nan] + [self.efficiency(values[j], values[j-1], p[j]/p[j-1]) for j in range(1, len(rows))]
+            intra = nodes == 1
+            node_base = np.flatnonzero(intra)[-1] if intra.any() else 0
+            node = [np.nan if intra[j] else self.efficiency(values[j], values[node_base], p[j]/p[node_base]) for j in range(len(rows))]
+
+            for j, i in enumerate(rows):
+                for k, v in zip(setting_keys, setting):
+                    columns[k].append(v)
+                columns[self.key].append(int(n[j]))
+                columns["SBATCH_N"].append(int(nodes[j]))
+                columns["domain"].append("intra-node" if intra[j] else "inter-node")
+                columns[self.metric].append(values[j])
+                columns["speedup"].append(speedup[j])
+                columns["efficiency"].append(efficiency[j])
+                columns["karp_flatt"].append(karp_flatt[j])
+                columns["step_efficiency"].append(step[j])
+                columns["node_efficiency"].append(node[j])
+        self.results = columns
+        return columns
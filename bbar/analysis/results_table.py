@@ -0,0 +1,204 @@
+import os
+import json
+import hashlib
+
+from bbar.logging import debug, info, traced
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+results_table_path = ".bbar_results"
+#Version of the table layout, tables cached with another version are rebuilt
+results_table_version = 2
+#Columns that are not part of the parameter key of a row
+record_columns = ["source", "batchfile", "command", "repetition", "metric", "value"]
+default_percentiles = [5, 95]
+
+def require_numpy():
+    if np is None:
+        raise Exception("bbar analyze requires numpy, install it with: pip3 install --user numpy")
+
+class Results_Table:
+    """
+    Columnar table of numeric metric values, one row per extracted value, stored as NumPy arrays.
+
+    Besides the record columns, a row is keyed by the parameters Commands generates for it:
+    SBATCH_n, one column per environment variable and one per argument ("arguments[0]", ...).
+    Parameter columns other than SBATCH_n hold strings, "" where a command doesn't define the parameter.
+    """
+    def __init__(self, columns=None):
+        require_numpy()
+        self.columns = columns if columns is not None else Results_Table.empty_columns()
+
+    @staticmethod
+    def empty_columns():
+        return {
+            "source": np.array([], dtype=str),
+            "batchfile": np.array([], dtype=str),
+            "command": np.array([], dtype=np.int64),
+            "repetition": np.array([], dtype=np.int64),
+            "SBATCH_n": np.array([], dtype=np.int64),
+            "metric": np.array([], dtype=str),
+            "value": np.array([], dtype=np.float64),
+        }
+
+    @staticmethod
+    def from_records(records):
+        numeric = [r for r in records if isinstance(r.value, (int, float)) and not isinstance(r.value, bool)]
+        if len(numeric) < len(records):
+            debug(f"Leaving {len(records) - len(numeric)} non-numeric values out of the results table")
+        if not numeric:
+            return Results_Table()
+        columns = {
+            "source": np.array([r.source for r in numeric], dtype=str),
+            "batchfile": np.array([r.batchfile for r in numeric], dtype=str),
+            "command": np.array([r.command for r in numeric], dtype=np.int64),
+            "repetition": np.array([r.repetition for r in numeric], dtype=np.int64),
+            "SBATCH_n": np.array([r.n_procs for r in numeric], dtype=np.int64),
+            "metric": np.array([r.metric for r in numeric], dtype=str),
+            "value": np.array([r.value for r in numeric], dtype=np.float64),
+        }
+        for name in sorted({k for r in numeric for k in r.env_vars}):
+            columns[name] = np.array([str(r.env_vars.get(name, "")) for r in numeric], dtype=str)
+        for i in range(max(len(r.arguments) for r in numeric)):
+            columns[f"arguments[{i}]"] = np.array([str(r.arguments[i]) if i < len(r.arguments) else "" for r in numeric], dtype=str)
+        return Results_Table(columns)
+
+    def __len__(self):
+        return len(self.columns["value"])
+
+    def key_columns(self):
+        return [c for c in self.columns if c not in record_columns]
+
+    def select(self, mask):
+        return Results_Table({k:v[mask] for k,v in self.columns.items()})
+
+    def drop_sources(self, sources):
+        if not sources or not len(self):
+            return self
+        return self.select(~np.isin(self.columns["source"], list(sources)))
+
+    def concat(self, other):
+        if not len(other):
+            return self
+        if not len(self):
+            return other
+        columns = {}
+        for name in list(self.columns) + [c for c in other.columns if c not in self.columns]:
+            parts = [t.columns[name] if name in t.columns else np.full(len(t), "", dtype=str) for t in (self, other)]
+            columns[name] = np.concatenate(parts)
+        return Results_Table(columns)
+
+    def group_codes(self, keys):
+        "Returns (group index per row, index of one representative row per group)"
+        codes = np.stack([np.unique(self.columns[k], return_inverse=True)[1].ravel() for k in keys])
+        _, first, group = np.unique(codes, axis=1, return_index=True, return_inverse=True)
+        return group.ravel(), first
+
+    def aggregate(self, keys=None, percentiles=default_percentiles):
+        """
+        Vectorized grouped reduction of value over keys (default: all parameter columns and the metric).
+        Returns columns: keys, count, mean, median, std, min, max and p<x> for each percentile.
+        """
+        keys = keys if keys is not None else self.key_columns() + ["metric"]
+        if not len(self):
+            return {**{k:[] for k in keys}, "count":[], "mean":[], "median":[], "std":[], "min":[], "max":[]}
+        group, first = self.group_codes(keys)
+        values = self.columns["value"]
+        #Sort by group, then by value within a group, so order statistics are index arithmetic
+        order = np.lexsort((values, group))
+        v = values[order]
+        g = group[order]
+        starts = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+        counts = np.diff(np.r_[starts, len(v)])
+        means = np.add.reduceat(v, starts) / counts
+        squares = np.add.reduceat((v - np.repeat(means, counts))**2, starts)
+        std = np.sqrt(squares / np.maximum(counts - 1, 1))
+
+        def percentile(p):
+            position = starts + (counts - 1) * p / 100
+            low = np.floor(position).astype(np.int64)
+            high = np.ceil(position).astype(np.int64)
+            return v[low] + (v[high] - v[low]) * (position - low)
+
+        result = {k:self.columns[k][first] for k in keys}
+        result.update({
+            "count": counts,
+            "mean": means,
+            "median": percentile(50),
+            "std": std,
+            "min": v[starts],
+            "max": v[starts + counts - 1],
+        })
+        for p in percentiles:
+            result[f"p{p:g}"] = percentile(p)
+        return result
+
+    def save(self, path, fmt="npz"):
+        if fmt == "parquet":
+            pa, pq = import_pyarrow()
+            pq.write_table(pa.table({k:v for k,v in self.columns.items()}), f"{path}.parquet")
+        else:
+            with open(f"{path}.npz", "wb") as f:
+                np.savez(f, **self.columns)
+
+    @staticmethod
+    def load(path, fmt="npz"):
+        if fmt == "parquet":
+            pa, pq = import_pyarrow()
+            table = pq.read_table(f"{path}.parquet")
+            return Results_Table({k:np.asarray(v) for k,v in table.to_pydict().items()})
+        with np.load(f"{path}.npz") as data:
+            return Results_Table({k:data[k] for k in data.files})
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("[analysis] table_format = \"parquet\" requires pyarrow, install it with: pip3 install --user pyarrow")
+    return pyarrow, pyarrow.parquet
+
+def file_signature(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+@traced("update_results_table")
+def update_results_table(bbar_project, path=results_table_path):
+    """
+    Loads the results table cached next to the project state, and brings it up to date.
+    Only files that are new or whose (size, mtime) changed since the last analysis are extracted again.
+    The whole table is rebuilt if the metric declarations in the bbarfile have changed.
+    """
+    from bbar.analysis.extraction import Extraction_Engine
+    require_numpy()
+    fmt = bbar_project.bbarfile_data["analysis"]["table_format"]
+    engine = Extraction_Engine(bbar_project)
+    metrics_hash = hashlib.sha1(json.dumps(bbar_project.bbarfile_data["benchmarks"].get("metrics", {}), sort_keys=True).encode()).hexdigest()
+
+    manifest = {}
+    table = Results_Table()
+    table_file = f"{path}.{fmt}"
+    if os.path.isfile(f"{path}.json") and os.path.isfile(table_file):
+        with open(f"{path}.json") as f:
+            manifest = json.load(f)
+        if manifest.get("metrics") == metrics_hash and manifest.get("format") == fmt and manifest.get("version") == results_table_version:
+            table = Results_Table.load(path, fmt)
+        else:
+            info("Metric declarations or the results table layout have changed, re-extracting all results")
+            manifest = {}
+    old_files = manifest.get("files", {})
+
+    tasks = engine.file_tasks()
+    files = {task[0]:file_signature(task[0]) for task in tasks}
+    changed = [task for task in tasks if old_files.get(task[0]) != files[task[0]]]
+    stale = {task[0] for task in changed} | (set(old_files) - set(files)) | {""}
+    debug(f"{len(changed)} of {len(tasks)} result files have changed since the last analysis")
+
+    table = table.drop_sources(stale).concat(Results_Table.from_records(engine.extract(changed)))
+    table.save(path, fmt)
+    with open(f"{path}.json", "w") as f:
+        json.dump({"metrics": metrics_hash, "format": fmt, "version": results_table_version, "files": files}, f)
+    return table
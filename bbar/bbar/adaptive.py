@@ -0,0 +1,187 @@
+import copy
+import math
+
+from bbar.util.boolean_parse import human_to_bool
+
+inverse_golden_ratio = (math.sqrt(5) - 1) / 2
+search_methods = ["bisection", "golden", "halving"]
+
+#DOCUMENT: adaptive tuning of one benchmark parameter, configured in [adaptive]:
+#   parameter = name of an environment variable of the benchmarks, or "arguments[<i>]"
+#   metric    = name of a metric declared in [benchmarks.metrics]
+#   goal      = "min" | "max" (default "min")
+#   min, max  = range of the parameter, integers if both are integers
+#   log       = search the range on a log scale (default false)
+#   method    = "golden" (default) | "bisection" | "halving"
+#   points    = number of starting candidates for halving (default 8)
+#   rounds    = maximum number of rounds (default 8)
+#   Each round runs the candidate values as the settings of every benchmark, with job names suffixed by -r<round>.
+#   The objective of a value is the mean of all measurements of the metric with that value, over all rounds.
+class Adaptive_Search:
+    """
+    Search over the range of one parameter, in rounds. Positions are kept in [0, 1], mapped onto the parameter range.
+        bisection: runs the quarter points of the interval, and keeps the half with the better one
+        golden:    golden-section search, one new point per round after the first
+        halving:   successive halving, runs all alive candidates again and keeps the better half
+    The state is kept in the project store, so rounds can be advanced by separate bbar invocations.
+    """
+    def __init__(self, config, store):
+        for key in ["parameter", "metric", "min", "max"]:
+            if key not in config:
+                raise ValueError(f"[adaptive] needs {key}")
+        self.parameter = config["parameter"]
+        self.metric = config["metric"]
+        self.goal = config.get("goal", "min")
+        self.low = config["min"]
+        self.high = config["max"]
+        self.log = human_to_bool(config.get("log", False))
+        self.method = config.get("method", "golden")
+        self.points = int(config.get("points", 8))
+        self.rounds = int(config.get("rounds", 8))
+        self.integer = isinstance(self.low, int) and isinstance(self.high, int)
+        if self.goal not in ["min", "max"]:
+            raise ValueError(f"Unknown [adaptive] goal \"{self.goal}\", expected \"min\" or \"max\"")
+        if self.method not in search_methods:
+            raise ValueError(f"Unknown [adaptive] method \"{self.method}\", expected one of {', '.join(search_methods)}")
+        if self.log and (self.low <= 0 or self.high <= 0):
+            raise ValueError("[adaptive] log = true needs a positive min and max")
+        if self.method == "halving" and self.points < 2:
+            raise ValueError("[adaptive] method = \"halving\" needs at least 2 points")
+        self.store = store
+        self.state = store.get_adaptive() or self.initial_state()
+
+    def initial_state(self):
+        if self.method == "bisection":
+            state = {"a": 0.0, "b": 1.0}
+        elif self.method == "golden":
+            state = {"a": 0.0, "b": 1.0, "c": 1 - inverse_golden_ratio, "d": inverse_golden_ratio}
+        else:
+            state = {"alive": [i/(self.points-1) for i in range(self.points)]}
+        state.update({"round": 0, "done": False, "measurements": {}})
+        return state
+
+    def value(self, u):
+        if self.log:
+            v = self.low * (self.high/self.low)**u
+        else:
+            v = self.low + (self.high-self.low)*u
+        return int(round(v)) if self.integer else v
+
+    def measured(self, value):
+        return str(value) in self.state["measurements"]
+
+    def objective(self, value):
+        "Mean measurement of value, negated for goal = \"max\", so lower is always better"
+        samples = self.state["measurements"].get(str(value))
+        if not samples:
+            return math.inf
+        mean = sum(samples)/len(samples)
+        return mean if self.goal == "min" else -mean
+
+    def positions(self):
+        state = self.state
+        if self.method == "bisection":
+            width = state["b"] - state["a"]
+            return [state["a"] + width/4, state["a"] + 3*width/4]
+        if self.method == "golden":
+            return [state[k] for k in ("c", "d") if not self.measured(self.value(state[k]))]
+        return state["alive"]
+
+    def candidates(self):
+        "The parameter values to run in the current round"
+        if "candidates" in self.state:
+            return self.state["candidates"]
+        return sorted(set(self.value(u) for u in self.positions()))
+
+    def parameter_value(self, record):
+        if self.parameter.startswith("arguments["):
+            i = int(self.parameter[len("arguments["):-1])
+            return record.arguments[i] if i < len(record.arguments) else None
+        return record.env_vars.get(self.parameter)
+
+    def record(self, records):
+        "Adds the metric values of extracted records (see Extraction_Engine) to the measurements, returns how many were added"
+        added = 0
+        for record in records:
+            if record.metric != self.metric or isinstance(record.value, (str, bool)):
+                continue
+            value = self.parameter_value(record)
+            if value is None:
+                continue
+            self.state["measurements"].setdefault(str(value), []).append(float(record.value))
+            added += 1
+        return added
+
+    def step(self):
+        "Moves the search to the next round's positions"
+        state = self.state
+        f = lambda u: self.objective(self.value(u))
+        if self.method == "bisection":
+            q1, q3 = self.positions()
+            middle = (state["a"] + state["b"])/2
+            if f(q1) <= f(q3):
+                state["b"] = middle
+            else:
+                state["a"] = middle
+        elif self.method == "golden":
+            if f(state["c"]) <= f(state["d"]):
+                state["b"], state["d"] = state["d"], state["c"]
+                state["c"] = state["b"] - inverse_golden_ratio*(state["b"] - state["a"])
+            else:
+                state["a"], state["c"] = state["c"], state["d"]
+                state["d"] = state["a"] + inverse_golden_ratio*(state["b"] - state["a"])
+        else:
+            alive = sorted(state["alive"], key=f)
+            state["alive"] = sorted(alive[:math.ceil(len(alive)/2)])
+
+    def converged(self):
+        if self.method == "halving":
+            return len(set(self.candidates())) <= 1
+        #Integer ranges collapse: nothing new to measure
+        return all(self.measured(v) for v in self.candidates())
+
+    def advance(self, records):
+        """
+        Records the results of the current round, and moves to the next round.
+        Returns False if the search is done, in which case the positions stay those of the last round run.
+        """
+        if self.state["done"]:
+            return False
+        self.state["candidates"] = self.candidates()
+        if self.record(records) == 0:
+            raise ValueError(f"No values of metric {self.metric} found for {self.parameter} in round {self.state['round']}")
+        previous = copy.deepcopy(self.state)
+        self.step()
+        self.state["round"] += 1
+        self.state.pop("candidates", None)
+        if self.state["round"] >= self.rounds or self.converged():
+            self.state = previous
+            self.state["done"] = True
+        self.state["candidates"] = self.candidates()
+        self.store.set_adaptive(self.state)
+        return not self.state["done"]
+
+    def best(self):
+        "Returns the best measured (value, mean measurement)"
+        measurements = self.state["measurements"]
+        key = min(measurements, key=lambda v: self.objective(v))
+        samples = measurements[key]
+        return (int(key) if self.integer else float(key)), sum(samples)/len(samples)
+
+    def apply(self, config):
+        "Returns a copy of the bbarfile config that runs the candidates of the current round as the settings of every benchmark"
+        config = copy.deepcopy(config)
+        benchmarks = config["benchmarks"]
+        values = self.candidates()
+        if self.parameter.startswith("arguments["):
+            i = int(self.parameter[len("arguments["):-1])
+            if i >= len(benchmarks.get("arguments", [])):
+                raise ValueError(f"[adaptive] parameter {self.parameter} is not an argument of the benchmarks")
+            benchmarks["arguments"][i] = {"values": values}
+        else:
+            benchmarks.setdefault("env_vars", {})[self.parameter] = {"values": values}
+        benchmarks["num_settings"] = len(values)
+        benchmarks["sweep"] = "zip"
+        params = config["sbatch_params"]
+        params["job-name"] = f"{params['job-name']}-r{self.state['round']}"
+        return config
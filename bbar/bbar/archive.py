@@ -0,0 +1,244 @@
+import io
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import tarfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from bbar.logging import info, debug, traced
+from bbar.constants import archive_jobids_name
+
+#tarfile stream modes and file extensions of the supported archive formats
+archive_formats = {
+    "tar":   ("w|",   ".tar"),
+    "gztar": ("w|gz", ".tar.gz"),
+    "bztar": ("w|bz2", ".tar.bz2"),
+    "xztar": ("w|xz", ".tar.xz"),
+    "zstd":  ("w|",   ".tar.zst"),
+}
+
+class Parallel_Gzip_Writer(io.RawIOBase):
+    """
+    Writable stream that gzip-compresses fixed size chunks in a thread pool (zlib releases the GIL),
+    and writes them in order as concatenated gzip members. A multi-member gzip file is a valid gzip file,
+    readable by gzip, tar and tarfile, as produced by pigz.
+    """
+    def __init__(self, fileobj, threads, chunk_size=4<<20, level=6):
+        self.fileobj = fileobj
+        self.threads = threads
+        self.chunk_size = chunk_size
+        self.level = level
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self.submit(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def submit(self, chunk):
+        self.pending.append(self.pool.submit(gzip.compress, chunk, self.level, mtime=0))
+        #Bound the memory held by compressed chunks waiting to be written
+        while len(self.pending) > 2*self.threads:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+        self.pool.shutdown()
+        super().close()
+
+def compressed_stream(fmt, fileobj, threads):
+    "Wraps fileobj in a parallel compressor for formats that tarfile doesn't compress itself, returns None otherwise"
+    if fmt == "gztar" and threads > 1:
+        return Parallel_Gzip_Writer(fileobj, threads)
+    if fmt == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("[archive] format = \"zstd\" requires zstandard, install it with: pip3 install --user zstandard")
+        return zstandard.ZstdCompressor(threads=threads).stream_writer(fileobj, closefd=False)
+    return None
+
+def arcname(path):
+    "Paths inside the project directory are archived relative to it, others without their leading /"
+    relative = os.path.relpath(path)
+    return path.lstrip("/") if relative.startswith("..") else relative
+
+def archive_entries(bbar_project, skip=()):
+    """
+    Yields the files to archive: output files, batchfiles and the contents of every workdir, each once, except for
+    bbar's own files, the [archive] store and the paths in skip
+    """
+    excluded = bbar_project.own_paths()
+    seen = {os.path.realpath(path) for path in skip}
+    def new(path):
+        path = os.path.realpath(path)
+        if path in seen:
+            return False
+        seen.add(path)
+        return True
+
+    for batchfile in bbar_project.submissions:
+        if os.path.isfile(batchfile.filename) and new(batchfile.filename):
+            yield batchfile.filename
+    for output in bbar_project.state.get_output_files():
+        if os.path.isfile(output) and new(output):
+            yield output
+    for batchfile in bbar_project.batchfiles:
+        for wd in batchfile.commands.workdirs:
+            if not os.path.isdir(wd) or not new(wd):
+                continue
+            for root, dirs, files in os.walk(wd):
+                dirs[:] = sorted(d for d in dirs if not os.path.join(os.path.realpath(os.path.join(root, d)), "").startswith(excluded))
+                for f in sorted(files):
+                    path = os.path.join(root, f)
+                    if not os.path.realpath(path).startswith(excluded) and new(path):
+                        yield path
+
+def add_bytes(tar, name, data):
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.size = len(data)
+    tarinfo.mtime = int(time.time())
+    tar.addfile(tarinfo, io.BytesIO(data))
+
+@traced("write_archive")
+def write_archive(bbar_project, name, fmt, threads, bbarfile_name, bbarfile_contents):
+    """
+    Streams all archive entries of bbar_project straight into name+extension, without staging copies.
+    Returns the archive path.
+    """
+    if fmt not in archive_formats:
+        raise Exception(f"Unknown archive format \"{fmt}\", expected one of {', '.join(archive_formats)}")
+    mode, extension = archive_formats[fmt]
+    threads = threads or os.cpu_count()
+    path = f"{name}{extension}"
+    count = 0
+    with open(path, "wb") as f:
+        stream = compressed_stream(fmt, f, threads)
+        with tarfile.open(fileobj=stream or f, mode="w|" if stream else mode) as tar:
+            #The archive itself, and the bbarfile, which is added from memory
+            for entry in archive_entries(bbar_project, skip=[path, bbarfile_name]):
+                tar.add(entry, arcname=arcname(entry), recursive=False)
+                count += 1
+            add_bytes(tar, bbarfile_name, bbarfile_contents.encode())
+            add_bytes(tar, archive_jobids_name, json.dumps(bbar_project.state.get_jobids(), indent=1).encode())
+        if stream:
+            stream.close()
+    debug(f"Archived {count} files with {threads if stream else 1} compression thread(s)")
+    info(f"Wrote {path}")
+    return path
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1<<20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class Content_Store:
+    """
+    Content-addressed archive directory:
+        blobs/<2 hex digits>/<sha256>   every distinct file content, stored once
+        runs/<timestamp>.json           one manifest per archived run, mapping archive names to blob hashes,
+                                        with the job id of each batchfile
+        index.json                      (size, mtime, hash) of every path archived so far
+    A file whose size and mtime match the index is not read again.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "runs"), exist_ok=True)
+        self.index = {}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def blob_path(self, digest):
+        return os.path.join(self.directory, "blobs", digest[:2], digest)
+
+    def has_blob(self, digest):
+        return os.path.isfile(self.blob_path(digest))
+
+    def put_file(self, path, digest):
+        blob = self.blob_path(digest)
+        if os.path.isfile(blob):
+            return False
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp = f"{blob}.tmp{threading.get_ident()}"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, blob)
+        return True
+
+    def put_bytes(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self.blob_path(digest)
+        if not os.path.isfile(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            with open(blob, "wb") as f:
+                f.write(data)
+        return digest
+
+    def archive_file(self, path):
+        "Returns (manifest entry, whether the file was hashed, whether a new blob was stored)"
+        st = os.stat(path)
+        cached = self.index.get(path)
+        if cached and cached["size"] == st.st_size and cached["mtime"] == st.st_mtime_ns and self.has_blob(cached["hash"]):
+            return cached, False, False
+        digest = hash_file(path)
+        stored = self.put_file(path, digest)
+        return {"size": st.st_size, "mtime": st.st_mtime_ns, "hash": digest}, True, stored
+
+    def write_run(self, files, jobids):
+        name = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, "runs", f"{name}.json")
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, "runs", f"{name}-{suffix}.json")
+            suffix += 1
+        with open(path, "w") as f:
+            json.dump({"created": time.time(), "files": files, "jobids": jobids}, f, indent=1, sort_keys=True)
+        with open(self.index_path, "w") as f:
+            json.dump(self.index, f)
+        return path
+
+@traced("write_incremental_archive")
+def write_incremental_archive(bbar_project, directory, threads, bbarfile_name, bbarfile_contents):
+    """
+    Archives the same entries as write_archive into a Content_Store in directory.
+    Unchanged files (same size and mtime as in an earlier run) are neither read nor copied.
+    Returns the path of the run manifest.
+    """
+    store = Content_Store(directory)
+    threads = threads or os.cpu_count()
+    entries = list(archive_entries(bbar_project, skip=[bbarfile_name]))
+    files = {}
+    hashed = stored = 0
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for entry, (record, was_hashed, was_stored) in zip(entries, pool.map(store.archive_file, entries)):
+            store.index[entry] = record
+            files[arcname(entry)] = {"hash": record["hash"], "size": record["size"]}
+            hashed += was_hashed
+            stored += was_stored
+    data = bbarfile_contents.encode()
+    files[bbarfile_name] = {"hash": store.put_bytes(data), "size": len(data)}
+    path = store.write_run(files, bbar_project.state.get_jobids())
+    info(f"Archived {len(entries)} files to {path}: {len(entries) - hashed} unchanged, {hashed} hashed, {stored} new blobs")
+    return path
@@ -1,72 +1,276 @@
 import os
-import toml
-import shutil
-import tempfile
+import re
 
-from pathlib import Path
-
-from bbar.persistence import BBAR_Store
+from bbar.persistence import open_store
+from bbar.persistence.bbar_store import bbar_default_storage_path
 from bbar.constants import default_bbarfile_name, BBAR_SUCCESS, BBAR_FAILURE
-from bbar.logging import error, warning, info, debug
+from bbar.logging import error, warning, info, debug, diagnostics, traced, count
 from bbar.scheduler.plugins import get as get_scheduler
+from bbar.scheduler.base import finished_states
+
+from .result_scanner import Result_Scanner
+from .adaptive import Adaptive_Search
+from .history import Runtime_History, apply_plan
+from .completion import command_statuses, resume_config
 
 from bbar.util.generators import scale_up_generator
 from bbar.util.prompts import yesno_prompt
 from bbar.util.boolean_parse import human_to_bool
 
+#Output patterns with a job id are written to a file per job
+job_output_regex = re.compile(r"%\d*[AjJ]")
+
+def check_names(batchfiles, submissions):
+    "Raises a ValueError if two batchfiles would be written to the same file, or write their output to the same file"
+    describe = lambda b: f"{b.jobname} (n = {b.n_procs})" if hasattr(b, "n_procs") else b.jobname
+    filenames = {}
+    outputs = {}
+    for batchfile in {id(b):b for b in batchfiles + submissions}.values():
+        if batchfile.filename in filenames:
+            raise ValueError(f"Batch files of {describe(filenames[batchfile.filename])} and {describe(batchfile)} would both be written to {batchfile.filename}, make batchfile_name depend on the job name and process count")
+        filenames[batchfile.filename] = batchfile
+        if getattr(batchfile, "tasks", None) or job_output_regex.search(batchfile.output):
+            continue
+        if batchfile.output in outputs:
+            raise ValueError(f"Batch files of {describe(outputs[batchfile.output])} and {describe(batchfile)} would both write their output to {batchfile.output}, make output depend on the job name and process count")
+        outputs[batchfile.output] = batchfile
+
 class BBAR_Project:
     "BBAR_Project is a control object that captures all model data and ties actions to those data"
-    def __init__(self, bbarfile_data, bbarfile_path=None):
+    def __init__(self, bbarfile_data, bbarfile_path=None, read_only=False):
         self.initialized = False
 
         self.bbarfile_data = bbarfile_data
-        self.state = BBAR_Store()
+        self.state = open_store(bbarfile_data["persistence"], read_only)
         self.scheduler_name = bbarfile_data["scheduler"]
         self.scheduler = get_scheduler(self.scheduler_name)
-        
-        self.batchfiles = [self.scheduler.Batchfile(bbarfile_data, n_procs)  for n_procs in scale_up_generator(bbarfile_data["scaleup"])]
 
-        #TODO: read archive name from bbarfile
-        self.archive_name = "bbar"
+        self.adaptive = None
+        if "adaptive" in bbarfile_data:
+            self.adaptive = Adaptive_Search(bbarfile_data["adaptive"], self.state)
+        self.history = None
+        if human_to_bool(bbarfile_data["history"]["enabled"]):
+            self.history = Runtime_History(bbarfile_data["history"])
+        self.build_batchfiles()
+
+        self.archive_name = bbarfile_data["archive"]["name"]
+        self.archive_format = bbarfile_data["archive"]["format"]
         self.initialized = True
  
     def __repr__(self):
+        import toml
         return toml.dumps(self.bbarfile_data)
 
+    def own_paths(self):
+        """
+        Real paths of bbar's own files, which also prefix their journal, WAL and temporary files,
+        and of the [archive] store directory
+        """
+        from .snapshot import snapshot_path
+        paths = [os.path.realpath(p) for p in (bbar_default_storage_path, self.state.storage_path, snapshot_path)]
+        if "history" in self.bbarfile_data:
+            paths.append(os.path.realpath(self.bbarfile_data["history"]["path"]))
+        if "archive" in self.bbarfile_data:
+            paths.append(os.path.join(os.path.realpath(self.bbarfile_data["archive"]["store"]), ""))
+        return tuple(paths)
+
+    @traced("build_batchfiles")
+    def build_batchfiles(self):
+        "Expands the configuration into batchfiles, for the current round of the adaptive search if there is one"
+        config = self.adaptive.apply(self.bbarfile_data) if self.adaptive else self.bbarfile_data
+        self.batchfiles = [self.scheduler.Batchfile(config, n_procs)  for n_procs in scale_up_generator(config["scaleup"])]
+        if self.history:
+            self.batchfiles = self.plan_batchfiles(config, self.batchfiles)
+        for batchfile in self.batchfiles:
+            batchfile.origin = batchfile.filename
+        resumed = self.resume_batchfiles(config, self.batchfiles)
+        for batchfile in self.batchfiles + resumed:
+            batchfile.attach_store(self.state)
+
+        #Submission units, either the batchfiles themselves or a single array batchfile running all of them
+        self.submissions = self.batchfiles
+        submission_mode = config["submission"]["mode"]
+        if submission_mode == "array":
+            self.submissions = self.array_submissions(config)
+        elif submission_mode != "separate":
+            raise Exception(f"Unknown submission mode \"{submission_mode}\", expected \"separate\" or \"array\"")
+        #Resubmitted commands always run in batchfiles of their own
+        self.batchfiles = self.batchfiles + resumed
+        self.submissions = self.submissions + resumed
+        check_names(self.batchfiles, self.submissions)
+
+    def resume_batchfiles(self, config, batchfiles):
+        "Batchfiles of the commands resubmitted by each bbar run --resume so far, see resume"
+        by_name = {b.filename:b for b in batchfiles}
+        resumed = []
+        for attempt, commands in enumerate(self.state.get_resumes(), 1):
+            for filename, indices in commands.items():
+                if filename not in by_name:
+                    continue
+                origin = by_name[filename]
+                batchfile = type(origin)(resume_config(config, origin, indices, attempt), origin.n_procs)
+                batchfile.add_suffix(f"-retry{attempt}")
+                batchfile.origin = filename
+                batchfile.attempt = attempt
+                resumed.append(batchfile)
+        return resumed
+
+    def plan_batchfiles(self, config, batchfiles):
+        """
+        Sets the --time of batchfiles from the runtime history, and shards those that would exceed the time limit.
+        The plan is made when the batchfiles are first generated, and kept in the store until they are purged.
+        """
+        plans = self.state.get_history_plan()
+        planned = []
+        for batchfile in batchfiles:
+            if batchfile.filename not in plans:
+                plans[batchfile.filename] = self.history.plan(batchfile, batchfile.n_procs)
+            plan = plans[batchfile.filename]
+            planned += apply_plan(batchfile, config, batchfile.n_procs, plan) if plan else [batchfile]
+        self.history_plan = plans
+        return planned
+
+    def record_runtimes(self):
+        "Adds the runtimes of the completed commands of finished jobs that haven't been recorded yet to the runtime history"
+        from bbar.analysis.extraction import latest
+        if self.history is None:
+            return
+        stats = self.get_job_stats()
+        recorded = 0
+        with self.state.transaction():
+            for batchfile in self.batchfiles:
+                record = stats.get(batchfile.filename)
+                if record is None or record["state"] not in finished_states:
+                    continue
+                #After a resume, the jobs of earlier attempts finish again
+                jobid = batchfile.get_jobid() or batchfile.filename
+                if self.state.is_recorded_job(jobid):
+                    continue
+                output = latest(batchfile.get_output())
+                statuses = command_statuses(output, len(batchfile.commands.commands), record["state"])
+                self.history.record(batchfile, record, output, statuses)
+                self.state.add_recorded_job(jobid)
+                recorded += 1
+        self.history.save()
+        debug(f"Recorded the runtimes of {recorded} batchfile(s) in {self.history.path}")
+
+    def command_results(self):
+        """
+        Status of every command of the project, completed, failed or missing, keyed by the batchfile it was first
+        generated in and its index there. A command counts as completed if any of its submissions completed it.
+        """
+        from bbar.analysis.extraction import latest
+        stats = self.get_job_stats()
+        results = {}
+        for batchfile in self.batchfiles:
+            commands = batchfile.commands
+            record = stats.get(batchfile.filename, {})
+            output = latest(batchfile.get_output()) if record else None
+            for i, status in zip(commands.indices, command_statuses(output, len(commands.indices), record.get("state"))):
+                key = (batchfile.origin, i)
+                if results.get(key) != "completed" and (status != "missing" or key not in results):
+                    results[key] = status
+        return results
+
+    def incomplete_commands(self):
+        "The failed and missing commands, as {batchfile: [command indices]}"
+        incomplete = {}
+        for (filename, i), status in self.command_results().items():
+            if status != "completed":
+                incomplete.setdefault(filename, []).append(i)
+        return incomplete
+
+    def list_commands(self):
+        results = list(self.command_results().values())
+        if results:
+            print(f"\nCommands: {results.count('completed')} completed, {results.count('failed')} failed, {results.count('missing')} missing")
+
+    @traced("resume")
+    def resume(self, interactive=False, **kwargs):
+        "called by run --resume when the project is partially completed, submits the failed and missing commands again"
+        incomplete = self.incomplete_commands()
+        if not incomplete:
+            info("All commands have completed, nothing to resume")
+            return BBAR_FAILURE
+        resumes = self.state.get_resumes()
+        attempt = len(resumes) + 1
+        self.state.set_resumes(resumes + [incomplete])
+        try:
+            self.build_batchfiles()
+        except ValueError as e:
+            error(str(e))
+            self.state.set_resumes(resumes)
+            self.build_batchfiles()
+            return BBAR_FAILURE
+        resumed = [b for b in self.batchfiles if getattr(b, "attempt", 0) == attempt]
+        info(f"Resubmitting {sum(len(c) for c in incomplete.values())} command(s) in {len(resumed)} batchfile(s)")
+        if self.create_batchfiles(interactive, resumed) == BBAR_SUCCESS and self.run_batchfiles(resumed) == BBAR_SUCCESS:
+            return BBAR_SUCCESS
+        #Forget the attempt, so the commands are resubmitted by the next bbar run --resume
+        self.state.set_resumes(resumes)
+        self.build_batchfiles()
+        return BBAR_FAILURE
+
+    def array_submissions(self, config):
+        ArrayBatchfile = self.scheduler.ArrayBatchfile
+        if ArrayBatchfile is None:
+            warning(f"Scheduler {self.scheduler_name} doesn't support array jobs, submitting batchfiles separately")
+            return self.batchfiles
+        differing = ArrayBatchfile.incompatible_params(self.batchfiles)
+        if differing:
+            warning(f"Can't submit scale points as an array job, they differ in {', '.join(differing)}. Submitting batchfiles separately")
+            return self.batchfiles
+        array_batchfile = ArrayBatchfile(config, self.batchfiles)
+        array_batchfile.attach_store(self.state)
+        return [array_batchfile]
+
+    @traced("create_directories")
     def create_directories(self):
-        for batch_cfg in self.batchfiles:
-            for wd in batch_cfg.commands.workdirs:
-                try:
-                    path = Path(wd).relative_to(Path('.').resolve())
-                except:
-                    path = Path(wd)
+        from pathlib import Path
+        with self.state.transaction():
+            for batch_cfg in self.batchfiles:
+                for wd in batch_cfg.commands.workdirs:
+                    try:
+                        path = Path(wd).relative_to(Path('.').resolve())
+                    except:
+                        path = Path(wd)
                 
-                for p in reversed(path.parents):
-                    if not p.exists():
-                        self.state.add_generated_dir(str(p.resolve()))
-                        os.mkdir(p)
+                    for p in reversed(path.parents):
+                        if not p.exists():
+                            self.state.add_generated_dir(str(p.resolve()))
+                            os.mkdir(p)
+                            count("directories created")
                 
-                if not path.exists():
-                    self.state.add_generated_dir(str(path.resolve()))
-                    os.mkdir(path)
-                #os.makedirs(wd,exist_ok=True)
+                    if not path.exists():
+                        self.state.add_generated_dir(str(path.resolve()))
+                        os.mkdir(path)
+                        count("directories created")
+                    #os.makedirs(wd,exist_ok=True)
         
     #Currently, no distinction between failing generation after generating some files, and no files
     #Weird state if only some created: should be special garbage state, or automatically rolled back
-    def create_batchfiles(self, interactive=False):
-        for batchfile in self.batchfiles:
-            if interactive and os.path.isfile(batchfile.filename):
-                if not yesno_prompt("Generated batchfiles will overwrite old ones, is this ok?"):
-                    return BBAR_FAILURE
-                else:
-                    interactive=False
-            self.state.add_generated_batchfile(batchfile.filename)
-            with open(batchfile.filename,"w") as f:
-                f.write(str(batchfile))
-        return BBAR_SUCCESS
+    @traced("create_batchfiles")
+    def create_batchfiles(self, interactive=False, batchfiles=None):
+        "Writes batchfiles, all submissions by default"
+        batchfiles = self.submissions if batchfiles is None else batchfiles
+        with self.state.transaction():
+            if self.history:
+                self.state.set_history_plan(self.history_plan)
+            for batchfile in batchfiles:
+                if interactive and os.path.isfile(batchfile.filename):
+                    if not yesno_prompt("Generated batchfiles will overwrite old ones, is this ok?"):
+                        return BBAR_FAILURE
+                    else:
+                        interactive=False
+                self.state.add_generated_batchfile(batchfile.filename)
+                with open(batchfile.filename,"w") as f:
+                    f.write(str(batchfile))
+                count("files written")
+            return BBAR_SUCCESS
          
     #MAYBE: rewrite to ask if there are outputs in the dirs
     def delete_directories(self):
+        import shutil
         for d in self.state.get_generated_dirs():
             if os.path.exists(d):
                 shutil.rmtree(d)
@@ -115,58 +319,190 @@ class BBAR_Project:
             print("\nDetected output files:")
             for o in outputs:
                 print("\t",o)
+        workdir_files = self.state.get_workdir_files()
+        if workdir_files:
+            print("\nDetected files in work dirs:")
+            for f in workdir_files:
+                print("\t",f)
+
+    def get_job_stats(self):
+        "Returns the scheduler's record of each submitted batchfile, keyed by batchfile name"
+        if self.scheduler.get_stats is None:
+            return {}
+        return self.scheduler.get_stats(self.batchfiles, self.state, self.bbarfile_data)
+
+    def jobs_finished(self):
+        stats = self.get_job_stats()
+        return all(b.filename in stats and stats[b.filename]["state"] in finished_states for b in self.batchfiles)
+
+    def list_jobs(self):
+        stats = self.get_job_stats()
+        queued = self.state.get_submission_queue()
+        if stats or queued:
+            print("\nJobs:")
+            for batchfile in self.batchfiles:
+                if batchfile.filename in stats:
+                    record = stats[batchfile.filename]
+                    print("\t", batchfile.filename, batchfile.get_jobid() or "", record["state"], record.get("elapsed", ""))
+            for filename in queued:
+                print("\t", filename, "queued by bbar")
 
     def list_files(self):
         "called by the list query command"
         self.list_generated_files()
         self.list_output()
         
-    def run_batchfiles(self, **kwargs):
-        "called by the run command"
+    @traced("run_batchfiles")
+    def run_batchfiles(self, submissions=None, **kwargs):
+        "called by the run command, submits all submissions by default"
         info(f"Using scheduler {self.scheduler_name}")
+        submissions = self.submissions if submissions is None else submissions
 
-        for batchfile in self.batchfiles:
-            filename = batchfile.filename
-            if os.path.exists(filename):
-                try:
-                    self.scheduler.schedule_job(batchfile)
-                except BaseException as e:
-                    error(f"Exception in scheduler {self.scheduler}, calling schedule_job('{filename}'):\n\t{e}\n")
-                    #TODO: cancel existing jobs
-                    return BBAR_FAILURE
-            else:
-                error(f"Batch file {filename} doesn't exist")
-                #TODO: cancel existing jobs
+        for batchfile in submissions:
+            if not os.path.exists(batchfile.filename):
+                error(f"Batch file {batchfile.filename} doesn't exist")
                 return BBAR_FAILURE
+
+        if self.scheduler.run_jobs is not None:
+            return self.scheduler.run_jobs(submissions, self.state, self.bbarfile_data)
+
+        max_in_flight = int(self.bbarfile_data["submission"]["max_in_flight"])
+        if max_in_flight <= 0 or len(submissions) <= 1:
+            return self.submit(submissions)
+        slots = max(0, max_in_flight - self.in_flight())
+        queued = submissions[slots:]
+        if self.submit(submissions[:slots]) == BBAR_FAILURE:
+            return BBAR_FAILURE
+        if queued:
+            self.state.set_submission_queue(self.state.get_submission_queue() + [b.filename for b in queued])
+            info(f"{len(queued)} batch file(s) are queued until earlier jobs finish, run \"bbar pump\" to submit them")
         return BBAR_SUCCESS
 
-    def archive_output(self, **kwargs):
-        "called by the archive command"
-        archive_name = self.archive_name
-        with tempfile.TemporaryDirectory() as tmpdir:
-            for batch_cfg in self.batchfiles:
-                for wd in batch_cfg.commands.workdirs:
+    def submit(self, submissions):
+        "Submits batchfiles to the scheduler, and cancels them all again if any submission fails"
+        from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
+        if not submissions:
+            return BBAR_SUCCESS
+        workers = 1
+        if self.scheduler.concurrent_submission:
+            workers = max(1, int(self.bbarfile_data["submission"]["workers"]))
+        debug(f"Submitting {len(submissions)} batch files with {workers} worker(s)")
+
+        submitted = []
+        failed = False
+        with self.state.transaction():
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(self.scheduler.schedule_job, batchfile):batchfile for batchfile in submissions}
+                for future in as_completed(futures):
+                    batchfile = futures[future]
                     try:
-                        path = Path(wd).relative_to(Path('.').resolve())
-                    except:
-                        path = Path(wd)
-                    tmpwd = str(Path(tmpdir)/wd)
-
-                    os.makedirs(tmpwd, exist_ok=True)
-                    for f in os.listdir(wd):
-                        shutil.copy(Path(wd)/f, tmpwd)
-                with open(Path(tmpdir)/default_bbarfile_name, "w") as f:
-                    toml.dump(self.bbarfile_data,f)
-                shutil.make_archive(archive_name,'gztar', tmpdir)
-                
+                        jobid = future.result()
+                    except CancelledError:
+                        continue
+                    except BaseException as e:
+                        error(f"Exception in scheduler {self.scheduler}, calling schedule_job('{batchfile.filename}'):\n\t{e}\n")
+                        failed = True
+                        for f in futures:
+                            f.cancel()
+                        continue
+                    if jobid is not None:
+                        debug(f"Submitted {batchfile.filename} as job {jobid}")
+                        batchfile.set_jobid(jobid)
+                    submitted.append(batchfile)
 
+        if failed:
+            self.cancel_jobs(submitted)
+            return BBAR_FAILURE
+        return BBAR_SUCCESS
+
+    def in_flight(self):
+        "Number of submitted jobs that haven't finished"
+        stats = self.get_job_stats()
+        return sum(1 for b in self.submissions if b.get_jobid() is not None
+                   and (b.filename not in stats or stats[b.filename]["state"] not in finished_states))
+
+    @traced("pump")
+    def pump(self, **kwargs):
+        "called by the pump command, submits queued batchfiles as long as fewer than max_in_flight jobs are in flight"
+        queue = self.state.get_submission_queue()
+        if not queue:
+            info("No batch files are queued")
+            return BBAR_SUCCESS
+        max_in_flight = int(self.bbarfile_data["submission"]["max_in_flight"])
+        slots = max(0, max_in_flight - self.in_flight()) if max_in_flight > 0 else len(queue)
+        if slots == 0:
+            debug(f"{max_in_flight} jobs in flight, {len(queue)} batch file(s) still queued")
+            return BBAR_SUCCESS
+        by_name = {b.filename:b for b in self.submissions}
+        if self.submit([by_name[f] for f in queue[:slots] if f in by_name]) == BBAR_FAILURE:
+            return BBAR_FAILURE
+        self.state.set_submission_queue(queue[slots:])
+        info(f"Submitted {len(queue[:slots])} batch file(s), {len(queue[slots:])} still queued")
+        return BBAR_SUCCESS
+
+    @traced("refine")
+    def refine(self, **kwargs):
+        "called by run --adaptive when a round has completed, generates the next round. Fails when the search is done"
+        from bbar.analysis.extraction import Extraction_Engine
+        if self.adaptive is None:
+            error("bbar run --adaptive needs an [adaptive] table in the bbarfile")
+            return BBAR_FAILURE
+        records = Extraction_Engine(self).extract()
+        try:
+            more = self.adaptive.advance(records)
+        except ValueError as e:
+            error(str(e))
+            return BBAR_FAILURE
+        value, mean = self.adaptive.best()
+        if not more:
+            info(f"Adaptive search done after {self.adaptive.state['round']+1} round(s), best {self.adaptive.parameter} = {value} ({self.adaptive.metric} = {mean:.6g})")
+            return BBAR_FAILURE
+        info(f"Best {self.adaptive.parameter} so far: {value} ({self.adaptive.metric} = {mean:.6g})")
+        #Retries of the last round's commands don't carry over to the next round
+        self.state.set_resumes([])
+        self.build_batchfiles()
+        info(f"Round {self.adaptive.state['round']}: {self.adaptive.parameter} = {', '.join(str(v) for v in self.adaptive.candidates())}")
+        return self.generate_files(**kwargs)
+
+    def cancel_jobs(self, batchfiles=None):
+        """
+        Cancels the jobs of already submitted batchfiles. By default, cancels all submissions and empties the
+        submission queue, called by the cancel command
+        """
+        status = BBAR_SUCCESS
+        with self.state.transaction():
+            if batchfiles is None:
+                batchfiles = self.submissions
+                self.state.set_submission_queue([])
+            for batchfile in batchfiles:
+                jobid = batchfile.get_jobid()
+                if jobid is None:
+                    continue
+                info(f"Cancelling job {jobid} ({batchfile.filename})")
+                try:
+                    self.scheduler.cancel_job(jobid)
+                except BaseException as e:
+                    error(f"Exception in scheduler {self.scheduler}, calling cancel_job('{jobid}'):\n\t{e}\n")
+                    status = BBAR_FAILURE
+                    continue
+                batchfile.clear_jobid()
+        return status
+
+    @traced("archive_output")
+    def archive_output(self, incremental=False, **kwargs):
+        "called by the archive command"
+        import toml
+        from .archive import write_archive, write_incremental_archive
+        threads = int(self.bbarfile_data["archive"]["threads"])
+        if incremental:
+            return write_incremental_archive(self, self.bbarfile_data["archive"]["store"], threads,
+                                             default_bbarfile_name, toml.dumps(self.bbarfile_data))
+        return write_archive(self, self.archive_name, self.archive_format, threads,
+                             default_bbarfile_name, toml.dumps(self.bbarfile_data))
+
+    @traced("scan_for_results")
     def scan_for_results(self):
-        for batchfile in self.batchfiles:
-            output_file = batchfile.output
-            #TODO: match SLURM patterns
-            #REQUIRES: capture SLURM job ids and other SLURM parameters that could be part of this
-            #job id should be enough, the rest can be acquired through sstat
-            if os.path.isfile(output_file):
-                self.state.add_output_file(output_file)
-            #for workdir in batchfile.commands.workdirs:
-            #    #TODO: check contents of workdir, needed for programs that generate files as output
+        scanner = Result_Scanner(self.state, self.own_paths())
+        scanner.scan(self.batchfiles)
+        diagnostics(f"Scan took {scanner.stat_calls} stat calls")
+        count("stat calls", scanner.stat_calls)
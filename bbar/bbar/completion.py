@@ -0,0 +1,44 @@
+import re
+import copy
+
+from bbar.constants import command_marker, step_marker
+
+#DOCUMENT: per-command completion. Every command line of a generated batchfile ends by printing
+#   "BBAR_STEP <i> exit_code=<code>", so the status of each command can be read from the output of its job:
+#       completed = exited with 0
+#       failed    = exited with another code, or started without printing its exit code (the job was killed)
+#       missing   = never started, e.g. the job timed out or was cancelled before reaching it
+#   Jobs without an output, or outputs without any exit codes (batchfiles generated by older versions of bbar),
+#   fall back on the job state.
+#   When some commands of a finished project didn't complete, the project is partially completed, and
+#   bbar run --resume generates and submits batchfiles of only those commands, with job names, batchfiles and
+#   outputs suffixed by -retry<k>.
+completion_regex = re.compile(rf"^(?:{command_marker} (\d+)|{step_marker} (\d+) exit_code=(\d+))$", re.MULTILINE)
+
+def command_statuses(path, num_commands, job_state=None):
+    "Status of each command of a batchfile from the output at path (None if there is none), and the state of its job"
+    if path is None:
+        return ["completed" if job_state == "COMPLETED" else "missing"]*num_commands
+    statuses = ["missing"]*num_commands
+    with open(path, errors="replace") as f:
+        data = f.read()
+    exit_codes = False
+    for m in completion_regex.finditer(data):
+        if m.group(1) is not None:
+            i, status = int(m.group(1)), "failed"
+        else:
+            i, status = int(m.group(2)), "completed" if int(m.group(3)) == 0 else "failed"
+            exit_codes = True
+        if i < num_commands:
+            statuses[i] = status
+    if not exit_codes and job_state == "COMPLETED":
+        return ["completed"]*num_commands
+    return statuses
+
+def resume_config(config, batchfile, indices, attempt):
+    "Returns a copy of the bbarfile config that runs only the commands with indices of batchfile"
+    config = copy.deepcopy(config)
+    config["benchmarks"].pop("shard", None)
+    config["benchmarks"]["select"] = list(indices)
+    config["sbatch_params"]["job-name"] = f"{batchfile.jobname}-retry{attempt}"
+    return config
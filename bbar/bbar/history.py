@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import math
+import copy
+
+from bbar.constants import command_marker, time_marker
+from bbar.logging import debug, info, warning
+
+#DOCUMENT: runtime history, configured in [history]:
+#   enabled   = record the runtime of every command of completed jobs, and predict the --time of SLURM batchfiles
+#   path      = file the history is kept in, it survives bbar purge
+#   samples   = runtimes kept per command, the prediction uses the longest of them
+#   margin    = factor the predicted runtime of a batchfile is multiplied by
+#   overhead  = seconds added to the predicted runtime of a batchfile
+#   max_time  = time limit of the partition, e.g. "24:00:00". Batchfiles predicted to take longer are split into shards,
+#               with job names, batch files and outputs suffixed by -s<shard>. "" means no limit.
+#   Commands are timed by timestamps printed around each command (and each step of packed batchfiles). Without them,
+#   the elapsed time of a completed job is split evenly over its commands, times the steps that ran at once.
+#   Only commands that completed are recorded, also from jobs that failed. Commands without history leave the
+#   configured --time as it is.
+
+slurm_time_regex = re.compile(r"^(?:(\d+)-)?(\d+)(?::(\d+))?(?::(\d+))?$")
+
+def parse_slurm_time(text):
+    "Seconds of a SLURM time: minutes, minutes:seconds, hours:minutes:seconds, days-hours[:minutes[:seconds]]"
+    m = slurm_time_regex.match(str(text).strip())
+    if not m:
+        return None
+    days, a, b, c = m.groups()
+    if days is not None:
+        return int(days)*86400 + int(a)*3600 + int(b or 0)*60 + int(c or 0)
+    if c is not None:
+        return int(a)*3600 + int(b)*60 + int(c)
+    if b is not None:
+        return int(a)*60 + int(b)
+    return int(a)*60
+
+def format_slurm_time(seconds):
+    "Formats seconds as a SLURM time, rounded up to whole minutes"
+    minutes = max(1, math.ceil(seconds/60))
+    days, minutes = divmod(minutes, 1440)
+    hours, minutes = divmod(minutes, 60)
+    return f"{days}-{hours:02}:{minutes:02}:00" if days else f"{hours:02}:{minutes:02}:00"
+
+def job_seconds(record):
+    "Runtime of a job, from a LOCAL job result or a sacct record"
+    if "wall_time" in record:
+        return float(record["wall_time"])
+    return parse_slurm_time(record.get("elapsed", ""))
+
+timestamp_regex = re.compile(rf"^(?:{command_marker} (\d+)|{time_marker} ([0-9.]+))$", re.MULTILINE)
+
+def command_times(path, num_commands):
+    "Runtime of each command from the timestamps in the output at path, None if a command wasn't timed"
+    with open(path, errors="replace") as f:
+        data = f.read()
+    times = [None]*num_commands
+    last_time = None
+    current = None
+    for m in timestamp_regex.finditer(data):
+        if m.group(1) is not None:
+            current = int(m.group(1))
+            continue
+        t = float(m.group(2))
+        if current is not None and last_time is not None and current < num_commands:
+            times[current] = t - last_time
+        last_time, current = t, None
+    return times
+
+class Runtime_History:
+    """
+    Runtimes of commands from earlier runs, keyed by command, process count, environment variables and arguments.
+    """
+    def __init__(self, config):
+        self.path = config["path"]
+        self.samples = int(config["samples"])
+        self.margin = float(config["margin"])
+        self.overhead = float(config["overhead"])
+        self.max_time = parse_slurm_time(config["max_time"]) if config["max_time"] else None
+        if config["max_time"] and self.max_time is None:
+            raise ValueError(f"[history] max_time = \"{config['max_time']}\" is not a SLURM time")
+        self.runtimes = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                self.runtimes = json.load(f)
+
+    def key(self, n_procs, command):
+        return json.dumps([str(command.command), n_procs, command.env_vars.var_dict, command.arguments], default=str)
+
+    def add(self, n_procs, command, seconds):
+        runtimes = self.runtimes.setdefault(self.key(n_procs, command), [])
+        runtimes.append(round(seconds, 3))
+        del runtimes[:-self.samples]
+
+    def estimate(self, n_procs, command):
+        runtimes = self.runtimes.get(self.key(n_procs, command))
+        return max(runtimes) if runtimes else None
+
+    def record(self, batchfile, job_record, output, statuses):
+        """
+        Adds the runtimes of the completed commands of a finished batchfile, from timestamps in output, or if it
+        completed without them, the job's elapsed time
+        """
+        commands = batchfile.commands
+        times = command_times(output, len(commands.commands)) if output else [None]*len(commands.commands)
+        if None in times and job_record["state"] == "COMPLETED":
+            elapsed = job_seconds(job_record)
+            if elapsed is None:
+                return
+            parallel = min(commands.max_steps, len(commands.commands)) if getattr(commands, "step_ranks", 0) else 1
+            times = [t if t is not None else elapsed*parallel/len(commands.commands) for t in times]
+        for command, seconds, status in zip(commands.commands, times, statuses):
+            if seconds is not None and status == "completed":
+                self.add(batchfile.n_procs, command, seconds)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.runtimes, f)
+        os.replace(tmp_path, self.path)
+
+    def predict(self, estimates, parallel=1):
+        return sum(estimates)/parallel*self.margin + self.overhead
+
+    def shards(self, estimates, parallel=1):
+        "Splits the commands into consecutive (start, stop) ranges that are each predicted to fit in max_time"
+        if self.max_time is None or self.predict(estimates, parallel) <= self.max_time:
+            return [(0, len(estimates))]
+        shards = []
+        start = 0
+        for i in range(1, len(estimates)+1):
+            if i - start > 1 and self.predict(estimates[start:i], parallel) > self.max_time:
+                shards.append((start, i-1))
+                start = i-1
+        shards.append((start, len(estimates)))
+        return shards
+
+    def plan(self, batchfile, n_procs):
+        """
+        Returns the shards of a SLURM batchfile as {start, stop, time} tables, a single one if it fits in max_time,
+        or [] if there is no history for all of its commands.
+        """
+        if not hasattr(batchfile, "sbatch_params"):
+            return []
+        commands = batchfile.commands
+        estimates = [self.estimate(n_procs, c) for c in commands.commands]
+        if not estimates or None in estimates:
+            debug(f"No runtime history for all commands of {batchfile.filename}, keeping the configured time")
+            return []
+        parallel = commands.max_steps if getattr(commands, "step_ranks", 0) else 1
+        shards = self.shards(estimates, parallel)
+        if len(shards) > 1:
+            info(f"{batchfile.filename} is predicted to take longer than [history] max_time, splitting it into {len(shards)} shards")
+        plan = []
+        for start, stop in shards:
+            seconds = self.predict(estimates[start:stop], parallel)
+            if self.max_time is not None and seconds > self.max_time:
+                warning(f"A single command of {batchfile.filename} is predicted to take longer than [history] max_time")
+            plan.append({"start": start, "stop": stop, "time": format_slurm_time(seconds)})
+        return plan
+
+def apply_plan(batchfile, config, n_procs, plan):
+    "Returns the batchfile with the --time of the plan, or its shards if the plan splits it"
+    batchfiles = [batchfile]
+    if len(plan) > 1:
+        batchfiles = []
+        for k, shard in enumerate(plan):
+            shard_config = copy.deepcopy(config)
+            shard_config["benchmarks"]["shard"] = [shard["start"], shard["stop"]]
+            shard_config["sbatch_params"]["job-name"] = f"{config['sbatch_params']['job-name']}-s{k}"
+            shard_batchfile = type(batchfile)(shard_config, n_procs)
+            shard_batchfile.add_suffix(f"-s{k}")
+            batchfiles.append(shard_batchfile)
+    for b, shard in zip(batchfiles, plan):
+        b.sbatch_params.param_dict["time"] = shard["time"]
+        debug(f"Predicted time of {b.filename}: {shard['time']}")
+    return batchfiles
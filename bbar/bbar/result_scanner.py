@@ -0,0 +1,72 @@
+import os
+import glob
+import stat
+
+class Result_Scanner:
+    """
+    Incrementally scans for output files and for files created in workdirs.
+
+    The (size, mtime) of every scanned path is cached in the store, and only paths whose stat differs from
+    the cache are re-examined. A workdir is only listed (with os.scandir) when its own mtime has changed,
+    i.e. when entries were added, removed or renamed in it. Known subdirectories are always descended into.
+    Paths starting with one of excluded (real paths of bbar's own files, see BBAR_Project.own_paths) are skipped.
+    """
+    def __init__(self, store, excluded=()):
+        self.store = store
+        self.excluded = tuple(excluded)
+        self.stat_calls = 0
+
+    def stat(self, path):
+        self.stat_calls += 1
+        try:
+            return os.stat(path)
+        except FileNotFoundError:
+            return None
+
+    def changed(self, path, st, **extra):
+        record = {"size": st.st_size, "mtime": st.st_mtime_ns, **extra}
+        if self.store.get_scan_entry(path) == record:
+            return False
+        self.store.set_scan_entry(path, record)
+        return True
+
+    def scan_output(self, output_file):
+        "Scans for output_file, which may contain * wildcards for unresolved sbatch filename patterns"
+        for path in glob.glob(output_file) if "*" in output_file else [output_file]:
+            st = self.stat(path)
+            if st and stat.S_ISREG(st.st_mode) and self.changed(path, st):
+                self.store.add_output_file(path)
+
+    def scan_workdir(self, workdir):
+        st = self.stat(workdir)
+        if st is None or not stat.S_ISDIR(st.st_mode):
+            return
+        cached = self.store.get_scan_entry(workdir)
+        if cached and cached["mtime"] == st.st_mtime_ns:
+            subdirs = cached["subdirs"]
+        else:
+            subdirs = []
+            real_workdir = os.path.realpath(workdir)
+            with os.scandir(workdir) as entries:
+                for entry in entries:
+                    real_path = os.path.join(real_workdir, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        if not os.path.join(real_path, "").startswith(self.excluded):
+                            subdirs.append(entry.name)
+                    elif entry.is_file() and not real_path.startswith(self.excluded):
+                        self.stat_calls += 1
+                        if self.changed(entry.path, entry.stat()):
+                            self.store.add_workdir_file(entry.path)
+            self.changed(workdir, st, subdirs=subdirs)
+
+        for subdir in subdirs:
+            self.scan_workdir(os.path.join(workdir, subdir))
+
+    def scan(self, batchfiles):
+        with self.store.transaction():
+            workdirs = {}
+            for batchfile in batchfiles:
+                self.scan_output(batchfile.get_output())
+                workdirs.update(dict.fromkeys(batchfile.commands.workdirs))
+            for workdir in workdirs:
+                self.scan_workdir(workdir)
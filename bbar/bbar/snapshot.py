@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+
+from bbar.persistence import open_store
+from bbar.constants import default_bbarfile_name
+from bbar.logging import debug, traced, count
+from bbar.scheduler.plugins import get as get_scheduler
+from bbar.bbarfile.defaults import bbarfile_defaults
+
+from .bbar_project import BBAR_Project
+
+snapshot_path = ".bbar_snapshot"
+#Changes when the contents of snapshots change, so that older snapshots aren't used
+snapshot_version = 3
+
+def snapshot_key(bbarfile_path, overrides):
+    "Identifies a configuration: the bbarfile contents, the command line overrides and the defaults"
+    h = hashlib.sha1(f"{snapshot_version}{bbarfile_defaults}".encode())
+    with open(bbarfile_path or default_bbarfile_name, "rb") as f:
+        h.update(f.read())
+    h.update(json.dumps(overrides or []).encode())
+    return h.hexdigest()
+
+class Snapshot_Commands:
+    def __init__(self, workdirs, indices):
+        self.workdirs = workdirs
+        self.indices = indices
+
+class Snapshot_Batchfile:
+    "The parts of a batchfile that status and list use: its name, resolved output file, workdirs and command indices"
+    def __init__(self, filename, output, workdirs, origin, indices, store):
+        self.filename = filename
+        self.output = output
+        self.commands = Snapshot_Commands(workdirs, indices)
+        self.origin = origin
+        self.store = store
+
+    def get_jobid(self):
+        return self.store.get_jobid(self.filename)
+
+    def get_output(self):
+        return self.output
+
+class Project_Snapshot(BBAR_Project):
+    """
+    A BBAR_Project restored from the snapshot that the last full command saved, for read-only commands.
+    Nothing is expanded, and the scheduler plugin is only imported if job states are queried.
+    """
+    def __init__(self, snapshot):
+        self.initialized = False
+        self.bbarfile_data = {"status": snapshot["status"], "persistence": snapshot["persistence"],
+                              "history": snapshot["history"], "archive": snapshot["archive"]}
+        self.state = open_store(snapshot["persistence"])
+        self.scheduler_name = snapshot["scheduler"]
+        self.batchfiles = [Snapshot_Batchfile(*batchfile, self.state) for batchfile in snapshot["batchfiles"]]
+        self.initialized = True
+
+    @property
+    def scheduler(self):
+        return get_scheduler(self.scheduler_name)
+
+def take_snapshot(bbar_project):
+    return {
+        "scheduler": bbar_project.scheduler_name,
+        "status": bbar_project.bbarfile_data["status"],
+        "persistence": bbar_project.bbarfile_data["persistence"],
+        #For BBAR_Project.own_paths
+        "history": {"path": bbar_project.bbarfile_data["history"]["path"]},
+        "archive": {"store": bbar_project.bbarfile_data["archive"]["store"]},
+        "batchfiles": [[b.filename, b.get_output(), list(b.commands.workdirs), b.origin, list(b.commands.indices)] for b in bbar_project.batchfiles],
+    }
+
+def read_snapshot(path=snapshot_path):
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+@traced("save_snapshot")
+def save_snapshot(bbar_project, key, path=snapshot_path):
+    "Saves what read-only commands need to know about bbar_project, if it has changed"
+    snapshot = dict(take_snapshot(bbar_project), key=key)
+    if read_snapshot(path) == snapshot:
+        return
+    debug(f"Saving project snapshot {path}")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+    count("files written")
+
+@traced("load_snapshot")
+def load_snapshot(bbarfile_path, overrides, path=snapshot_path):
+    "Returns a Project_Snapshot if the snapshot was taken of the same configuration, None otherwise"
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        return None
+    try:
+        key = snapshot_key(bbarfile_path, overrides)
+    except OSError:
+        return None
+    if snapshot.get("key") != key:
+        debug("Configuration changed since the last snapshot, reading the bbarfile")
+        return None
+    debug(f"Using project snapshot {path}")
+    return Project_Snapshot(snapshot)
@@ -1,9 +1,8 @@
 import os
-import toml
 from bbar.bbar import BBAR_Project
 from bbar.util.deep_union import deep_dict_union
 from bbar.constants import default_bbarfile_name
-from bbar.logging import debug
+from bbar.logging import debug, traced
 from .defaults import bbarfile_defaults
 
 class BBARFile_Error(Exception):
@@ -16,6 +15,7 @@ def check_valid_file(f):
         raise BBARFile_Error(f"Error reading bbarfile \"{f}\":\n\t File \"{f}\" does not exist")
 
 def apply_user_overrides(original, overrides):
+    import toml
     if overrides:
         for override in overrides:
             try:
@@ -27,7 +27,10 @@ def apply_user_overrides(original, overrides):
     return original
  
 
-def read_bbarfile( bbarfile_path, overrides):
+@traced("read_bbarfile")
+def read_bbarfile( bbarfile_path, overrides, read_only=False):
+    "Reads the bbarfile into a BBAR_Project, whose state isn't written to with read_only"
+    import toml
 
     debug(f"Using bbarfile \"{bbarfile_path}\"", condition=bbarfile_path)
     bbarfile_path = bbarfile_path or default_bbarfile_name
@@ -40,11 +43,13 @@ def read_bbarfile( bbarfile_path, overrides):
         bbarfile_data = toml.load(bbarfile_path)
         bbarfile_data = deep_dict_union(defaults, bbarfile_data)
         bbarfile_data = apply_user_overrides(bbarfile_data, overrides)
-        bset = BBAR_Project(bbarfile_data)
+        bset = BBAR_Project(bbarfile_data, read_only=read_only)
         if not bset.initialized:
             raise("Unknown error")
     except toml.decoder.TomlDecodeError as e:
         raise BBARFile_Error(f"Error parsing bbarfile TOML in \"{bbarfile_path}\":\n\t{e}")
+    except ValueError as e:
+        raise BBARFile_Error(f"Error in bbarfile \"{bbarfile_path}\":\n\t{e}")
     except Exception as e:
         raise(e)
         #raise BBARFile_Error(f"Error reading or parsing bbarfile \"{bbarfile_path}\":\n\t{e}")
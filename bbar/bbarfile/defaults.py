@@ -1,6 +1,8 @@
 bbarfile_defaults="""
 max_procs_per_node = 4
 batchfile_name     = "{SBATCH_job-name}-{SBATCH_n}.batch"
+array_batchfile_name = "{SBATCH_job-name}-array.batch"
+array_output       = "{SBATCH_job-name}-%A_%a.out"
 setup		   = ""
 cleanup		   = ""
 scheduler          = "SLURM"
@@ -13,6 +15,66 @@ status_analysis    = "exit_code"
 job-name = "benchmark_job"
 output   = "{SBATCH_job-name}-{SBATCH_n}.out"
 
+#Submission: "separate" jobs or one "array" job, concurrent sbatch calls, jobs queued or running at once (0 = no limit),
+#and seconds between submissions of bbar pump --watch
+[submission]
+mode     = "separate"
+workers  = 8
+max_in_flight = 0
+poll_interval = 60
+
+#LOCAL scheduler: core budget (0 = all cores), max concurrent jobs (0 = one per core), pin jobs to CPUs
+[local]
+cores    = 0
+max_jobs = 0
+pin      = true
+
+#SLURM packing: run the commands of a batchfile as concurrent job steps of ranks processes each,
+#as many at a time as fit in the allocation (0 = run every command on the whole allocation, one after the other)
+[packing]
+ranks        = 0
+step_options = "--exact"
+
+#Runtime history of commands, see bbar/bbar/history.py. When enabled, generate sets the --time of SLURM batchfiles
+#to the predicted runtime times margin plus overhead seconds, and splits batchfiles that would exceed max_time
+[history]
+enabled  = false
+path     = ".bbar_history"
+samples  = 5
+margin   = 1.5
+overhead = 60
+max_time = ""
+
+#Seconds for which job states from sacct/squeue are reused
+[status]
+ttl      = 30
+
+#Processes used for extracting metrics (0 = one per core), results table format ("npz" or "parquet")
+[analysis]
+workers      = 0
+table_format = "npz"
+percentiles  = [5, 95]
+
+#bbar compare: statistical test ("mannwhitney" or "bootstrap"), significance level, smallest relative change reported,
+#and the metrics for which higher values are better
+[compare]
+test      = "mannwhitney"
+alpha     = 0.05
+threshold = 0.05
+higher_is_better = []
+
+#Archive written by bbar archive, format is one of tar, gztar, bztar, xztar or zstd, threads = 0 means one per core
+#store is the content-addressed archive directory used by bbar archive --incremental
+[archive]
+name     = "bbar"
+format   = "gztar"
+threads  = 0
+store    = ".bbar_archive"
+
+[persistence]
+backend  = "toml"
+journal  = false
+
 
 
 """
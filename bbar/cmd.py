@@ -1,24 +1,75 @@
+import sys
 import argparse
-import pprint
-from bbar.bbarfile import read_bbarfile, BBARFile_Error
 from bbar.constants import default_bbarfile_name
-from bbar.state_machine import BBAR_FSM
-from bbar.logging import set_verbosity
+from bbar.logging import set_verbosity, error, info, debug, diagnostics, span, enable_profiling
 
+#Commands served from the project snapshot when the bbarfile hasn't changed, without expanding the configuration
+read_only_commands = ["status", "list"]
 
-def analyze(bbar_project):
-    bbar_project.scan_for_results()
-    state = bbar_project.state
-    print()
+
+def analyze(bbar_project, args):
+    from bbar.analysis.results_table import update_results_table
+    from bbar.analysis.output import write_table
+    table = update_results_table(bbar_project)
+    if not len(table):
+        print("No metrics found, declare metrics in [benchmarks.metrics] and check that there are results")
+        return
+    if args.report:
+        from bbar.analysis.plugins import get_report
+        report_config = dict(bbar_project.bbarfile_data.get("reports", {}).get(args.report, {}))
+        if "metric" not in report_config:
+            error(f"Report {args.report} needs a metric, set it in [reports.{args.report}]")
+            return
+        report_config.setdefault("max_procs_per_node", bbar_project.bbarfile_data["max_procs_per_node"])
+        Report = get_report(args.report)
+        write_table(Report(**report_config).report(table), args.format)
+    elif args.raw:
+        write_table(table.columns, args.format)
+    else:
+        write_table(table.aggregate(percentiles=bbar_project.bbarfile_data["analysis"]["percentiles"]), args.format)
+
+def compare(bbar_project, args):
+    "Prints the comparison with the baseline, returns False if there are regressions"
+    from bbar.analysis.compare import compare_with_baseline
+    from bbar.analysis.output import write_table
+    if not args.baseline:
+        error("bbar compare needs a baseline: --baseline <results table, project directory or archive>")
+        return False
+    columns = compare_with_baseline(bbar_project, args.baseline)
+    write_table(columns, args.format)
+    return "regression" not in list(columns["verdict"])
+
+def report_profile(args):
+    "Prints the profile of bbar's own phases with --profile, or at the DIAGNOSTICS level, and writes the Chrome trace"
+    from bbar.logging import profiling
+    if not profiling.enabled:
+        return
+    log = info if args.profile or args.profile_trace else diagnostics
+    log("\nProfile:")
+    for line in profiling.profile_summary():
+        log(line)
+    if args.profile_trace:
+        profiling.write_chrome_trace(args.profile_trace)
+        log(f"Wrote Chrome trace {args.profile_trace}")
 
 def main():
-    command_choices = ["generate", "run", "purge", "archive", "list", "status", "show_config"]
+    command_choices = ["generate", "run", "pump", "cancel", "purge", "archive", "list", "status", "analyze", "compare", "show_config"]
 
     parser = argparse.ArgumentParser(description='Generates and runs benchmarks for you automatically')
     parser.add_argument("command", choices=command_choices, metavar=f"command", help='{ '+' | '.join(command_choices)+' }')
     parser.add_argument("-f", help="don't ask for confirmation when overwriting or deleting files", action='store_true')
     parser.add_argument("-p", help="command line parameters that override bbarfile parameters.", nargs='+')
     parser.add_argument("--bbarfile", help=f"the bbarfile is a TOML file containing benchmark configuration, (default='{default_bbarfile_name}')")
+    parser.add_argument("--format", help="output format of analysis results (default='text')", choices=["text", "csv", "json"], default="text")
+    parser.add_argument("--raw", help="analyze: print every extracted value instead of aggregates", action='store_true')
+    parser.add_argument("--adaptive", help="run: run rounds of the search configured in [adaptive], refining around the best results", action='store_true')
+    parser.add_argument("--resume", help="run: submit only the commands that failed or didn't run, when the project is partially completed", action='store_true')
+    parser.add_argument("--watch", help="pump: keep submitting queued batch files as jobs finish, until none are queued", action='store_true')
+    parser.add_argument("--incremental", help="archive: store files once by content hash, and only read files that changed since the last archive", action='store_true')
+    parser.add_argument("--baseline", help="compare: results table (.npz or .parquet), project directory or archive to compare the results with")
+    parser.add_argument("--profile", help="time bbar's own phases and print a summary", action='store_true')
+    parser.add_argument("--profile-trace", help="profile like --profile, and write the phases as a Chrome trace to PATH", metavar="PATH")
+    parser.add_argument("--report", help="analyze: print a report configured in [reports.<REPORT>] instead of aggregates, e.g. scaling")
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-v","--verbose", help="verbose level, add more v's for more verbosity", action="count", default=0)
@@ -27,30 +78,58 @@ def main():
     args = parser.parse_args()
  
     set_verbosity(args.verbose - args.quiet)
+    if args.profile or args.profile_trace:
+        enable_profiling()
 
-    try:
-        bbar_project = read_bbarfile(args.bbarfile, args.p)
-    except BBARFile_Error as e:
-        parser.error(e)
+    from bbar.bbar.snapshot import load_snapshot, save_snapshot, snapshot_key
+    bbar_project = None
+    if args.command in read_only_commands:
+        bbar_project = load_snapshot(args.bbarfile, args.p)
+    from_snapshot = bbar_project is not None
+    #Completing the jobs records runtimes and the results of each command, which need the full project
+    if from_snapshot and bbar_project.state.get_status() == "running" and bbar_project.jobs_finished():
+        debug("Jobs have finished, reading the bbarfile")
+        bbar_project, from_snapshot = None, False
 
-    state_machine = BBAR_FSM(bbar_project, interactive = not args.f)
+    if not from_snapshot:
+        from bbar.bbarfile import read_bbarfile, BBARFile_Error
+        try:
+            bbar_project = read_bbarfile(args.bbarfile, args.p)
+        except BBARFile_Error as e:
+            parser.error(e)
+
+    from bbar.state_machine import BBAR_FSM
+    state_machine = BBAR_FSM(bbar_project, interactive = not args.f, adaptive = args.adaptive, resume = args.resume, watch = args.watch)
     state_machine.try_system_task("scan")
- 
+    success = True
 
     try:
-        if args.command in ["generate","run","cancel","purge"]:
-            state_machine.try_command(args.command)
-        elif args.command == "analyze":
-            analyze(bbar_project)
-        elif args.command == "status":
-            state_machine.print_status()
-        elif args.command == "archive":
-            bbar_project.archive_output()
-        elif args.command == "list":
-            bbar_project.list_files()
-        elif args.command == "show_config":
-            pprint.pprint(bbar_project)
+        with span(f"bbar {args.command}"):
+            if args.command in ["generate","run","pump","cancel","purge"]:
+                state_machine.try_command(args.command)
+                success = not state_machine.failed
+            elif args.command == "analyze":
+                analyze(bbar_project, args)
+            elif args.command == "compare":
+                success = compare(bbar_project, args)
+            elif args.command == "status":
+                state_machine.print_status()
+            elif args.command == "archive":
+                bbar_project.archive_output(incremental=args.incremental)
+            elif args.command == "list":
+                bbar_project.list_files()
+            elif args.command == "show_config":
+                import pprint
+                pprint.pprint(bbar_project)
     #except Exception as e:
     #    parser.error(f"Error running command {args.command}:\n\t{e}")
     except KeyboardInterrupt:
         print("\nCaught interrupt signal, exiting")
+        report_profile(args)
+        return
+
+    if not from_snapshot:
+        save_snapshot(bbar_project, snapshot_key(args.bbarfile, args.p))
+    report_profile(args)
+    if not success:
+        sys.exit(1)
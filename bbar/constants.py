@@ -1,4 +1,20 @@
 default_bbarfile_name = "bbarfile"
 
+#Printed before each command in generated batchfiles, so that output can be attributed to commands
+command_marker = "BBAR_COMMAND"
+#Printed before each repetition and warmup run of a command with a repetition policy, and after the last repetition
+repetition_marker = "BBAR_REPETITION"
+warmup_marker = "BBAR_WARMUP"
+repetitions_marker = "BBAR_REPETITIONS"
+#The files of file-based metrics are moved to <file>.rep<r> after repetition r, so that each repetition keeps its own
+repetition_file_suffix = ".rep"
+#Printed with the exit code of each command, after the output of the command
+step_marker = "BBAR_STEP"
+#Printed with a timestamp before each command and after the last, when the runtime history is enabled
+time_marker = "BBAR_TIME"
+#Archives keep the job id of each batchfile in this file, so that outputs named by job id (%j, %A_%a) can be found
+#when the archive is a baseline
+archive_jobids_name = ".bbar_jobids.json"
+
 BBAR_FAILURE = False
 BBAR_SUCCESS = True
@@ -1,63 +1,48 @@
-from bbar.util.generators import generator_from_config
+from bbar.util.generators import sweep_settings
 from bbar.util.deep_union import deep_dict_union
 from bbar.generic.environment import Environment_variables, LMOD_modules
+from bbar.constants import command_marker, step_marker, time_marker
+from bbar.util.templates import compile_template
+from bbar.generic.conditions import compile_condition, Column
+from bbar.generic.repetitions import Repetition_Policy, shell_functions
+from functools import lru_cache
 from pathlib import Path
-import re
+import copy
+
+#Prints the exit code of the command line it ends, and keeps it as the exit code of the line
+exit_function = f"bbar_exit() {{ local code=$?; echo {step_marker} $1 exit_code=$code; return $code; }}"
+
+@lru_cache(maxsize=None)
+def command_path(command_dir, command):
+    return (Path(command_dir) / command).absolute()
 
 class Command_closure:
     def __init__(self, workdir, command_dir, command, arguments, env_vars, format_params):
+        params = {**format_params, **env_vars, "arguments": arguments}
         self.env_vars = Environment_variables(env_vars)
-        self.workdir = workdir.format(**env_vars, **format_params, arguments=arguments)
-        self.command_dir = command_dir.format(**env_vars, **format_params, arguments=arguments)
-        self.command = (Path(command_dir) / command).absolute()
+        self.workdir = compile_template(workdir).render(params)
+        self.command_dir = compile_template(command_dir).render(params)
+        self.command = command_path(command_dir, command)
         self.arguments = arguments
         self.argv_string = ' '.join([str(v) for v in [self.command]+self.arguments])
 
-cond_regex=re.compile("\s*(?P<lhs>\w+)\s*(?P<op>\W+)\s*(?P<rhs>\w+)\s*")
-#Extremely tiny, limited condition parser. Only allow 3 tokens, <lhs> <op>, <rhs>
-def condition_eval(condition, format_params):
-    m = cond_regex.search(condition)
-    try:
-        lhs, op, rhs = m.group('lhs'),m.group('op'),m.group('rhs')
-        if lhs == "N":
-            lhs = int(format_params["SBATCH_N"])
-        elif lhs == "n":
-            lhs = int(format_params["SBATCH_n"])
-        else:
-            lhs = int(lhs)
-
-        if rhs == "N":
-            rhs = int(format_params["SBATCH_N"])
-        elif rhs == "n":
-            rhs = int(format_params["SBATCH_n"])
-        else:
-            rhs = int(rhs)
-        
-        if op == "=" or op == "==":
-            return lhs == rhs
-        if op == "!=":
-            return lhs != rhs
-        if op == ">":
-            return lhs > rhs
-        if op == "<":
-            return lhs < rhs
-
-        return false
-
-    except:
-        raise Exception(f"Bad condition {condition} in bbarfile")
-    
-
-
-#TODO: currently getting stuff from format_params, also get an object to evaluate conditionals on
+#Keys that a condition on per-command parameters (environment variables, arguments) may set
+command_condition_keys = ["workdir", "command_dir", "command", "env_vars"]
+
 class Commands:
     def __init__(self, config, format_params):
-        cfg = config.copy()
+        cfg = config
         conditionals = cfg["if"] if "if" in cfg else {}
+        #Conditions may refer to environment variables set in any if block
+        all_env_var_names = set(cfg.get("env_vars", {})) | {k for v in conditionals.values() for k in v.get("env_vars", {})}
+        command_conditionals = []
         for condition, conditional_value in conditionals.items():
-            if condition_eval(condition, format_params):
+            condition = compile_condition(condition)
+            if condition.names & (all_env_var_names | {"arguments"}):
+                command_conditionals.append((condition, conditional_value))
+            elif condition.test(format_params):
                 #add contents of v, a dict, to cfg
-                cfg = deep_dict_union(cfg, conditional_value)
+                cfg = deep_dict_union(copy.deepcopy(cfg), conditional_value)
 
         workdir = cfg["workdir"]
         command_dir = cfg["command_dir"] if "command_dir" in cfg else "."
@@ -67,30 +52,76 @@ class Commands:
         if "num_settings" in cfg:
             num_settings = int(cfg["num_settings"])
 
-        argument_generators = []
-        if "arguments" in cfg:
-            try:
-                argument_generators = [generator_from_config(i,v,num_settings) for i,v in enumerate(cfg["arguments"])]
-            except Exception as e:
-                raise Exception("ERROR generating arguments for benchmarks:", e)
-
-        env_var_generators = {}
-        if "env_vars" in cfg:
-            try:
-                env_var_generators = {
-                    k:generator_from_config(k,v,num_settings)
-                    for k,v in cfg["env_vars"].items()
-                }
-            except Exception as e:
-                raise Exception("ERROR generating environment variables for benchmarks:", e)
-        
-        self.commands = [Command_closure( 
-                             workdir, command_dir, command,
-                             [next(a) for a in argument_generators],
-                             {k:next(v) for k,v in env_var_generators.items()},
-                             format_params) for _ in range(num_settings)]
+        num_arguments = len(cfg.get("arguments", []))
+        env_var_names = list(cfg.get("env_vars", {}))
+        axes = {f"arguments[{i}]":v for i,v in enumerate(cfg.get("arguments", []))}
+        axes.update(cfg.get("env_vars", {}))
+        samples = int(cfg["samples"]) if "samples" in cfg else None
+        try:
+            rows = sweep_settings(axes, cfg.get("sweep", "zip"), num_settings, samples, cfg.get("seed", 0))
+        except Exception as e:
+            raise Exception("ERROR generating arguments and environment variables for benchmarks:", e)
+        settings = [([row[f"arguments[{i}]"] for i in range(num_arguments)], {k:row[k] for k in env_var_names}) for row in rows]
+        #Index of each command among all settings, which identifies it across shards and resubmissions
+        self.indices = list(range(len(settings)))
+        #The commands resubmitted by bbar run --resume, see BBAR_Project.resume
+        if "select" in cfg:
+            self.indices = [int(i) for i in cfg["select"]]
+            settings = [settings[i] for i in self.indices]
+        #A shard of a batchfile that was split to fit the time limit, see Runtime_History
+        elif "shard" in cfg:
+            start, stop = cfg["shard"]
+            settings = settings[start:stop]
+            self.indices = self.indices[start:stop]
+
+        #Conditions on per-command parameters are evaluated for all commands at once, on columns of their values.
+        #Each sees the environment variables set by the if blocks before it, variables that aren't set are None
+        overrides = [{} for _ in settings]
+        if command_conditionals:
+            columns = dict(format_params)
+            columns["arguments"] = Column([arguments for arguments, _ in settings])
+            for name in all_env_var_names:
+                columns[name] = Column([env_vars.get(name) for _, env_vars in settings])
+            for condition, conditional_value in command_conditionals:
+                unsupported = set(conditional_value) - set(command_condition_keys)
+                if unsupported:
+                    raise ValueError(f"Condition \"{condition.text}\" depends on each command, so it can only set {', '.join(command_condition_keys)}, not {', '.join(sorted(unsupported))}")
+                hits = condition.test(columns, len(settings))
+                for override, hit in zip(overrides, hits):
+                    if hit:
+                        deep_dict_union(override, copy.deepcopy(conditional_value))
+                set_env_vars = conditional_value.get("env_vars", {})
+                if set_env_vars and any(hits):
+                    for name, value in set_env_vars.items():
+                        columns[name] = Column([value if hit else old for old, hit in zip(columns[name], hits)])
+
+        self.commands = [Command_closure(
+                             override.get("workdir", workdir), override.get("command_dir", command_dir), override.get("command", command),
+                             arguments, {**env_vars, **override.get("env_vars", {})},
+                             format_params) for (arguments, env_vars), override in zip(settings, overrides)]
 
         self.workdirs = [c.workdir for c in self.commands]
 
+        self.timestamps = False
+        self.repetitions = None
+        if "repetitions" in cfg:
+            self.repetitions = Repetition_Policy(cfg["repetitions"], cfg.get("metrics", {}))
+
+    def repeat(self):
+        "The prefix of command lines that runs them according to the repetition policy, if there is one"
+        return f"{self.repetitions.prefix()} " if self.repetitions else ""
+
+    def functions(self):
+        "Shell functions that the command lines use"
+        return f"{exit_function}\n" + (f"{shell_functions}\n" if self.repetitions else "")
+
+    def timed(self, lines):
+        "Joins command lines, each preceded by a timestamp when timestamps are enabled, for the runtime history"
+        if not self.timestamps:
+            return "\n".join(lines)
+        stamp = f"echo {time_marker} $(date +%s.%N)"
+        return "\n".join([f"{stamp}; {line}" for line in lines] + [stamp])
+
     def __repr__(self):
-        return "\n".join([f"pushd {cmd_closure.workdir} &>/dev/null && {cmd_closure.env_vars} {cmd_closure.argv_string} && popd &> /dev/null" for cmd_closure in self.commands])
+        repeat = self.repeat()
+        return self.functions() + self.timed([f"echo {command_marker} {i} && pushd {cmd_closure.workdir} &>/dev/null && {cmd_closure.env_vars} {repeat}{cmd_closure.argv_string} && popd &> /dev/null; bbar_exit {i}" for i, cmd_closure in enumerate(self.commands)])
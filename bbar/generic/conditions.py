@@ -0,0 +1,324 @@
+import re
+import operator
+from itertools import repeat
+from functools import lru_cache
+
+#DOCUMENT: conditions in [benchmarks.if."<condition>"] tables, e.g.
+#   "n >= 4 and n <= 16"     "4 <= n <= 16"     "n in 4..16"     "N == 1 or procs_on_node < 4"
+#   "UCX_RNDV_THRESH > 8192"     "arguments[0] in [256, 512]"     "{SBATCH_job-name} == 'small'"     "n % 2 == 0"
+#   Names refer to format parameters: SBATCH_<param>, procs_on_node, benchmark environment variables and arguments.
+#   n and N are short for SBATCH_n and SBATCH_N. Names that aren't identifiers can be written in braces.
+#   An environment variable that another if block sets for some commands is unset for the others: it compares
+#   unequal to everything, and arithmetic on it stays unset.
+#   As in Python, "and" and "or" only evaluate their right operand where the left one doesn't decide the result,
+#   so "N == 1 or UNKNOWN > 3" holds wherever N is 1, even without an UNKNOWN parameter.
+
+class Column(list):
+    "The values of a parameter for each command of a batchfile, conditions on columns evaluate to a column of results"
+
+def broadcast(f, *values):
+    "Applies f to values, or to each row of them at once (with map) if any of them are Columns"
+    rows = next((len(v) for v in values if isinstance(v, Column)), None)
+    if rows is None:
+        return f(*values)
+    return Column(map(f, *[v if isinstance(v, Column) else repeat(v, rows) for v in values]))
+
+def freeze(value):
+    "A hashable copy of a parameter value, Columns and lists become tuples"
+    if isinstance(value, (list, tuple)):
+        return (type(value) is Column, tuple(map(freeze, value)))
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    return value
+
+def numeric(value):
+    if isinstance(value, str):
+        for convert in (int, float):
+            try:
+                return convert(value)
+            except ValueError:
+                pass
+    return value
+
+def comparable(a, b):
+    "Numbers and numeric strings compare as numbers, e.g. an environment variable \"4096\" with 4096"
+    if isinstance(a, str) != isinstance(b, str):
+        return numeric(a), numeric(b)
+    return a, b
+
+def compare(op):
+    def f(a, b):
+        if a is None or b is None:
+            return op is operator.ne
+        return op(*comparable(a, b))
+    return f
+
+comparisons = {
+    "==": compare(operator.eq), "=": compare(operator.eq), "!=": compare(operator.ne),
+    "<": compare(operator.lt), "<=": compare(operator.le), ">": compare(operator.gt), ">=": compare(operator.ge),
+}
+def arithmetic_op(op):
+    return lambda a, b: None if a is None or b is None else op(numeric(a), numeric(b))
+
+arithmetic = {
+    "+": arithmetic_op(operator.add), "-": arithmetic_op(operator.sub), "*": arithmetic_op(operator.mul),
+    "/": arithmetic_op(operator.truediv), "%": arithmetic_op(operator.mod),
+}
+aliases = {"n": "SBATCH_n", "N": "SBATCH_N"}
+
+class Literal:
+    def __init__(self, value):
+        self.value = value
+    def evaluate(self, params):
+        return self.value
+
+class Name:
+    def __init__(self, name, index=None):
+        self.name = name
+        self.index = index
+    def evaluate(self, params):
+        if self.name in params:
+            value = params[self.name]
+        elif self.name in aliases and aliases[self.name] in params:
+            value = params[aliases[self.name]]
+        else:
+            raise ValueError(f"Unknown parameter {self.name}")
+        if self.index is not None:
+            return broadcast(lambda v: v[self.index], value)
+        return value
+
+class Operation:
+    def __init__(self, f, *operands):
+        self.f = f
+        self.operands = operands
+    def evaluate(self, params):
+        return broadcast(self.f, *[o.evaluate(params) for o in self.operands])
+
+class Chain:
+    "a < b <= c, as in Python"
+    def __init__(self, operands, ops):
+        self.operands = operands
+        self.ops = ops
+    def evaluate(self, params):
+        values = [o.evaluate(params) for o in self.operands]
+        def chain(*values):
+            return all(comparisons[op](a, b) for op, a, b in zip(self.ops, values, values[1:]))
+        return broadcast(chain, *values)
+
+class Logic:
+    "a and b, a or b, which evaluate b only for the rows that a doesn't decide"
+    def __init__(self, op, left, right):
+        #a decides "a or b" when it's true, and "a and b" when it's false
+        self.decides = bool if op == "or" else operator.not_
+        self.operands = (left, right)
+    def evaluate(self, params):
+        left, right = self.operands
+        value = left.evaluate(params)
+        if not isinstance(value, Column):
+            return bool(value) if self.decides(value) else bool(right.evaluate(params))
+        result = Column(map(bool, value))
+        undecided = [i for i, v in enumerate(value) if not self.decides(v)]
+        if undecided:
+            rows = {k:Column(v[i] for i in undecided) if isinstance(v, Column) else v for k, v in params.items()}
+            values = right.evaluate(rows)
+            for j, i in enumerate(undecided):
+                result[i] = bool(values[j] if isinstance(values, Column) else values)
+        return result
+
+token_regex = re.compile(r"""\s*(?:
+    (?P<number>\d+(?:\.\d+)?)|
+    (?P<string>'[^']*'|"[^"]*")|
+    (?P<field>\{[^{}]+\})|
+    (?P<name>[A-Za-z_]\w*)|
+    (?P<op>\.\.|==|!=|<=|>=|[=<>()\[\],+\-*/%])
+    )""", re.VERBOSE)
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = token_regex.match(text, pos)
+        if not m:
+            raise ValueError(f"Unexpected \"{text[pos:].strip()}\"")
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == "number":
+            tokens.append(("literal", float(value) if "." in value else int(value)))
+        elif kind == "string":
+            tokens.append(("literal", value[1:-1]))
+        elif kind == "field":
+            tokens.append(("name", value[1:-1]))
+        elif kind == "name" and value in ("and", "or", "not", "in"):
+            tokens.append(("op", value))
+        elif kind == "name" and value in ("true", "false"):
+            tokens.append(("literal", value == "true"))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+class Parser:
+    """
+    Recursive descent parser for:
+        or     := and ("or" and)*
+        and    := not ("and" not)*
+        not    := "not" not | cmp
+        cmp    := sum ((op sum)+ | ["not"] "in" (sum ".." sum | "[" sum ("," sum)* "]"))?
+        sum    := term (("+" | "-") term)*
+        term   := atom (("*" | "/" | "%") atom)*
+        atom   := literal | name ["[" int "]"] | "-" atom | "(" or ")"
+    """
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self, *ops):
+        if self.pos < len(self.tokens) and self.tokens[self.pos][0] == "op" and self.tokens[self.pos][1] in ops:
+            return self.tokens[self.pos][1]
+        return None
+
+    def take(self, *ops):
+        op = self.peek(*ops)
+        if op:
+            self.pos += 1
+        return op
+
+    def expect(self, op):
+        if not self.take(op):
+            found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else "end of condition"
+            raise ValueError(f"Expected \"{op}\", found \"{found}\"")
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise ValueError(f"Unexpected \"{self.tokens[self.pos][1]}\"")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.take("or"):
+            node = Logic("or", node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.take("and"):
+            node = Logic("and", node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        if self.take("not"):
+            return Operation(operator.not_, self.parse_not())
+        return self.parse_cmp()
+
+    def parse_cmp(self):
+        node = self.parse_sum()
+        negate = False
+        if self.peek("not") and self.pos + 1 < len(self.tokens) and self.tokens[self.pos+1] == ("op", "in"):
+            self.pos += 1
+            negate = True
+        if self.take("in"):
+            node = self.parse_membership(node)
+            return Operation(operator.not_, node) if negate else node
+        operands, ops = [node], []
+        while self.peek(*comparisons):
+            ops.append(self.take(*comparisons))
+            operands.append(self.parse_sum())
+        return Chain(operands, ops) if ops else node
+
+    def parse_membership(self, node):
+        if self.take("["):
+            items = [self.parse_sum()]
+            while self.take(","):
+                items.append(self.parse_sum())
+            self.expect("]")
+            def member(value, *items):
+                return any(comparisons["=="](value, item) for item in items)
+            return Operation(member, node, *items)
+        low = self.parse_sum()
+        self.expect("..")
+        high = self.parse_sum()
+        return Chain([low, node, high], ["<=", "<="])
+
+    def parse_sum(self):
+        node = self.parse_term()
+        while op := self.take("+", "-"):
+            node = Operation(arithmetic[op], node, self.parse_term())
+        return node
+
+    def parse_term(self):
+        node = self.parse_atom()
+        while op := self.take("*", "/", "%"):
+            node = Operation(arithmetic[op], node, self.parse_atom())
+        return node
+
+    def parse_atom(self):
+        if self.pos >= len(self.tokens):
+            raise ValueError("Unexpected end of condition")
+        kind, value = self.tokens[self.pos]
+        if kind == "literal":
+            self.pos += 1
+            return Literal(value)
+        if kind == "name":
+            self.pos += 1
+            index = None
+            if self.take("["):
+                kind, index = self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+                if kind != "literal" or not isinstance(index, int):
+                    raise ValueError(f"Expected an integer index after {value}[")
+                self.pos += 1
+                self.expect("]")
+            return Name(value, index)
+        if self.take("-"):
+            return Operation(lambda a: None if a is None else -numeric(a), self.parse_atom())
+        if self.take("("):
+            node = self.parse_or()
+            self.expect(")")
+            return node
+        raise ValueError(f"Unexpected \"{value}\"")
+
+def names(node):
+    if isinstance(node, Name):
+        return {node.name}
+    children = getattr(node, "operands", ())
+    return set().union(*[names(c) for c in children]) if children else set()
+
+class Condition:
+    "A bbarfile condition, parsed once into an expression tree"
+    def __init__(self, text):
+        self.text = text
+        try:
+            self.root = Parser(text).parse()
+        except ValueError as e:
+            raise ValueError(f"Bad condition \"{text}\" in bbarfile: {e}")
+        self.names = names(self.root)
+        #Results by the values of the parameters the condition uses. Every scale point has the same columns of
+        #per-command parameters, so a condition on them is evaluated once for all scale points that agree on the rest
+        self.results = {}
+
+    def evaluate(self, params):
+        """
+        Evaluates the condition with params. Parameters given as Columns evaluate the condition for all
+        their rows at once, and the result is then a Column of results.
+        """
+        try:
+            return self.root.evaluate(params)
+        except (ValueError, TypeError, IndexError, ZeroDivisionError) as e:
+            raise ValueError(f"Can't evaluate condition \"{self.text}\": {e}")
+
+    def test(self, params, rows=None):
+        "Returns a truth value, or with rows, a list of rows truth values"
+        used = {name:params[name] for name in self.names | {aliases[n] for n in self.names if n in aliases} if name in params}
+        key = (freeze(used), rows)
+        if key not in self.results:
+            result = self.evaluate(used)
+            if rows is None:
+                self.results[key] = bool(result)
+            else:
+                self.results[key] = list(map(bool, result)) if isinstance(result, Column) else [bool(result)]*rows
+        return self.results[key]
+
+@lru_cache(maxsize=None)
+def compile_condition(text):
+    return Condition(text)
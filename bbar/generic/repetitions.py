@@ -0,0 +1,122 @@
+import math
+import shlex
+from statistics import NormalDist
+
+from bbar.constants import repetition_marker, warmup_marker, repetitions_marker, repetition_file_suffix
+
+#DOCUMENT: repetition policy of the benchmarks, in [benchmarks.repetitions]:
+#   min        = repetitions that always run (default 1)
+#   max        = repetitions at most (default min)
+#   warmup     = runs before the repetitions, whose results are discarded (default 0)
+#   ci_width   = target width of the confidence interval of the mean, relative to the mean (default 0, run max repetitions)
+#   confidence = confidence level of the interval (default 0.95)
+#   metric     = name of a regex metric in [benchmarks.metrics] to measure, instead of the wall time of each repetition
+#   Repetitions stop as soon as at least min have run and the interval is narrower than ci_width.
+#   Files of file-based metrics are moved to <file>.rep<r> after repetition r, and removed after warmup runs, so that
+#   a repetition doesn't overwrite the results of the one before it.
+#   The loop runs inside the generated batchfile, so SLURM jobs and local runs stop as soon as the target is reached.
+
+#Extracts the last match of a metric regex from a file, as Extraction_Engine does
+extract_script = 'import re,sys\n'\
+    'p=re.compile(sys.argv[1],re.M)\n'\
+    'v=[m.group("value") if "value" in p.groupindex else m.group(1) if p.groups else m.group(0) for m in p.finditer(open(sys.argv[2],errors="replace").read())]\n'\
+    'v and print(v[-1])'
+
+#bbar_repeat <min> <max> <warmup> <ci_width> <t quantiles> <metric regex> <metric file> <metric files> command...
+#t quantiles are the critical values of Student's t for 1, 2, ... degrees of freedom, comma separated,
+#metric files are the files of all file-based metrics, colon separated
+shell_functions = f"""bbar_ci_width() {{
+    awk -v samples="$1" -v t="$2" 'BEGIN {{
+        n = split(samples, x, " "); split(t, q, ",")
+        if (n < 2) {{ print -1; exit }}
+        for (i = 1; i <= n; i++) sum += x[i]
+        mean = sum/n
+        for (i = 1; i <= n; i++) ss += (x[i] - mean)^2
+        if (mean == 0) {{ print -1; exit }}
+        print 2*q[n-1]*sqrt(ss/(n-1)/n)/(mean < 0 ? -mean : mean)
+    }}'
+}}
+bbar_repeat() {{
+    local min=$1 max=$2 warmup=$3 target=$4 t=$5 regex=$6 file=$7 files f
+    IFS=: read -ra files <<< "$8"
+    shift 8
+    local out samples="" n=0 r code start value width=-1
+    out=$(mktemp)
+    for ((r = 0; r < warmup; r++)); do
+        echo {warmup_marker} $r
+        "$@" || {{ code=$?; rm -f "$out"; return $code; }}
+        for f in "${{files[@]}}"; do rm -f "$f"; done
+    done
+    for ((r = 0; r < max; r++)); do
+        echo {repetition_marker} $r
+        start=$(date +%s.%N)
+        if [ -n "$regex" ] && [ -z "$file" ]; then
+            "$@" | tee "$out"
+            code=${{PIPESTATUS[0]}}
+        else
+            "$@"
+            code=$?
+        fi
+        [ $code -eq 0 ] || {{ rm -f "$out"; return $code; }}
+        if [ -n "$regex" ]; then
+            value=$(python3 -c '{extract_script}' "$regex" "${{file:-$out}}")
+        else
+            value=$(awk -v start=$start -v end=$(date +%s.%N) 'BEGIN {{ print end - start }}')
+        fi
+        [ -n "$value" ] && samples="$samples $value" && n=$((n+1))
+        for f in "${{files[@]}}"; do [ -f "$f" ] && mv -f "$f" "$f{repetition_file_suffix}$r"; done
+        if [ $((r+1)) -ge $min ] && [ $n -ge 2 ] && awk -v t="$target" 'BEGIN {{ exit !(t > 0) }}'; then
+            width=$(bbar_ci_width "$samples" "$t")
+            awk -v w="$width" -v t="$target" 'BEGIN {{ exit !(w >= 0 && w <= t) }}' && {{ r=$((r+1)); break; }}
+        fi
+    done
+    rm -f "$out"
+    [ $n -ge 2 ] && width=$(bbar_ci_width "$samples" "$t")
+    echo {repetitions_marker} $r ci_width=$width
+}}"""
+
+def t_quantile(p, df):
+    "Quantile p of Student's t distribution with df degrees of freedom: exact for df 1 and 2, a Cornish-Fisher expansion above"
+    if df == 1:
+        return math.tan(math.pi*(p - 0.5))
+    if df == 2:
+        return (2*p - 1)*math.sqrt(2/(4*p*(1 - p)))
+    z = NormalDist().inv_cdf(p)
+    return z + (z**3 + z)/(4*df) \
+        + (5*z**5 + 16*z**3 + 3*z)/(96*df**2) \
+        + (3*z**7 + 19*z**5 + 17*z**3 - 15*z)/(384*df**3) \
+        + (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z)/(92160*df**4)
+
+class Repetition_Policy:
+    def __init__(self, config, metrics):
+        self.min = int(config.get("min", 1))
+        self.max = int(config.get("max", self.min))
+        self.warmup = int(config.get("warmup", 0))
+        self.ci_width = float(config.get("ci_width", 0))
+        self.confidence = float(config.get("confidence", 0.95))
+        self.metric = config.get("metric", "")
+        if self.min < 1 or self.max < self.min:
+            raise ValueError(f"[benchmarks.repetitions] needs 1 <= min <= max, got min = {self.min}, max = {self.max}")
+        if self.warmup < 0 or self.ci_width < 0:
+            raise ValueError("[benchmarks.repetitions] warmup and ci_width can't be negative")
+        if not 0 < self.confidence < 1:
+            raise ValueError(f"[benchmarks.repetitions] confidence must be between 0 and 1, got {self.confidence}")
+        self.regex, self.file = "", ""
+        if self.metric:
+            spec = metrics.get(self.metric)
+            if spec is None or "regex" not in spec:
+                raise ValueError(f"[benchmarks.repetitions] metric \"{self.metric}\" is not a regex metric in [benchmarks.metrics]")
+            self.regex, self.file = spec["regex"], spec.get("file", "")
+        self.files = list(dict.fromkeys(spec["file"] for spec in metrics.values() if "regex" in spec and spec.get("file")))
+
+    def quantiles(self):
+        p = (1 + self.confidence)/2
+        return ",".join(f"{t_quantile(p, df):.4f}" for df in range(1, max(self.max, 2)))
+
+    def prefix(self):
+        "The bbar_repeat call that a command line is prefixed with"
+        #Without a target width, samples aren't needed, and neither is the metric
+        regex = self.regex if self.ci_width > 0 else ""
+        file = self.file if self.ci_width > 0 else ""
+        files = ":".join(self.files)
+        return f"bbar_repeat {self.min} {self.max} {self.warmup} {self.ci_width:g} {self.quantiles()} {shlex.quote(regex)} {shlex.quote(file)} {shlex.quote(files)}"
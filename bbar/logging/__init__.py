@@ -1,4 +1,5 @@
 from enum import Enum
+from .profiling import span, traced, count, enable_profiling
 
 
 class Loglevel(Enum):
@@ -34,9 +35,15 @@ def debug(message, condition=True):
 def diagnostics(message, condition=True):
     log(message, Loglevel.DIAGNOSTICS, condition)
 
+def everything(message, condition=True):
+    log(message, Loglevel.EVERYTHING, condition)
+
 def set_verbosity(new_verbosity):
     global verbosity 
     if new_verbosity in [l.value for l in Loglevel]:
         verbosity = Loglevel(new_verbosity)
+        #Diagnostics include the profile of bbar's own phases, EVERYTHING also logs every span as it ends
+        if verbosity.value >= Loglevel.DIAGNOSTICS.value:
+            enable_profiling()
     else:
         print(f"No such verbose level: {new_verbosity}")
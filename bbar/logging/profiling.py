@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import threading
+from functools import wraps
+
+#Spans and counters of bbar's own work, recorded only when profiling is enabled (bbar --profile, or -vv and above)
+enabled = False
+events = []
+counters = {}
+counters_lock = threading.Lock()
+origin = time.perf_counter_ns()
+
+class Span:
+    "Times a phase of bbar, recorded as a complete event of the Chrome trace"
+    __slots__ = ("name", "start")
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        from bbar.logging import everything
+        duration = time.perf_counter_ns() - self.start
+        events.append((self.name, self.start, duration, threading.get_ident()))
+        everything(f"{self.name} took {duration/1e6:.3f} ms")
+        return False
+
+class Null_Span:
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+null_span = Null_Span()
+
+def span(name):
+    "with span(name): ... times the block when profiling is enabled, and costs one check otherwise"
+    return Span(name) if enabled else null_span
+
+def traced(name):
+    "Decorator for a span around every call of a function"
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return f(*args, **kwargs)
+            with Span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    if enabled:
+        #Submission and extraction count from worker threads
+        with counters_lock:
+            counters[name] = counters.get(name, 0) + n
+
+def enable_profiling():
+    global enabled
+    enabled = True
+
+def profile_summary():
+    "Lines summarizing the spans (calls, total, mean and max time per name) and the counters"
+    spans = {}
+    for name, _, duration, _ in events:
+        calls, total, longest = spans.get(name, (0, 0, 0))
+        spans[name] = (calls + 1, total + duration, max(longest, duration))
+    width = max([len(n) for n in list(spans) + list(counters)] + [4])
+    lines = [f"{'span'.ljust(width)}  {'calls':>7}  {'total ms':>10}  {'mean ms':>10}  {'max ms':>10}"]
+    for name, (calls, total, longest) in sorted(spans.items(), key=lambda s: -s[1][1]):
+        lines.append(f"{name.ljust(width)}  {calls:>7}  {total/1e6:>10.3f}  {total/calls/1e6:>10.3f}  {longest/1e6:>10.3f}")
+    if counters:
+        lines.append(f"{'counter'.ljust(width)}  {'count':>7}")
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name.ljust(width)}  {value:>7}")
+    return lines
+
+def write_chrome_trace(path):
+    "Writes the spans and counters in the Chrome trace event format, for chrome://tracing or Perfetto"
+    pid = os.getpid()
+    trace = [{"name": name, "ph": "X", "ts": (start - origin)/1000, "dur": duration/1000, "pid": pid, "tid": tid}
+             for name, start, duration, tid in events]
+    end = (time.perf_counter_ns() - origin)/1000
+    trace += [{"name": name, "ph": "C", "ts": end, "pid": pid, "tid": 0, "args": {name: value}} for name, value in counters.items()]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
@@ -1 +1 @@
-from .bbar_store import BBAR_Store
+from .bbar_store import BBAR_Store, BBAR_SQLite_Store, BBAR_Read_Only_Store, open_store
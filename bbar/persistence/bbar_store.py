@@ -1,64 +1,239 @@
+import os
+import json
 from .toml_store import TOML_Store
+from .sqlite_store import SQLite_Store
+from bbar.logging import info
+from bbar.util.boolean_parse import human_to_bool
+from bbar.constants import archive_jobids_name
+
 bbar_default_storage_path = ".bbar_state"
+bbar_default_sqlite_path = ".bbar_state.db"
 
-class BBAR_Store(TOML_Store):
+class BBAR_State:
+    """
+    The bbar project state, on top of the primitives of a backing store (TOML_Store or SQLite_Store).
+    Records that are written many at a time (scan cache entries, job results, job statuses and recorded jobs)
+    aren't flushed by their setters, call those in a transaction.
+    """
     generated_dirs_key = "generated_dirs"
     generated_batchfiles_key = "generated_batchfiles"
     output_files_key = "output_files"
+    jobids_key = "jobids"
+    job_results_key = "job_results"
+    job_status_key = "job_status"
+    workdir_files_key = "workdir_files"
+    scan_cache_key = "scan_cache"
+    adaptive_key = "adaptive"
+    history_plan_key = "history_plan"
+    resumes_key = "resumes"
+    submission_queue_key = "submission_queue"
+    recorded_jobs_key = "recorded_jobs"
     state_counter_key = "STATE_COUNTER"
     status_key = "status"
-    
-    def __init__(self, storage_path=bbar_default_storage_path):
-        super().__init__(storage_path)
 
     def get_state_counter(self):
-        return self.get(BBAR_Store.state_counter_key) or 0
+        return self.get(BBAR_State.state_counter_key) or 0
     
     def get_status(self):
-        return self.get(BBAR_Store.status_key) or None
+        return self.get(BBAR_State.status_key) or None
 
     def get_generated_dirs(self):
-        return self.get(BBAR_Store.generated_dirs_key) or {}
+        return self.get_map(BBAR_State.generated_dirs_key)
 
     def get_generated_batchfiles(self):
-        return self.get(BBAR_Store.generated_batchfiles_key) or {}
+        return self.get_map(BBAR_State.generated_batchfiles_key)
 
     def get_output_files(self):
-        return self.get(BBAR_Store.output_files_key) or {}
+        return self.get_map(BBAR_State.output_files_key)
+
+    def get_workdir_files(self):
+        return self.get_map(BBAR_State.workdir_files_key)
+
+    def get_jobids(self):
+        "Returns a map from batchfile name to job id"
+        return self.get_map(BBAR_State.jobids_key)
+
+    def get_job_results(self):
+        "Returns a map from batchfile name to the exit code and wall time of jobs run locally"
+        return self.get_map(BBAR_State.job_results_key)
+
+    def get_scan_entry(self, path):
+        "Returns the cached stat (size, mtime) of a scanned path"
+        return self.get_map_item(BBAR_State.scan_cache_key, path)
+
+    def get_job_statuses(self):
+        "Returns a map from job id to the last known scheduler record of the job"
+        return self.get_map(BBAR_State.job_status_key)
+
+    def get_adaptive(self):
+        "Returns the state of the adaptive search, see Adaptive_Search"
+        return self.get(BBAR_State.adaptive_key) or None
+
+    def get_jobid(self, batchfile_name):
+        return self.get_map_item(BBAR_State.jobids_key, batchfile_name)
+
+    def is_generated_dir(self, path):
+        return self.has_map_item(BBAR_State.generated_dirs_key, path)
+
+    def is_generated_batchfile(self, path):
+        return self.has_map_item(BBAR_State.generated_batchfiles_key, path)
+
+    def is_output_file(self, path):
+        return self.has_map_item(BBAR_State.output_files_key, path)
 
     def increment_state_counter(self):
         counter = self.get_state_counter()
-        self.set(BBAR_Store.state_counter_key, counter+1)
+        self.set(BBAR_State.state_counter_key, counter+1)
 
     def set_status(self, status):
-        self.store_value(BBAR_Store.status_key, status)
+        self.store_value(BBAR_State.status_key, status)
 
-    def add_generated_dir(self, new_dir):
-        dirs = self.get_generated_dirs()
-        if new_dir in dirs:
+    def add_to_map(self, key, item):
+        if self.has_map_item(key, item):
             return
-        dirs[new_dir] = True
+        self.set_map_item(key, item, True)
         self.increment_state_counter()
-        self.store_value(BBAR_Store.generated_dirs_key, dirs)
+        self.store()
+
+    def add_generated_dir(self, new_dir):
+        self.add_to_map(BBAR_State.generated_dirs_key, new_dir)
     
     def add_generated_batchfile(self, new_file):
-        files = self.get_generated_batchfiles()
-        if new_file in files:
-            return
-        files[new_file] = True
-        self.increment_state_counter()
-        self.store_value(BBAR_Store.generated_batchfiles_key, files)
+        self.add_to_map(BBAR_State.generated_batchfiles_key, new_file)
     
     def add_output_file(self, new_file):
-        files = self.get_output_files()
-        if new_file in files:
-            return
-        files[new_file] = True
+        self.add_to_map(BBAR_State.output_files_key, new_file)
+
+    def add_workdir_file(self, new_file):
+        self.add_to_map(BBAR_State.workdir_files_key, new_file)
+
+    def set_scan_entry(self, path, record):
+        self.set_map_item(BBAR_State.scan_cache_key, path, record)
+
+    def set_jobid(self, batchfile_name, jobid):
+        self.set_map_item(BBAR_State.jobids_key, batchfile_name, jobid)
         self.increment_state_counter()
-        self.store_value(BBAR_Store.output_files_key, files)
+        self.store()
+
+    def set_job_result(self, batchfile_name, result):
+        self.set_map_item(BBAR_State.job_results_key, batchfile_name, result)
+        self.increment_state_counter()
+
+    def set_job_status(self, jobid, record):
+        self.set_map_item(BBAR_State.job_status_key, str(jobid), record)
+
+    def get_history_plan(self):
+        return self.get(BBAR_State.history_plan_key) or {}
+
+    def set_history_plan(self, plan):
+        self.store_value(BBAR_State.history_plan_key, plan)
+
+    def get_resumes(self):
+        "Returns the commands resubmitted by each bbar run --resume, as {batchfile: [command indices]}"
+        return self.get(BBAR_State.resumes_key) or []
+
+    def set_resumes(self, resumes):
+        self.store_value(BBAR_State.resumes_key, resumes)
+
+    def get_submission_queue(self):
+        "Returns the batchfiles waiting to be submitted by bbar pump, in order"
+        return self.get(BBAR_State.submission_queue_key) or []
+
+    def set_submission_queue(self, queue):
+        self.store_value(BBAR_State.submission_queue_key, queue)
+
+    def is_recorded_job(self, jobid):
+        "Whether the runtimes of a job (its job id, or batchfile name for LOCAL jobs) are in the runtime history"
+        return self.has_map_item(BBAR_State.recorded_jobs_key, str(jobid))
+
+    def add_recorded_job(self, jobid):
+        self.set_map_item(BBAR_State.recorded_jobs_key, str(jobid), True)
+
+    def set_adaptive(self, state):
+        self.store_value(BBAR_State.adaptive_key, state)
+
+    def clear_jobid(self, batchfile_name):
+        self.del_map_item(BBAR_State.jobids_key, batchfile_name)
+        self.increment_state_counter()
+        self.store()
  
     def clear_generated_files(self):
-        self.store_value(BBAR_Store.generated_batchfiles_key, {})
-        self.store_value(BBAR_Store.generated_dirs_key, {})
-        self.store_value(BBAR_Store.output_files_key, {})
+        with self.transaction():
+            self.clear_map(BBAR_State.generated_batchfiles_key)
+            self.clear_map(BBAR_State.generated_dirs_key)
+            self.clear_map(BBAR_State.output_files_key)
+            self.clear_map(BBAR_State.workdir_files_key)
+            self.clear_map(BBAR_State.scan_cache_key)
+            self.clear_map(BBAR_State.jobids_key)
+            self.clear_map(BBAR_State.job_results_key)
+            self.clear_map(BBAR_State.job_status_key)
+            self.clear_map(BBAR_State.recorded_jobs_key)
+            self.delete(BBAR_State.adaptive_key)
+            self.set(BBAR_State.history_plan_key, {})
+            self.set(BBAR_State.resumes_key, [])
+            self.set(BBAR_State.submission_queue_key, [])
+
+class BBAR_Store(BBAR_State, TOML_Store):
+    def __init__(self, storage_path=bbar_default_storage_path, journal=False):
+        TOML_Store.__init__(self, storage_path, journal)
+
+class BBAR_SQLite_Store(BBAR_State, SQLite_Store):
+    dedicated_maps = [
+        BBAR_State.generated_dirs_key,
+        BBAR_State.generated_batchfiles_key,
+        BBAR_State.output_files_key,
+        BBAR_State.jobids_key,
+    ]
+
+    def __init__(self, storage_path=bbar_default_sqlite_path, read_only=False):
+        SQLite_Store.__init__(self, storage_path, read_only)
+
+class BBAR_Read_Only_Store(BBAR_State, TOML_Store):
+    """
+    The state of a project, e.g. a baseline, read into memory without creating, migrating or compacting
+    its store. Changes are kept in memory only. An extracted archive has no store, only the job ids of its batchfiles.
+    """
+    def __init__(self, persistence_config):
+        self.journal = False
+        self.transaction_depth = 0
+        self.pending_ops = []
+        backend = persistence_config.get("backend", "toml").lower()
+        if backend == "sqlite" and os.path.isfile(bbar_default_sqlite_path):
+            store = BBAR_SQLite_Store(read_only=True)
+            self.storage_path = store.storage_path
+            self.state = store.get_state()
+            store.connection.close()
+        else:
+            self.storage_path = bbar_default_storage_path
+            self.journal_path = f"{self.storage_path}.journal"
+            self.state = self.get_stored_state()
+        if not self.state and os.path.isfile(archive_jobids_name):
+            with open(archive_jobids_name) as f:
+                self.state[BBAR_State.jobids_key] = json.load(f)
+
+    def store(self):
+        self.pending_ops = []
+
+def migrate_toml_store(toml_path, store):
+    "Copies the contents of a TOML state file into store, and moves the TOML file out of the way"
+    info(f"Migrating project state from {toml_path} to {store.storage_path}")
+    old_state = BBAR_Store(toml_path).get_state()
+    with store.transaction():
+        for key, value in old_state.items():
+            store.set(key, value)
+    os.replace(toml_path, f"{toml_path}.migrated")
 
+def open_store(persistence_config, read_only=False):
+    "Opens the store configured in the [persistence] table of a bbarfile"
+    if read_only:
+        return BBAR_Read_Only_Store(persistence_config)
+    backend = persistence_config.get("backend", "toml").lower()
+    if backend == "toml":
+        return BBAR_Store(journal=human_to_bool(persistence_config.get("journal", False)))
+    elif backend == "sqlite":
+        migrate = not os.path.isfile(bbar_default_sqlite_path) and os.path.isfile(bbar_default_storage_path)
+        store = BBAR_SQLite_Store()
+        if migrate:
+            migrate_toml_store(bbar_default_storage_path, store)
+        return store
+    raise ValueError(f"Unknown persistence backend \"{backend}\", expected \"toml\" or \"sqlite\"")
@@ -0,0 +1,150 @@
+import json
+from contextlib import contextmanager
+from bbar.logging import debug, span, count
+
+default_storage_path = ".sqlite_store"
+
+class SQLite_Store:
+    """
+    Key-value store persisted in an SQLite database, with the same interface as TOML_Store.
+
+    Scalars live in the kv table. Maps live in map_items, keyed by (map, item), except for the
+    maps listed in dedicated_maps, which get a table of their own with the item as primary key.
+    A map also has an empty object in kv, so that an empty map reads as {} rather than None.
+    Membership checks and single-item updates are therefore indexed lookups, and nothing is
+    loaded up front.
+    """
+    dedicated_maps = []
+
+    def __init__(self, storage_path=default_storage_path, read_only=False):
+        if storage_path is not None:
+            self.storage_path = storage_path
+        self.transaction_depth = 0
+        import sqlite3
+        debug(f"Opening {self.storage_path}{' read-only' if read_only else ''}")
+        if read_only:
+            self.connection = sqlite3.connect(f"file:{self.storage_path}?mode=ro", uri=True)
+            return
+        self.connection = sqlite3.connect(self.storage_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS map_items (map TEXT NOT NULL, item TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (map, item))")
+            for table in self.dedicated_maps:
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (item TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def get_state(self):
+        state = {k:json.loads(v) for k,v in self.connection.execute("SELECT key, value FROM kv")}
+        for m, in self.connection.execute("SELECT DISTINCT map FROM map_items"):
+            state[m] = self.get_map(m)
+        for table in self.dedicated_maps:
+            state[table] = self.get_map(table)
+        return state
+
+    def load(self):
+        pass
+
+    def store(self):
+        if self.transaction_depth > 0:
+            return
+        with span("store.commit"):
+            count("store flushes")
+            self.connection.commit()
+
+    def begin(self):
+        self.transaction_depth += 1
+
+    def commit(self):
+        if self.transaction_depth == 0:
+            raise RuntimeError(f"commit() called on {self.storage_path} without begin()")
+        self.transaction_depth -= 1
+        self.store()
+
+    def rollback(self):
+        "Discard all uncommitted changes, and end any open transaction"
+        self.transaction_depth = 0
+        self.connection.rollback()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Defer commits until the block exits. Changes are committed even if the block raises,
+        since they describe files that already exist on disk.
+        """
+        self.begin()
+        try:
+            yield self
+        finally:
+            #Unless the block rolled back
+            if self.transaction_depth > 0:
+                self.commit()
+
+    def set(self, key, value):
+        self.delete_map_items(key)
+        if isinstance(value, dict):
+            for item, v in value.items():
+                self.set_map_item(key, item, v)
+            value = {}
+        self.connection.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def get(self, key):
+        row = self.connection.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        if row:
+            value = json.loads(row[0])
+            return self.get_map(key) if isinstance(value, dict) else value
+        return self.get_map(key) or None
+
+    def delete(self, key):
+        self.delete_map_items(key)
+        self.connection.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def store_value(self, key, value):
+        self.set(key,value)
+        self.store()
+
+    def get_map(self, key):
+        if key in self.dedicated_maps:
+            rows = self.connection.execute(f"SELECT item, value FROM {key}")
+        else:
+            rows = self.connection.execute("SELECT item, value FROM map_items WHERE map = ?", (key,))
+        return {item:json.loads(v) for item,v in rows}
+
+    def has_map_item(self, key, item):
+        if key in self.dedicated_maps:
+            row = self.connection.execute(f"SELECT 1 FROM {key} WHERE item = ?", (item,)).fetchone()
+        else:
+            row = self.connection.execute("SELECT 1 FROM map_items WHERE map = ? AND item = ?", (key, item)).fetchone()
+        return row is not None
+
+    def get_map_item(self, key, item, default=None):
+        if key in self.dedicated_maps:
+            row = self.connection.execute(f"SELECT value FROM {key} WHERE item = ?", (item,)).fetchone()
+        else:
+            row = self.connection.execute("SELECT value FROM map_items WHERE map = ? AND item = ?", (key, item)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_map_item(self, key, item, value):
+        self.connection.execute("INSERT OR IGNORE INTO kv (key, value) VALUES (?, '{}')", (key,))
+        if key in self.dedicated_maps:
+            self.connection.execute(f"INSERT OR REPLACE INTO {key} (item, value) VALUES (?, ?)", (item, json.dumps(value)))
+        else:
+            self.connection.execute("INSERT OR REPLACE INTO map_items (map, item, value) VALUES (?, ?, ?)", (key, item, json.dumps(value)))
+
+    def del_map_item(self, key, item):
+        if key in self.dedicated_maps:
+            self.connection.execute(f"DELETE FROM {key} WHERE item = ?", (item,))
+        else:
+            self.connection.execute("DELETE FROM map_items WHERE map = ? AND item = ?", (key, item))
+
+    def delete_map_items(self, key):
+        if key in self.dedicated_maps:
+            self.connection.execute(f"DELETE FROM {key}")
+        else:
+            self.connection.execute("DELETE FROM map_items WHERE map = ?", (key,))
+
+    def clear_map(self, key):
+        self.set(key, {})
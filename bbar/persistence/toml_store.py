@@ -1,35 +1,140 @@
-import toml
 import os
-from bbar.logging import debug
+import json
+from contextlib import contextmanager
+from bbar.logging import debug, warning, traced, count
 
 default_storage_path = ".toml_store"
 
+#Journal operations, one JSON list of ops per committed transaction:
+#   ["set", key, value]
+#   ["set_item", key, item, value]
+#   ["del_item", key, item]
+#   ["delete", key]
+def apply_op(state, op):
+    kind = op[0]
+    if kind == "set":
+        state[op[1]] = op[2]
+    elif kind == "set_item":
+        state.setdefault(op[1], {})[op[2]] = op[3]
+    elif kind == "del_item":
+        state.get(op[1], {}).pop(op[2], None)
+    elif kind == "delete":
+        state.pop(op[1], None)
+    else:
+        raise ValueError(f"Unknown journal operation {kind}")
+
 class TOML_Store:
-    def __init__(self, storage_path=default_storage_path):
+    """
+    Key-value store persisted as a TOML file.
+
+    Mutations are flushed by store(). Inside a transaction (begin()/commit() or `with store.transaction():`)
+    flushes are deferred until the outermost commit, so a batch of mutations costs a single write.
+
+    In journal mode, a flush appends the pending operations as one line to "<storage_path>.journal"
+    instead of rewriting the whole file. The journal is replayed and compacted into the TOML file
+    on load. A torn last line (crash mid-write) is dropped, so the state is always that of the last
+    complete commit.
+    """
+    def __init__(self, storage_path=default_storage_path, journal=False):
 
         if storage_path is not None:
             self.storage_path = storage_path
-        if os.path.isfile(self.storage_path):
-            debug(f"Loading {self.storage_path}")
-            self.state = toml.load(self.storage_path)
-        else:
-            self.state = {}
- 
+        self.journal_path = f"{self.storage_path}.journal"
+        self.journal = journal
+        self.transaction_depth = 0
+        self.pending_ops = []
+        self.load()
+        if os.path.isfile(self.journal_path):
+            self.compact()
+
     def get_state(self):
         return self.state
 
+    @traced("store.load")
     def get_stored_state(self):
-        return toml.load(self.storage_path)
+        state = {}
+        if os.path.isfile(self.storage_path):
+            import toml
+            debug(f"Loading {self.storage_path}")
+            state = toml.load(self.storage_path)
+        if os.path.isfile(self.journal_path):
+            debug(f"Replaying journal {self.journal_path}")
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        ops = json.loads(line)
+                    except json.JSONDecodeError:
+                        warning(f"Dropping incomplete transaction at the end of {self.journal_path}")
+                        break
+                    for op in ops:
+                        apply_op(state, op)
+        return state
 
     def load(self):
         self.state = self.get_stored_state()
-   
-    def store(self):
-        with open(self.storage_path,"w") as f:
+        self.pending_ops = []
+
+    def compact(self):
+        "Fold the journal into the TOML file"
+        self.write_state()
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+
+    @traced("store.write_state")
+    def write_state(self):
+        count("store flushes")
+        import toml
+        tmp_path = f"{self.storage_path}.tmp"
+        with open(tmp_path,"w") as f:
             toml.dump(self.state, f)
+        os.replace(tmp_path, self.storage_path)
+
+    @traced("store.append_journal")
+    def append_journal(self):
+        count("store flushes")
+        with open(self.journal_path,"a") as f:
+            f.write(json.dumps(self.pending_ops)+"\n")
+
+    def store(self):
+        if self.transaction_depth > 0 or not self.pending_ops:
+            return
+        if self.journal:
+            self.append_journal()
+        else:
+            self.write_state()
+        self.pending_ops = []
+
+    def begin(self):
+        self.transaction_depth += 1
+
+    def commit(self):
+        if self.transaction_depth == 0:
+            raise RuntimeError(f"commit() called on {self.storage_path} without begin()")
+        self.transaction_depth -= 1
+        self.store()
+
+    def rollback(self):
+        "Discard all uncommitted changes by reloading the stored state, and end any open transaction"
+        self.transaction_depth = 0
+        self.load()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Defer flushes until the block exits. Changes are committed even if the block raises,
+        since they describe files that already exist on disk.
+        """
+        self.begin()
+        try:
+            yield self
+        finally:
+            #Unless the block rolled back
+            if self.transaction_depth > 0:
+                self.commit()
 
     def set(self, key, value):
         self.state[key] = value
+        self.pending_ops.append(["set", key, value])
 
     def get(self, key):
         if key in self.state:
@@ -37,6 +142,30 @@ class TOML_Store:
         else:
             return None
 
+    def delete(self, key):
+        apply_op(self.state, ["delete", key])
+        self.pending_ops.append(["delete", key])
+
     def store_value(self, key, value):
         self.set(key,value)
         self.store()
+
+    def get_map(self, key):
+        return self.state.get(key) or {}
+
+    def has_map_item(self, key, item):
+        return item in self.get_map(key)
+
+    def get_map_item(self, key, item, default=None):
+        return self.get_map(key).get(item, default)
+
+    def set_map_item(self, key, item, value):
+        apply_op(self.state, ["set_item", key, item, value])
+        self.pending_ops.append(["set_item", key, item, value])
+
+    def del_map_item(self, key, item):
+        apply_op(self.state, ["del_item", key, item])
+        self.pending_ops.append(["del_item", key, item])
+
+    def clear_map(self, key):
+        self.set(key, {})
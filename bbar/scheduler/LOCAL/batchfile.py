@@ -2,6 +2,8 @@ from bbar.generic import Environment_variables, LMOD_modules
 from bbar.generic import Commands
 from bbar.scheduler.base import BaseBatchfile
 from bbar.scheduler.SLURM.batchfile import SLURM_batch_params
+from bbar.util.templates import render
+from bbar.util.boolean_parse import human_to_bool
 
 #DOCUMENT: Assumptions for sbatch files:
 #   1. sbatch files mainly differ by process count in a benchmark case, for scale benchmarks
@@ -26,13 +28,20 @@ class Shellscript_Batchfile(BaseBatchfile):
         self.batch_params = FAKE_SLURM_batch_params(config, n_procs)
         self.output = self.batch_params.param_dict["output"]
         self.jobname = self.batch_params.param_dict["job-name"]
+        self.n_procs = self.batch_params.n_procs
         format_params = self.batch_params.format_params
 
         self.modules = LMOD_modules(config)
         self.commands = Commands(config["benchmarks"], format_params)
+        self.commands.timestamps = human_to_bool(config["history"]["enabled"])
         self.setup = config["setup"]
         self.cleanup = config["cleanup"]
-        self.filename = config["batchfile_name"].format(**format_params)
+        self.filename = render(config["batchfile_name"], format_params)
+        super().__init__(self.filename)
+
+    def add_suffix(self, suffix):
+        super().add_suffix(suffix)
+        self.batch_params.param_dict["output"] = self.output
 
     def __repr__(self):
         newline = "\n"
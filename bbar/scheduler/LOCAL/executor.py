@@ -0,0 +1,100 @@
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+from bbar.constants import BBAR_SUCCESS, BBAR_FAILURE
+from bbar.logging import info, debug, warning, error, count
+from bbar.util.boolean_parse import human_to_bool
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def cpu_list_string(cpus):
+    return ",".join([str(c) for c in cpus])
+
+class Local_Executor:
+    """
+    Runs shell script batchfiles concurrently on the local machine.
+
+    Each job needs n_procs cores. Jobs are started in order whenever enough cores of the budget are free,
+    smaller jobs further down the queue may start ahead of a larger job that doesn't fit yet.
+    With pinning enabled, every running job gets a disjoint set of CPUs, set by taskset. Setting the affinity
+    in a preexec_fn isn't safe while the threads waiting for other jobs are running.
+    """
+    def __init__(self, local_config):
+        cpus = available_cpus()
+        cores = int(local_config.get("cores", 0))
+        if cores > 0:
+            cpus = cpus[:cores]
+        self.cpus = cpus
+        self.max_jobs = int(local_config.get("max_jobs", 0)) or len(cpus)
+        self.pin = human_to_bool(local_config.get("pin", True))
+        if self.pin and shutil.which("taskset") is None:
+            warning("[local] pin = true needs taskset (util-linux), running jobs without pinning them to CPUs")
+            self.pin = False
+
+    def cores_needed(self, batchfile):
+        n_procs = max(1, int(batchfile.n_procs))
+        if n_procs > len(self.cpus):
+            warning(f"{batchfile.filename} needs {n_procs} cores, but only {len(self.cpus)} are available. Running it on all of them")
+            return len(self.cpus)
+        return n_procs
+
+    def launch(self, batchfile, cpus, finished):
+        pin = ["taskset", "-c", cpu_list_string(cpus)] if self.pin else []
+        count("subprocess calls")
+        with open(batchfile.output, "w") as output:
+            process = subprocess.Popen(pin + ["/usr/bin/bash", "-c", f"source {batchfile.filename}"],
+                                       stdout=output, stderr=subprocess.STDOUT)
+        start = time.monotonic()
+        def wait():
+            exit_code = process.wait()
+            finished.put((batchfile, cpus, exit_code, time.monotonic() - start))
+        threading.Thread(target=wait, daemon=True).start()
+        return process
+
+    def run(self, batchfiles, store):
+        pending = [(b, self.cores_needed(b)) for b in batchfiles]
+        free = list(self.cpus)
+        running = {}
+        finished = queue.Queue()
+        failed = []
+        debug(f"Running {len(pending)} batchfiles on {len(self.cpus)} cores, at most {self.max_jobs} at a time")
+        try:
+            #Results are flushed to the store once, when all jobs have finished or on an interrupt
+            with store.transaction():
+                while pending or running:
+                    for job in list(pending):
+                        batchfile, cores = job
+                        if cores > len(free) or len(running) >= self.max_jobs:
+                            continue
+                        cpus, free = free[:cores], free[cores:]
+                        pending.remove(job)
+                        debug(f"Starting {batchfile.filename} on cpus {cpu_list_string(cpus)}")
+                        running[batchfile.filename] = self.launch(batchfile, cpus, finished)
+
+                    batchfile, cpus, exit_code, wall_time = finished.get()
+                    del running[batchfile.filename]
+                    free = sorted(free + cpus)
+                    info(f"{batchfile.filename} finished with exit code {exit_code} in {wall_time:.2f} s")
+                    if exit_code != 0:
+                        failed.append(batchfile.filename)
+                    store.set_job_result(batchfile.filename, {
+                        "exit_code": exit_code,
+                        "wall_time": wall_time,
+                        "cpus": cpu_list_string(cpus),
+                    })
+        except KeyboardInterrupt:
+            for process in running.values():
+                process.terminate()
+            raise
+
+        if failed:
+            error(f"{len(failed)} batchfile(s) exited with a nonzero exit code: {', '.join(failed)}")
+            return BBAR_FAILURE
+        return BBAR_SUCCESS
@@ -1,7 +1,9 @@
 from bbar.scheduler.base import BaseScheduler
 from bbar.scheduler.plugins import register_scheduler
 from .batchfile import Shellscript_Batchfile
+from .executor import Local_Executor
 import subprocess
+from bbar.logging import count
 
 #TODO: maybe change bash to sh
 @register_scheduler("LOCAL")
@@ -15,7 +17,19 @@ class Local_Scheduler(BaseScheduler):
 
     def schedule_job(batchfile):
         args = ["/usr/bin/bash", "-c", f"source {batchfile.filename}"]
+        count("subprocess calls")
         subprocess.check_call(args)
 
-    def get_stats():
+    def run_jobs(batchfiles, store, config):
+        "Runs batchfiles concurrently, packed onto the cores of this machine"
+        return Local_Executor(config["local"]).run(batchfiles, store)
+
+    def cancel_job(jobid):
         pass
+
+    def get_stats(batchfiles, store, config):
+        stats = {}
+        for filename, result in store.get_job_results().items():
+            state = "COMPLETED" if result["exit_code"] == 0 else "FAILED"
+            stats[filename] = dict(result, state=state, elapsed=f"{result['wall_time']:.2f}s")
+        return {b.filename:stats[b.filename] for b in batchfiles if b.filename in stats}
@@ -1,6 +1,12 @@
 from bbar.generic import LMOD_modules, Commands
 from bbar.scheduler.base import BaseBatchfile
 from bbar.logging import debug
+from bbar.constants import command_marker, step_marker, time_marker
+from bbar.util.templates import render, render_all
+from .status import query_job_states
+from bbar.util.boolean_parse import human_to_bool
+import copy
+import re
 import subprocess
 
 #DOCUMENT: Assumptions for sbatch files:
@@ -10,7 +16,8 @@ import subprocess
 #       node 1 gets 4
 #       node 2 gets 2
 #   instead of the balanced 3 and 3
-#DOCUMENT:formatted values can only refer to parameters declared earlier than them (and "n","N","jobname","output")
+#DOCUMENT:formatted values can refer to any other parameter as {SBATCH_<param>}, in any order, and to {procs_on_node}.
+#   Parameters are resolved in dependency order, circular references are an error.
 
 #DOCUMENT:Four parameters are guaranteed to be in the SBATCH configuration:
 # --n
@@ -28,45 +35,124 @@ class SLURM_batch_params:
         self.n_nodes = self.param_dict["N"] = ((n_procs+(max_procs_per_node-1))//max_procs_per_node)    
         self.procs_on_node = min(self.n_procs, max_procs_per_node)
 
-        #TODO: this will probably fail spectacularily if referring to later batch params
-        #      restrict this to only non-formatted params somehow, how to detect? regex? maybe python provides?
+        params = {f"{self.FORMAT_PREFIX}_{k}":v for k,v in self.param_dict.items()}
+        params["procs_on_node"] = self.procs_on_node
+        self.param_dict = render_all(self.param_dict, params, prefix=f"{self.FORMAT_PREFIX}_")
         self.format_params = {f"{self.FORMAT_PREFIX}_{k}":v for k,v in self.param_dict.items()}
-        for k, v in self.param_dict.items():
-            if isinstance(v, str):
-                self.param_dict[k] = v.format(**self.format_params, procs_on_node = self.procs_on_node)
-            self.format_params[f"{self.FORMAT_PREFIX}_{k}"] = self.param_dict[k]
+        self.format_params["procs_on_node"] = self.procs_on_node
         
     def __repr__(self):
         return "\n".join([f"#{self.BATCHFILE_PREFIX} --{k}={v}" for k,v in self.param_dict.items() if len(k) > 1])+"\n"\
                 + "\n".join([f"#{self.BATCHFILE_PREFIX} -{k} {v}" for k,v in self.param_dict.items() if len(k) == 1])\
 
+slurm_filename_regex = re.compile(r"%(\d*)([%AaJjx])")
+
+def resolve_slurm_filename(pattern, jobid=None, jobname=None):
+    """
+    Substitutes the sbatch filename patterns %A, %a, %j, %J, %x and %% in pattern.
+    Array task job ids are of the form "<array job id>_<task id>".
+    Fields that can't be resolved (e.g. %j before submission) become a "*" glob.
+    """
+    array_id, _, task_id = str(jobid).partition("_") if jobid is not None else (None, None, None)
+    fields = {
+        "A": array_id,
+        "a": task_id or None,
+        "j": None if task_id else array_id,
+        "J": None if task_id else array_id,
+        "x": jobname,
+    }
+    def replace(m):
+        width, field = m.groups()
+        if field == "%":
+            return "%"
+        value = fields[field]
+        if value is None:
+            return "*"
+        return str(value).zfill(int(width)) if width else str(value)
+    return slurm_filename_regex.sub(replace, pattern)
+
+#DOCUMENT: in packed batchfiles ([packing] ranks > 0), each command runs as a job step of `ranks` processes,
+#   started in the background as soon as the running steps leave room for it in the allocation, and joined with wait.
+#   The output of each step goes to a file of its own, which is printed after all steps have finished, after the
+#   command's marker line and followed by "BBAR_STEP <i> exit_code=<code>", so results are attributed as usual.
+#   The batchfile exits with 1 if any step failed.
 class SLURM_commands(Commands):
+    srun_options = ""
+    step_ranks = 0
+    step_options = ""
+    max_steps = 1
+
+    def pack(self, ranks, step_options, n_procs):
+        "Runs the commands as concurrent job steps of ranks processes each, as many as fit in n_procs"
+        self.step_ranks = ranks
+        self.step_options = step_options
+        self.max_steps = max(1, n_procs // ranks)
+
+    def packed(self):
+        srun = " ".join(["srun", self.step_options, f"-n {self.step_ranks}"]) if self.step_options else f"srun -n {self.step_ranks}"
+        repeat = self.repeat()
+        #For the runtime history, each step is timed by itself, and its output printed between its start and end times
+        stamp = lambda i, event: f"date +%s.%N > \"$bbar_steps/{i}.{event}\"; " if self.timestamps else ""
+        print_stamp = lambda event: f"    echo {time_marker} $(cat \"$bbar_steps/$i.{event}\" 2>/dev/null)\n" if self.timestamps else ""
+        steps = "\n".join([f"bbar_slot; {{ {stamp(i, 'start')}( cd {c.workdir} && {c.env_vars} {repeat}{srun} {c.argv_string} ) > \"$bbar_steps/{i}.out\" 2>&1; echo $? > \"$bbar_steps/{i}.code\"; {stamp(i, 'end')}}} &" for i, c in enumerate(self.commands)])
+        return self.functions() +\
+            "bbar_steps=$(mktemp -d)\n"\
+            f"bbar_slot() {{ while [ $(jobs -rp | wc -l) -ge {self.max_steps} ]; do wait -n; done; }}\n"\
+            f"{steps}\n"\
+            "wait\n"\
+            "bbar_failed=0\n"\
+            f"for ((i = 0; i < {len(self.commands)}; i++)); do\n"\
+            f"{print_stamp('start')}"\
+            f"    echo {command_marker} $i\n"\
+            "    cat \"$bbar_steps/$i.out\"\n"\
+            "    code=$(cat \"$bbar_steps/$i.code\" 2>/dev/null || echo 1)\n"\
+            f"    echo {step_marker} $i exit_code=$code\n"\
+            f"{print_stamp('end')}"\
+            "    [ \"$code\" -eq 0 ] || bbar_failed=1\n"\
+            "done\n"\
+            "rm -rf \"$bbar_steps\"\n"\
+            "(exit $bbar_failed)"
+
     def __repr__(self):
-        return "\n".join([f"pushd {c.workdir} &>/dev/null && {c.env_vars} srun {c.argv_string} && popd &> /dev/null" for c in self.commands])
+        if self.step_ranks:
+            return self.packed()
+        srun = f"srun {self.srun_options}" if self.srun_options else "srun"
+        repeat = self.repeat()
+        return self.functions() + self.timed([f"echo {command_marker} {i} && pushd {c.workdir} &>/dev/null && {c.env_vars} {repeat}{srun} {c.argv_string} && popd &> /dev/null; bbar_exit {i}" for i, c in enumerate(self.commands)])
     
 class SLURM_Batchfile(BaseBatchfile):
     def __init__(self, config, n_procs):                                        
         self.sbatch_params = SLURM_batch_params(config, n_procs)
+        self.n_procs = self.sbatch_params.n_procs
         self.output = self.sbatch_params.param_dict["output"]
         self.jobname = self.sbatch_params.param_dict["job-name"]
         format_params = self.sbatch_params.format_params
 
         self.modules = LMOD_modules(config)
         self.commands = SLURM_commands(config["benchmarks"], format_params)
-        self.setup = config["setup"].format(**format_params)
-        self.cleanup = config["cleanup"].format(**format_params)
-        self.filename = config["batchfile_name"].format(**format_params)
-        self.env_vars = [f"{e}={val.format(**format_params)}" for e,val in config["env_vars"].items()]
+        self.commands.timestamps = human_to_bool(config["history"]["enabled"])
+        step_ranks = int(render(config["packing"]["ranks"], format_params))
+        if step_ranks > 0:
+            self.commands.pack(step_ranks, render(config["packing"]["step_options"], format_params), self.n_procs)
+        self.setup = render(config["setup"], format_params)
+        self.cleanup = render(config["cleanup"], format_params)
+        self.filename = render(config["batchfile_name"], format_params)
+        super().__init__(self.filename)
+        self.env_vars = [f"{e}={render(val, format_params)}" for e,val in config["env_vars"].items()]
+
+    def add_suffix(self, suffix):
+        super().add_suffix(suffix)
+        self.sbatch_params.param_dict["output"] = self.output
 
     def get_stats(self):
-        if "jobid" not in self.__dict__ or not self.jobid:
+        "Queries the scheduler for this job only, see SLURM_Scheduler.get_stats for querying many jobs"
+        jobid = self.get_jobid()
+        if jobid is None:
             return {}
-        sacct_output = suprocess.run(["sacct","-p","-j",f"{self.jobid}"]).stdout.decode()
-        lines = sacct_output.split("\n")
-        header = lines[0].split("|")
-        lines = lines[1:]
-        data = [{k:v for k,v in zip(header,l.split("|")) if v != ""} for l in lines if l]
-        return data
+        return query_job_states([jobid]).get(str(jobid), {})
+
+    def get_output(self):
+        return resolve_slurm_filename(self.output, self.get_jobid(), self.jobname)
 
     def run(self):
         pass
@@ -80,3 +166,75 @@ class SLURM_Batchfile(BaseBatchfile):
             f"{newline.join(['export '+e for e in self.env_vars])}\n\n"\
             f"{self.commands}\n"\
             f"{newline+self.cleanup+newline if self.cleanup else ''}"
+
+#DOCUMENT: in array mode, all scale points are submitted as the tasks of a single sbatch --array job.
+#   SLURM gives every array task the same allocation, so the array requests the allocation of the largest
+#   scale point, and each task launches its commands with an explicit srun -n/-N.
+#   Only parameters that describe the allocation size may differ between scale points.
+class SLURM_Array_Batchfile(BaseBatchfile):
+    "A single sbatch --array batchfile running one scale point per array task, selected by SLURM_ARRAY_TASK_ID"
+    task_params = ["n", "N", "gres", "output"]
+
+    @staticmethod
+    def incompatible_params(batchfiles):
+        "Returns the sbatch params, other than the allocation size, that differ between batchfiles"
+        first = batchfiles[0].sbatch_params.param_dict
+        differing = set()
+        for batchfile in batchfiles[1:]:
+            params = batchfile.sbatch_params.param_dict
+            differing |= {k for k in set(first) | set(params) if first.get(k) != params.get(k)}
+        return sorted(differing - set(SLURM_Array_Batchfile.task_params))
+
+    def __init__(self, config, batchfiles):
+        self.tasks = batchfiles
+        largest = max(batchfiles, key=lambda b: b.sbatch_params.n_procs)
+        format_params = largest.sbatch_params.format_params
+
+        self.sbatch_params = copy.copy(largest.sbatch_params)
+        self.sbatch_params.param_dict = dict(largest.sbatch_params.param_dict)
+        self.output = self.sbatch_params.param_dict["output"] = render(config["array_output"], format_params)
+        self.sbatch_params.param_dict["array"] = f"0-{len(batchfiles)-1}"
+        #The array is a single submission, so SLURM throttles its tasks instead of bbar pump
+        max_in_flight = int(config["submission"]["max_in_flight"])
+        if max_in_flight > 0:
+            self.sbatch_params.param_dict["array"] += f"%{max_in_flight}"
+        self.jobname = self.sbatch_params.param_dict["job-name"]
+        self.modules = largest.modules
+        self.filename = render(config["array_batchfile_name"], format_params)
+        super().__init__(self.filename)
+
+        for task_id, task in enumerate(self.tasks):
+            task.array_task_id = task_id
+            task.output = self.output
+            task.commands.srun_options = f"-n {task.sbatch_params.n_procs} -N {task.sbatch_params.n_nodes}"
+
+    def set_jobid(self, jobid):
+        super().set_jobid(jobid)
+        for task in self.tasks:
+            task.set_jobid(f"{jobid}_{task.array_task_id}")
+
+    def clear_jobid(self):
+        super().clear_jobid()
+        for task in self.tasks:
+            task.clear_jobid()
+
+    def get_output(self):
+        return resolve_slurm_filename(self.output, self.get_jobid(), self.jobname)
+
+    def task_body(self, task):
+        newline = "\n"
+        return  f"{task.setup+newline if task.setup else ''}"\
+            f"{newline.join(['export '+e for e in task.env_vars])+newline if task.env_vars else ''}"\
+            f"{task.commands}\n"\
+            f"{task.cleanup+newline if task.cleanup else ''}"
+
+    def __repr__(self):
+        newline = "\n"
+        cases = "".join([f"{task.array_task_id})\n{self.task_body(task)};;\n" for task in self.tasks])
+        return  "#!/bin/bash\n"\
+            f"{self.sbatch_params}\n"\
+            "\n#this file was generated from a configuration file\n"\
+            f"{str(self.modules)+newline if self.modules else ''}\n"\
+            "case $SLURM_ARRAY_TASK_ID in\n"\
+            f"{cases}"\
+            "esac\n"
@@ -1,13 +1,21 @@
-from bbar.scheduler.base import BaseScheduler
+from bbar.scheduler.base import BaseScheduler, finished_states
 from bbar.scheduler.plugins import register_scheduler
-from .batchfile import SLURM_Batchfile
+from .batchfile import SLURM_Batchfile, SLURM_Array_Batchfile
+from .status import query_job_states
+from bbar.logging import span, count
 
+import re
 import subprocess
+import time
+
+jobid_regex = re.compile(r"Submitted batch job (\d+)")
 
 @register_scheduler("SLURM")
 class SLURM_Scheduler(BaseScheduler):
-    Batchfile         = SLURM_Batchfile
-    jobs              = []
+    Batchfile             = SLURM_Batchfile
+    ArrayBatchfile        = SLURM_Array_Batchfile
+    jobs                  = []
+    concurrent_submission = True
 
     def __init__(self):
         #TODO: import state from BBAR_Store
@@ -15,8 +23,40 @@ class SLURM_Scheduler(BaseScheduler):
         
 
     def schedule_job(batchfile):
+        "Submits batchfile with sbatch, returns the job id"
         args = ["sbatch", batchfile.filename]
-        subprocess.check_call(args)
+        count("subprocess calls")
+        try:
+            with span("sbatch"):
+                result = subprocess.run(args, check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            raise Exception(f"sbatch {batchfile.filename} failed with exit code {e.returncode}: {e.stderr.strip()}")
+        m = jobid_regex.search(result.stdout)
+        if not m:
+            raise Exception(f"Could not find a job id in the output of sbatch {batchfile.filename}: {result.stdout.strip()}")
+        return m.group(1)
 
-    def get_stats():
-        pass
+    def cancel_job(jobid):
+        count("subprocess calls")
+        subprocess.run(["scancel", str(jobid)], check=True, capture_output=True)
+
+    def get_stats(batchfiles, store, config):
+        """
+        Returns the sacct/squeue record of each submitted batchfile. Records are cached in the store,
+        and only jobs that haven't finished and whose record is older than [status] ttl seconds are queried,
+        all in one call.
+        """
+        ttl = float(config["status"]["ttl"])
+        jobids = {b.filename:str(b.get_jobid()) for b in batchfiles if b.get_jobid() is not None}
+        cache = store.get_job_statuses()
+        now = time.time()
+        stale = [j for j in jobids.values() if j not in cache
+                 or (cache[j]["state"] not in finished_states and now - cache[j]["time"] > ttl)]
+        if stale:
+            records = query_job_states(stale)
+            with store.transaction():
+                for jobid in stale:
+                    if jobid in records:
+                        cache[jobid] = dict(records[jobid], time=now)
+                        store.set_job_status(jobid, cache[jobid])
+        return {name:cache[j] for name,j in jobids.items() if j in cache}
@@ -0,0 +1,87 @@
+import re
+import subprocess
+from bbar.logging import debug, warning, traced, count
+
+#Pending array tasks are reported by sacct and squeue as a single line, e.g. 1234_[0-7%2]
+array_range_regex = re.compile(r"^(\d+)_\[([^\]]*)\]$")
+#Job ids per sacct/squeue call, keeps the command line at a sane length
+query_chunk_size = 500
+
+def expand_jobid(jobid):
+    m = array_range_regex.match(jobid)
+    if not m:
+        return [jobid]
+    array_id, spec = m.groups()
+    jobids = []
+    for part in spec.split("%")[0].split(","):
+        first, _, last = part.partition("-")
+        jobids += [f"{array_id}_{i}" for i in range(int(first), int(last or first)+1)]
+    return jobids
+
+def parse_sacct(output):
+    "Parses the output of sacct --parsable2 into a map from job id to record"
+    lines = [l for l in output.split("\n") if l]
+    if not lines:
+        return {}
+    header = lines[0].split("|")
+    records = {}
+    for line in lines[1:]:
+        row = dict(zip(header, line.split("|")))
+        record = {
+            #e.g. "CANCELLED by 1000"
+            "state": row.get("State", "UNKNOWN").split(" ")[0],
+            "exit_code": row.get("ExitCode", ""),
+            "elapsed": row.get("Elapsed", ""),
+        }
+        for jobid in expand_jobid(row["JobID"]):
+            records[jobid] = record
+    return records
+
+def parse_squeue(output):
+    records = {}
+    for line in output.split("\n"):
+        if not line:
+            continue
+        jobid, _, state = line.partition("|")
+        for j in expand_jobid(jobid):
+            records[j] = {"state": state}
+    return records
+
+@traced("sacct")
+def sacct(jobids):
+    count("subprocess calls")
+    args = ["sacct", "--allocations", "--parsable2", "--format=JobID,State,ExitCode,Elapsed", "-j", ",".join(jobids)]
+    return parse_sacct(subprocess.run(args, check=True, capture_output=True, text=True).stdout)
+
+@traced("squeue")
+def squeue(jobids):
+    """
+    Without accounting, jobs that have left the queue can only be known to have finished.
+    If squeue fails, no records are returned, so that the jobs are queried again by the next status call.
+    """
+    count("subprocess calls")
+    args = ["squeue", "--noheader", "--format=%i|%T", "-j", ",".join(jobids)]
+    try:
+        result = subprocess.run(args, capture_output=True, text=True)
+    except OSError as e:
+        warning(f"Could not query job states, neither sacct nor squeue can be run: {e}")
+        return {}
+    #squeue fails with "Invalid job id specified" if none of the jobs are in the queue anymore
+    if result.returncode != 0 and "Invalid job id" not in result.stderr:
+        warning(f"squeue failed with exit code {result.returncode}: {result.stderr.strip()}")
+        return {}
+    records = parse_squeue(result.stdout) if result.returncode == 0 else {}
+    return {j:records.get(j, {"state": "FINISHED"}) for j in jobids}
+
+def query_job_states(jobids):
+    "Queries the states of all jobids with one sacct call (per chunk), falling back to squeue"
+    jobids = [str(j) for j in jobids]
+    records = {}
+    for i in range(0, len(jobids), query_chunk_size):
+        chunk = jobids[i:i+query_chunk_size]
+        try:
+            records.update(sacct(chunk))
+        except (OSError, subprocess.CalledProcessError) as e:
+            debug(f"sacct failed, falling back to squeue: {e}")
+            records.update(squeue(chunk))
+    return records
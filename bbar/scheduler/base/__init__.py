@@ -1,2 +1,2 @@
 from .batchfile import BaseBatchfile
-from .scheduler import BaseScheduler
+from .scheduler import BaseScheduler, finished_states
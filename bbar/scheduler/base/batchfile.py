@@ -1,6 +1,16 @@
+import os
+
+def suffixed(name, suffix):
+    "Inserts suffix before the extension of name, unless it's already in the name"
+    if suffix in name:
+        return name
+    root, ext = os.path.splitext(name)
+    return f"{root}{suffix}{ext}"
+
 class BaseBatchfile:
     def __init__(self, filename):
         self.filename = filename
+        self.store = None
         self.__dict = {"filename": filename}
 
     def set(self, key, value):
@@ -14,11 +24,35 @@ class BaseBatchfile:
     def get_state(self):
         return self.__dict
 
+    def add_suffix(self, suffix):
+        "Suffixes the filename and output of a batchfile that is a shard or resubmission of another one"
+        self.filename = suffixed(self.filename, suffix)
+        self.__dict["filename"] = self.filename
+        self.output = suffixed(self.output, suffix)
+
+    def attach_store(self, store):
+        "Persist job ids in store, and pick up the job id of an earlier submission"
+        self.store = store
+        jobid = store.get_jobid(self.filename)
+        if jobid is not None:
+            self.set("jobid", jobid)
+
     def set_jobid(self, jobid):
         self.set("jobid", jobid)
+        if self.store is not None:
+            self.store.set_jobid(self.filename, jobid)
+
+    def clear_jobid(self):
+        self.__dict.pop("jobid", None)
+        if self.store is not None:
+            self.store.clear_jobid(self.filename)
 
     def get_jobid(self):
-        return get("jobid")
+        return self.get("jobid")
+
+    def get_output(self):
+        "The output file of the job, with any scheduler-specific filename patterns resolved"
+        return self.output
 
     def get_filename(self):
         return self.filename
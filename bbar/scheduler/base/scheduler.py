@@ -1,10 +1,23 @@
 from functools import partial
 
+#Job states after which a job won't change anymore.
+#FINISHED is used when a job has left the queue but its outcome is unknown
+finished_states = ["COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL",
+                   "PREEMPTED", "BOOT_FAIL", "DEADLINE", "FINISHED"]
+
 class BaseScheduler:
-    Batchfile            = None
-    schedule_batchjob    = None
-    get_stats            = None
-    name                 = "Unknown scheduler"
+    Batchfile             = None
+    #Batchfile type taking (config, batchfiles), submitting all batchfiles as one array job
+    ArrayBatchfile        = None
+    schedule_batchjob     = None
+    cancel_job            = None
+    #Optional replacement for submitting batchfiles one by one, run_jobs(batchfiles, store, config) -> BBAR_SUCCESS/BBAR_FAILURE
+    run_jobs              = None
+    #get_stats(batchfiles, store, config) -> {batchfile name: {"state": ..., ...}}
+    get_stats             = None
+    name                  = "Unknown scheduler"
+    #Whether schedule_job may be called from several threads at once
+    concurrent_submission = False
 
     def __init__(self):
         pass
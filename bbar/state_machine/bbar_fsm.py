@@ -1,7 +1,7 @@
 from statemachine import StateMachine, State
 from statemachine import exceptions as statemachine_exceptions
 from bbar.persistence import BBAR_Store
-from bbar.logging import info, debug, error
+from bbar.logging import info, debug, error, warning
 from bbar.constants import BBAR_SUCCESS
 
 #TODO: save state in store, requires init()?
@@ -13,26 +13,37 @@ class BBAR_FSM(StateMachine):
     generated = State("generated")
     running = State("running")
     completed = State("completed")
-    #TODO: add partially completed state, if cancelled but some jobs have finished
+    #Finished, but some commands failed or never ran, see bbar.bbar.completion
+    partial = State("partial")
 
     #These can wrap back because they may fail
     generate = init.to(generated, init)
     start = generated.to(running, generated)
 
-    complete = running.to(completed)
+    complete = running.to(completed, partial)
+    #Resubmit the failed and missing commands, or stay partial if that fails
+    resume = partial.to(running, partial)
+    #Adaptive search: generate the next round, or stay when the search is done. A partial round is refined on the
+    #commands that completed
+    refine = completed.to(generated, completed) | partial.to(generated, partial)
     
     #These can wrap back because the user may cancel the transition
     cancel = running.to(generated, running)
-    #TODO: REMOVE running -> purge once we have a way to detect completion OR a way to cancel
-    purge = generated.to(init, generated) | completed.to(init, completed) | running.to(init, running)
+    #running -> init purges a project whose jobs couldn't all be cancelled
+    purge = generated.to(init, generated) | completed.to(init, completed) | partial.to(init, partial) | running.to(init, running)
 
-    stay = init.to.itself() | generated.to.itself() | running.to.itself() | completed.to.itself()
-    scan = running.to.itself() | completed.to.itself()
+    #Submit queued batchfiles, see [submission] max_in_flight
+    pump = running.to.itself()
+
+    stay = init.to.itself() | generated.to.itself() | running.to.itself() | completed.to.itself() | partial.to.itself()
+    scan = running.to.itself() | completed.to.itself() | partial.to.itself()
 
     def __init__(self, bbar_project, **options):
         self.bbar_project = bbar_project
         self.store = bbar_project.state
         self.options = options
+        #Set when a command fails, so that bbar exits with a nonzero exit code
+        self.failed = False
         start_value = self.store.get_status()
         if start_value is not None:
             super().__init__(start_value = start_value)
@@ -55,6 +66,10 @@ class BBAR_FSM(StateMachine):
         self.store.set_status(self.current_state.value)
         debug("Status set to completed")
 
+    def on_enter_partial(self):
+        self.store.set_status(self.current_state.value)
+        debug("Status set to partial")
+
     def on_stay(self):
         info(f"Nothing to do, already {self.current_state.identifier}.")
 
@@ -64,6 +79,7 @@ class BBAR_FSM(StateMachine):
             return self.generated
         else:
             info("Failed to generate files.")
+            self.failed = True
             return self.init
 
     def on_start(self):
@@ -72,12 +88,18 @@ class BBAR_FSM(StateMachine):
             return self.running
         else:
             error("Failed to run jobs.")
+            self.failed = True
             return self.generated
     
     def on_cancel(self):
         info("Cancelling all running jobs.")
-        info("\"cancel\" not supported yet")
-        return self.running
+        if (self.bbar_project.cancel_jobs() == BBAR_SUCCESS):
+            info("All jobs have been cancelled.")
+            return self.generated
+        else:
+            error("Failed to cancel some jobs.")
+            self.failed = True
+            return self.running
 
     def on_purge(self):
         info("Purging all generated files (except archives).")
@@ -91,11 +113,71 @@ class BBAR_FSM(StateMachine):
         debug("Scanning for SLURM output files.")
         self.bbar_project.scan_for_results()
 
+    def on_pump(self):
+        self.bbar_project.pump(**self.options)
+
+    def on_refine(self):
+        if (self.bbar_project.refine(**self.options) == BBAR_SUCCESS):
+            return self.generated
+        return self.current_state
+
+    def on_complete(self):
+        info("All jobs have finished.")
+        self.bbar_project.record_runtimes()
+        incomplete = sum(len(c) for c in self.bbar_project.incomplete_commands().values())
+        if incomplete:
+            info(f"{incomplete} command(s) failed or didn't run, run \"bbar run --resume\" to submit them again.")
+            return self.partial
+        return self.completed
+
+    def on_resume(self):
+        if (self.bbar_project.resume(**self.options) == BBAR_SUCCESS):
+            info("Jobs have been started.")
+            return self.running
+        self.failed = True
+        return self.partial
+
     def on_analyze(self):
         debug("Analyzing output files.")
 
+    def run_adaptive(self):
+        "Runs rounds of the adaptive search until it's done, or until a round is left running on the scheduler"
+        while True:
+            if self.current_state == self.running:
+                self.try_system_task("scan")
+                if self.current_state == self.running:
+                    info("Round is running, run \"bbar run --adaptive\" again when it has completed.")
+                    return
+            if self.current_state == self.partial:
+                #Each round gets one resume
+                if not self.store.get_resumes():
+                    self.resume()
+                    if self.current_state == self.running:
+                        continue
+                warning("Some commands of the round failed or didn't run, refining the search on the commands that completed")
+            if self.current_state in [self.completed, self.partial]:
+                self.refine()
+                if self.current_state in [self.completed, self.partial]:
+                    return
+            if self.current_state == self.init:
+                self.generate()
+            if self.current_state == self.generated:
+                self.start()
+            if self.current_state != self.running:
+                return
+
     def try_command(self, cmd):
         state = self.current_state
+        if cmd == "run" and self.options.get("adaptive"):
+            self.run_adaptive()
+            return
+        if cmd == "run" and self.options.get("resume"):
+            if state == self.partial:
+                self.resume()
+            else:
+                print("'bbar run --resume' only resubmits the commands of a partially completed project")
+                self.print_status()
+            return
         if (cmd, state) in [("generate",self.generated), ("run",self.running)]:
             self.stay()
             self.print_allowed_actions()
@@ -108,6 +190,10 @@ class BBAR_FSM(StateMachine):
                 if state == self.init:
                     self.generate()
                 self.start()
+            elif cmd == "pump":
+                self.pump()
+                if self.options.get("watch"):
+                    self.watch_queue()
             elif cmd == "cancel":
                 self.cancel()
             elif cmd == "purge":
@@ -118,21 +204,40 @@ class BBAR_FSM(StateMachine):
             print(f"'bbar {cmd}' not allowed in current state")
             self.print_status()
 
+    def watch_queue(self):
+        "Pumps queued batchfiles every [submission] poll_interval seconds, until none are queued"
+        import time
+        interval = float(self.bbar_project.bbarfile_data["submission"]["poll_interval"])
+        while self.store.get_submission_queue():
+            debug(f"Waiting {interval} s for jobs to finish")
+            time.sleep(interval)
+            self.try_system_task("scan")
+            if self.current_state != self.running:
+                return
+            self.pump()
+
     def try_system_task(self,task):
-        if task == "scan" and self.current_state in [self.running,self.completed]:
+        if task == "scan" and self.current_state in [self.running,self.completed,self.partial]:
             self.scan()
+            if self.current_state == self.running and self.bbar_project.jobs_finished():
+                self.complete()
 
 
     def print_allowed_actions(self):
         "This has a lot of 'ugly' hacks to make it more readable"
-        transitions = [t.identifier for t in self.current_state.transitions if t.identifier not in  ["stay","complete","scan"]]
-        transitions = [t if t != "start" else "run" for t in transitions]
+        transitions = [t.identifier for t in self.current_state.transitions if t.identifier not in  ["stay","complete","scan","refine"]]
+        if not self.store.get_submission_queue():
+            transitions = [t for t in transitions if t != "pump"]
+        transitions = [{"start": "run", "resume": "run --resume"}.get(t, t) for t in transitions]
         if len(transitions) > 0:
             print(f"Allowed actions: {', '.join(transitions)}")
 
 
     def print_status(self):
         print(f"Status: {self.current_state.identifier}")
-        if self.current_state in [self.running, self.completed]:
+        if self.current_state in [self.running, self.completed, self.partial]:
+            self.bbar_project.list_jobs()
             self.bbar_project.list_output()
+        if self.current_state == self.partial:
+            self.bbar_project.list_commands()
         self.print_allowed_actions()
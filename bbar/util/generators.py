@@ -25,13 +25,34 @@ def const_generator(const):
 def list_generator(l):
     for i in l:
         yield i
-        
+
+def spaced(start, stop, num_steps, log=False):
+    "num_steps values from start to stop inclusive, evenly spaced, or geometrically spaced with log. Integer endpoints give integers"
+    if num_steps == 1:
+        values = [start]
+    elif log:
+        if start <= 0 or stop <= 0:
+            raise Exception(f"Log-spaced ranges need positive endpoints, got {start} and {stop}")
+        ratio = (stop/start)**(1/(num_steps-1))
+        values = [start*ratio**i for i in range(num_steps)]
+    else:
+        values = [start + (stop-start)*i/(num_steps-1) for i in range(num_steps)]
+    if isinstance(start, int) and isinstance(stop, int):
+        return [int(round(v)) for v in values]
+    return values
+
 def generator_from_config(name, config, num_steps):
     if isinstance(config, dict):
         if "start" in config and "step" in config:
             return infinite_stepper(config["start"],config["step"])
         elif "start" in config and "step_factor" in config:
             return multiplicator(config["start"], config["step_factor"], num_steps)
+        elif "start" in config and "stop" in config:
+            if config.get("num_steps", num_steps) < num_steps:
+                raise Exception(f"Too few steps in range provided for {name}, needed {num_steps}, num_steps was {config['num_steps']}")
+            return list_generator(spaced(config["start"], config["stop"], config.get("num_steps", num_steps), config.get("log", False)))
+        elif "values" in config:
+            return generator_from_config(name, config["values"], num_steps)
         
     elif isinstance(config, list):
         if len(config) < num_steps:
@@ -55,3 +76,82 @@ def scale_up_generator(config):
         return const_generator(config)
 
 #TODO: stepper definitions in bbarfile implicitly coded into if statements, better type checking somehow?
+
+
+#DOCUMENT: sweeps, set with sweep = "..." in a [benchmarks] block, combine the values of all arguments and env_vars:
+#   zip     (default) the i-th command gets the i-th value of every parameter, num_settings commands
+#   product every combination of the parameters' values, each parameter has num_steps values (default num_settings)
+#   lhs     samples = <count> points of a Latin hypercube over the parameter domains, seed = <int> (default 0)
+#   random  samples = <count> independent uniform samples over the parameter domains, seed = <int> (default 0)
+#   Lists can also be written as {values = [...]}, where TOML doesn't allow mixing lists and tables in an array.
+#   Sampled domains are lists (a choice), {min, max} (uniform, log = true for log-uniform, integers if both are integers),
+#   or any finite range: {start, stop, num_steps}, {start, step, num_steps}, {start, step_factor, num_steps}.
+sweep_kinds = ["zip", "product", "lhs", "random"]
+
+def axis_values(name, config, num_steps):
+    "The finite list of values a parameter takes"
+    if isinstance(config, list):
+        return config
+    if not isinstance(config, dict):
+        return [config]
+    if "values" in config:
+        return config["values"]
+    if "min" in config or "max" in config:
+        raise Exception(f"{name} = {config} is continuous, it can only be used in lhs or random sweeps")
+    num_steps = config.get("num_steps", num_steps)
+    generator = generator_from_config(name, config, num_steps)
+    if generator is None:
+        raise Exception(f"Can't generate values for {name} from {config}")
+    return [next(generator) for _ in range(num_steps)]
+
+def sample_domain(name, config, num_steps):
+    "Returns a function mapping u in [0, 1) to a value of the parameter"
+    if isinstance(config, dict) and ("min" in config or "max" in config):
+        low, high, log = config["min"], config["max"], config.get("log", False)
+        integer = isinstance(low, int) and isinstance(high, int)
+        if log:
+            if low <= 0 or high <= 0:
+                raise Exception(f"Log-uniform {name} needs positive min and max, got {low} and {high}")
+            def sample(u):
+                v = low*(high/low)**u
+                return min(int(v), high) if integer else v
+        else:
+            def sample(u):
+                return low + int(u*(high-low+1)) if integer else low + u*(high-low)
+        return sample
+    values = axis_values(name, config, num_steps)
+    return lambda u: values[min(int(u*len(values)), len(values)-1)]
+
+def sweep_settings(axes, kind="zip", num_settings=1, samples=None, seed=0):
+    """
+    Combines parameters, given as {key: bbarfile value config}, into a list of settings, each a {key: value}.
+    See sweep_kinds.
+    """
+    if kind == "zip":
+        generators = {k:generator_from_config(k, v, num_settings) for k, v in axes.items()}
+        for k, g in generators.items():
+            if g is None and ("min" in axes[k] or "max" in axes[k]):
+                raise Exception(f"{k} = {axes[k]} is continuous, it can only be used in lhs or random sweeps, set sweep = \"lhs\" or \"random\" and samples")
+            if g is None:
+                raise Exception(f"Can't generate values for {k} from {axes[k]}")
+        return [{k:next(g) for k, g in generators.items()} for _ in range(num_settings)]
+    if kind == "product":
+        import itertools
+        keys = list(axes)
+        values = [axis_values(k, axes[k], num_settings) for k in keys]
+        return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+    if kind in ("lhs", "random"):
+        import random
+        if samples is None:
+            raise Exception(f"A {kind} sweep needs samples = <number of commands>")
+        rng = random.Random(seed)
+        domains = {k:sample_domain(k, v, num_settings) for k, v in axes.items()}
+        if kind == "random":
+            return [{k:d(rng.random()) for k, d in domains.items()} for _ in range(samples)]
+        #Latin hypercube: every parameter's range is split in samples strata, and each stratum is sampled exactly once
+        strata = {}
+        for k in domains:
+            strata[k] = list(range(samples))
+            rng.shuffle(strata[k])
+        return [{k:d((strata[k][i] + rng.random())/samples) for k, d in domains.items()} for i in range(samples)]
+    raise Exception(f"Unknown sweep \"{kind}\", expected one of {', '.join(sweep_kinds)}")
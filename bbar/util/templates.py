@@ -0,0 +1,112 @@
+from functools import lru_cache
+from string import Formatter
+
+_formatter = Formatter()
+
+class Template:
+    """
+    A str.format template, parsed once into a list of literal text and replacement fields.
+    render(params) gives the same result as text.format(**params) without parsing text again.
+    Fields with attribute or index lookups (e.g. {arguments[0]}) are resolved with Formatter.get_field.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.parts = []
+        self.fields = set()
+        for literal, field, spec, conversion in _formatter.parse(text):
+            if literal:
+                self.parts.append((literal, None, None, None))
+            if field is None:
+                continue
+            if field == "" or field.isdigit():
+                raise ValueError(f"Positional field {{{field}}} in \"{text}\", only named fields are supported")
+            if spec and "{" in spec:
+                raise ValueError(f"Nested field in format spec \"{spec}\" in \"{text}\" is not supported")
+            self.fields.add(field_root(field))
+            self.parts.append((None, field, spec, conversion))
+        #A template without fields renders to its literal text, with escaped braces ({{ and }}) unescaped
+        self.constant = None if self.fields else "".join(literal for literal, *_ in self.parts)
+
+    def render(self, params):
+        if self.constant is not None:
+            return self.constant
+        out = []
+        for literal, field, spec, conversion in self.parts:
+            if field is None:
+                out.append(literal)
+                continue
+            if "." in field or "[" in field:
+                value = _formatter.get_field(field, (), params)[0]
+            else:
+                value = params[field]
+            if conversion:
+                value = _formatter.convert_field(value, conversion)
+            out.append(value if type(value) is str and not spec else format(value, spec))
+        return "".join(out)
+
+    def __repr__(self):
+        return f"Template({self.text!r})"
+
+def field_root(field):
+    "The parameter a field refers to: \"arguments\" for \"arguments[0]\""
+    for i, c in enumerate(field):
+        if c in ".[":
+            return field[:i]
+    return field
+
+@lru_cache(maxsize=None)
+def compile_template(text):
+    return Template(text)
+
+def render(value, params):
+    "Renders value if it's a string template, other values are returned as they are"
+    if isinstance(value, str):
+        return compile_template(value).render(params)
+    return value
+
+def dependency_order(templates, prefix=""):
+    """
+    Orders the names of templates ({name: template string or value}) so that every template comes after
+    the templates it refers to, by fields named prefix+name. Raises ValueError on a cycle.
+    """
+    deps = {}
+    for name, value in templates.items():
+        fields = compile_template(value).fields if isinstance(value, str) else set()
+        deps[name] = [f[len(prefix):] for f in fields if f.startswith(prefix) and f[len(prefix):] in templates and f[len(prefix):] != name]
+        if f"{prefix}{name}" in fields:
+            raise ValueError(f"{name} = \"{value}\" refers to itself")
+
+    order = []
+    done = set()
+    visiting = []
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            cycle = visiting[visiting.index(name):] + [name]
+            raise ValueError(f"Circular reference between parameters: {' -> '.join(cycle)}")
+        visiting.append(name)
+        for dep in deps[name]:
+            visit(dep)
+        visiting.pop()
+        done.add(name)
+        order.append(name)
+
+    for name in templates:
+        visit(name)
+    return order
+
+def render_all(templates, params, prefix=""):
+    """
+    Renders templates ({name: template string or value}) in dependency order. Each rendered value is added to
+    params as prefix+name, so that later templates can refer to it. Returns {name: rendered value}, in the
+    original order of templates.
+    """
+    rendered = {}
+    for name in dependency_order(templates, prefix):
+        try:
+            rendered[name] = render(templates[name], params)
+        except KeyError as e:
+            raise ValueError(f"Unknown parameter {e} in {name} = \"{templates[name]}\"")
+        params[f"{prefix}{name}"] = rendered[name]
+    return {name:rendered[name] for name in templates}
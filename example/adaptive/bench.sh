@@ -0,0 +1,4 @@
+#!/bin/bash
+#Synthetic benchmark for trying out bbar run --adaptive with the LOCAL scheduler:
+#the runtime is smallest for UCX_RNDV_THRESH = 16384, with some noise
+awk -v t="$UCX_RNDV_THRESH" -v seed="$RANDOM" 'BEGIN { srand(seed); x = log(t)/log(2) - 14; printf "Time: %.4f s\n", 1 + 0.05*x*x + 0.01*rand() }'
@@ -14,5 +14,6 @@ setup(name='bbar',
     license='MIT',
     packages=['bbar'],
     install_requires=['toml','python-statemachine'],
+    extras_require={'analysis':['numpy'], 'parquet':['numpy','pyarrow'], 'zstd':['zstandard']},
     entry_points={'console_scripts':['bbar=bbar.cmd:main']},
     zip_safe=False)
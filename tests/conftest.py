@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+fake_slurm = os.path.join(repo, "tools", "fake_slurm")
+sys.path.insert(0, repo)
+
+slurm_bbarfile = """
+scheduler = "SLURM"
+max_procs_per_node = 4
+[sbatch_params]
+job-name = "t"
+time = "00:10:00"
+[scaleup]
+start = 1
+step_factor = 2
+num_steps = 2
+[benchmarks]
+workdir = "work_{SBATCH_n}"
+command = "bench.sh"
+num_settings = 2
+arguments = [{start = 0, step = 1}]
+[benchmarks.metrics.runtime]
+regex = 'Time: (?P<value>[0-9.]+) s'
+[status]
+ttl = 0
+"""
+
+#Fails for argument 1 until the file "fixed" exists in the project directory
+bench_script = """#!/bin/bash
+echo "Time: 1.$1 s"
+[ "$1" != 1 ] || [ -e {project}/fixed ]
+"""
+
+class Bbar:
+    "Runs the bbar command line in a project directory, with the fake SLURM commands first on the PATH"
+    def __init__(self, directory):
+        self.directory = directory
+        self.env = dict(os.environ, PYTHONPATH=repo, PATH=f"{fake_slurm}{os.pathsep}{os.environ['PATH']}",
+                        FAKE_SLURM_DIR=os.path.join(directory, ".fake_slurm"), FAKE_SLURM_EXECUTE="1",
+                        FAKE_SLURM_QUEUE_DELAY="0", FAKE_SLURM_RUNTIME="0")
+
+    def __call__(self, *args, check=True):
+        "Returns the output of bbar <args>"
+        result = subprocess.run([sys.executable, "-c", "from bbar.cmd import main; main()", *args], cwd=self.directory,
+                                env=self.env, capture_output=True, text=True, timeout=60)
+        if check and result.returncode != 0:
+            raise AssertionError(f"bbar {' '.join(args)} exited with {result.returncode}:\n{result.stdout}{result.stderr}")
+        return result.stdout + result.stderr
+
+    def slurm(self, command, *args):
+        "Runs one of the fake SLURM commands"
+        return subprocess.run([os.path.join(fake_slurm, command), *args], cwd=self.directory, env=self.env,
+                              capture_output=True, text=True, timeout=60)
+
+    def wait_for(self, status, *args, timeout=30):
+        "Polls bbar status until the project has status, returns the last output"
+        deadline = time.time() + timeout
+        while True:
+            output = self("status", *args)
+            if f"Status: {status}" in output:
+                return output
+            if time.time() > deadline:
+                raise AssertionError(f"Project didn't reach status {status} in {timeout} s:\n{output}")
+            time.sleep(0.2)
+
+@pytest.fixture
+def project(tmp_path):
+    "A SLURM project of two batchfiles with two commands each, of which command 1 fails until fixed exists"
+    (tmp_path / "bbarfile").write_text(slurm_bbarfile)
+    script = tmp_path / "bench.sh"
+    script.write_text(bench_script.format(project=tmp_path))
+    script.chmod(0o755)
+    return tmp_path
+
+@pytest.fixture
+def bbar(project):
+    return Bbar(str(project))
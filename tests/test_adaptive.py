@@ -0,0 +1,54 @@
+"bbar run --adaptive on example/adaptive, whose synthetic benchmark is fastest for UCX_RNDV_THRESH = 16384"
+import re
+import shutil
+
+import pytest
+
+from conftest import Bbar, repo
+
+#The benchmark of the example without its noise, so that searches are reproducible
+exact_bench = """#!/bin/bash
+awk -v t="$UCX_RNDV_THRESH" 'BEGIN { x = log(t)/log(2) - 14; printf "Time: %.6f s\\n", 1 + 0.05*x*x }'
+"""
+
+def example(path, bench=None):
+    shutil.copytree(f"{repo}/example/adaptive", path)
+    if bench is not None:
+        (path / "bench.sh").write_text(bench)
+    (path / "bench.sh").chmod(0o755)
+    return Bbar(str(path))
+
+def rounds(output):
+    "The candidates of each round after the first, from the output of bbar run --adaptive"
+    return re.findall(r"^Round \d+: UCX_RNDV_THRESH = (.*)$", output, re.MULTILINE)
+
+def best(output):
+    m = re.search(r"Adaptive search done after (\d+) round\(s\), best UCX_RNDV_THRESH = (\d+)", output)
+    assert m, output
+    return int(m.group(2))
+
+@pytest.mark.parametrize("method", ["golden", "bisection", "halving"])
+def test_local_search_converges(tmp_path, method):
+    bbar = example(tmp_path / "adaptive")
+    output = bbar("run", "--adaptive", "-f", "-p", f"adaptive.method = '{method}'")
+    #halving only gets to pick among its 8 starting points, the nearest being 19972
+    assert 16384/1.25 <= best(output) <= 16384*1.25
+    assert "Status: completed" in bbar("status")
+
+def test_search_resumes_from_the_store(tmp_path):
+    "A search advanced by one bbar invocation per round, from the state in the store, runs the same rounds"
+    local = example(tmp_path / "local", exact_bench)
+    expected = local("run", "--adaptive", "-f")
+    assert len(rounds(expected)) == 9
+
+    slurm = example(tmp_path / "slurm", exact_bench)
+    on_slurm = ("-p", "scheduler = 'SLURM'", "status.ttl = 0")
+    outputs = [slurm("run", "--adaptive", "-f", *on_slurm)]
+    while "Adaptive search done" not in outputs[-1]:
+        assert len(outputs) <= 12, "the search didn't finish"
+        slurm.wait_for("completed", *on_slurm)
+        outputs.append(slurm("run", "--adaptive", "-f", *on_slurm))
+    #Each invocation refines the finished round and submits the next one
+    assert all(len(rounds(output)) <= 1 for output in outputs)
+    assert rounds("".join(outputs)) == rounds(expected)
+    assert best(outputs[-1]) == best(expected)
@@ -0,0 +1,21 @@
+"bbar compare against baselines, run against the fake SLURM"
+import pytest
+
+pytest.importorskip("numpy")
+
+#Prints a runtime that depends on the scale point, from the workdir work_<n>
+bench_script = """#!/bin/bash
+echo "Time: ${PWD##*_}.$1 s"
+"""
+job_id_output = ("-p", "sbatch_params.output = 't-%j.out'")
+
+@pytest.mark.parametrize("output", [(), job_id_output], ids=["named", "by job id"])
+def test_compare_with_archive(project, bbar, output):
+    (project / "bench.sh").write_text(bench_script)
+    bbar("run", "-f", *output)
+    bbar.wait_for("completed", *output)
+    bbar("archive", "-f", *output)
+    result = bbar("compare", "--baseline", "bbar.tar.gz", "--format", "csv", *output)
+    rows = [line.split(",") for line in result.splitlines() if line.startswith("1,") or line.startswith("2,")]
+    assert len(rows) == 4
+    assert all(row[-1] == "unchanged" for row in rows), result
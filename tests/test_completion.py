@@ -0,0 +1,34 @@
+"Per-command completion, read from the BBAR_STEP lines of job outputs"
+from types import SimpleNamespace
+
+from bbar.bbar.completion import command_statuses, resume_config
+
+def output(tmp_path, text):
+    path = tmp_path / "out"
+    path.write_text(text)
+    return str(path)
+
+def test_statuses(tmp_path):
+    path = output(tmp_path, "BBAR_COMMAND 0\nBBAR_STEP 0 exit_code=0\nBBAR_COMMAND 1\nBBAR_STEP 1 exit_code=2\nBBAR_COMMAND 2\n")
+    assert command_statuses(path, 4, "TIMEOUT") == ["completed", "failed", "failed", "missing"]
+
+def test_without_output():
+    assert command_statuses(None, 2, "COMPLETED") == ["completed", "completed"]
+    assert command_statuses(None, 2, "CANCELLED") == ["missing", "missing"]
+
+def test_without_exit_codes(tmp_path):
+    "Outputs of batchfiles generated before exit codes were printed fall back on the job state"
+    path = output(tmp_path, "BBAR_COMMAND 0\nBBAR_COMMAND 1\n")
+    assert command_statuses(path, 2, "COMPLETED") == ["completed", "completed"]
+    assert command_statuses(path, 2, "FAILED") == ["failed", "failed"]
+
+def test_ignores_unknown_commands(tmp_path):
+    path = output(tmp_path, "BBAR_COMMAND 5\nBBAR_STEP 5 exit_code=0\nBBAR_STEP 0 exit_code=0\n")
+    assert command_statuses(path, 1, "COMPLETED") == ["completed"]
+
+def test_resume_config():
+    config = {"benchmarks": {"command": "bench", "shard": [2, 4]}, "sbatch_params": {"job-name": "t"}}
+    resumed = resume_config(config, SimpleNamespace(jobname="t-r1"), [1, 3], 2)
+    assert resumed["benchmarks"] == {"command": "bench", "select": [1, 3]}
+    assert resumed["sbatch_params"]["job-name"] == "t-r1-retry2"
+    assert config["benchmarks"]["shard"] == [2, 4]
@@ -0,0 +1,65 @@
+"The condition language of [benchmarks.if.\"<condition>\"] tables"
+import pytest
+
+from bbar.generic.conditions import Condition, Column
+
+params = {"SBATCH_n": 8, "SBATCH_N": 2, "procs_on_node": 4, "SBATCH_job-name": "small", "T": "4096", "arguments": [256, "x"]}
+
+@pytest.mark.parametrize("text, expected", [
+    ("n >= 4 and n <= 16", True),
+    ("4 <= n <= 16", True),
+    ("n in 4..7", False),
+    ("N == 1 or procs_on_node < 8", True),
+    ("T > 2048", True),
+    ("T == 4096", True),
+    ("arguments[0] in [128, 256]", True),
+    ("arguments[1] not in ['x']", False),
+    ("{SBATCH_job-name} == 'small'", True),
+    ("n % 2 == 0 and n / 2 == 4", True),
+    ("not (n - 8)", True),
+    ("-n < 0", True),
+    ("true and not false", True),
+])
+def test_evaluate(text, expected):
+    assert Condition(text).test(params) == expected
+
+@pytest.mark.parametrize("text", ["n >", "n == (1", "n $ 2", "arguments[x] == 1", "n in 1"])
+def test_syntax_errors(text):
+    with pytest.raises(ValueError, match="Bad condition"):
+        Condition(text)
+
+def test_unknown_parameter():
+    with pytest.raises(ValueError, match="Unknown parameter missing"):
+        Condition("missing > 1").test(params)
+
+def test_columns():
+    columns = dict(params, T=Column([1024, 2048, 4096, 8192]))
+    assert Condition("T >= 4096 and n == 8").test(columns, 4) == [False, False, True, True]
+    #Conditions without columns apply to every row
+    assert Condition("n == 8").test(columns, 4) == [True]*4
+
+def test_unset_values():
+    columns = {"BIG": Column([None, 1, None])}
+    assert Condition("BIG == 1").test(columns, 3) == [False, True, False]
+    assert Condition("BIG != 1").test(columns, 3) == [True, False, True]
+    assert Condition("BIG + 1 > 1").test(columns, 3) == [False, True, False]
+
+def test_results_are_cached_by_used_parameters():
+    condition = Condition("T > 2048")
+    first = condition.test(dict(params, SBATCH_n=1, T=Column([1024, 4096])), 2)
+    second = condition.test(dict(params, SBATCH_n=2, T=Column([1024, 4096])), 2)
+    assert first == second == [False, True]
+    assert len(condition.results) == 1
+    assert condition.test(dict(params, T=Column([4096, 1024])), 2) == [True, False]
+
+def test_short_circuit():
+    "The right operand of and/or is only evaluated where the left one doesn't decide the result"
+    assert Condition("N == 2 or UNKNOWN > 3").test(params)
+    assert not Condition("N == 1 and UNKNOWN > 3").test(params)
+    with pytest.raises(ValueError, match="Unknown parameter UNKNOWN"):
+        Condition("N == 1 or UNKNOWN > 3").test(params)
+    #Per row: T / 0 is only evaluated for the rows where T isn't 0
+    columns = {"T": Column([0, 2, 4])}
+    assert Condition("T == 0 or 8 / T > 3").test(columns, 3) == [True, True, False]
+    assert Condition("T != 0 and 8 / T > 3").test(columns, 3) == [False, True, False]
+    assert Condition("T == 0 or T == 2 or T == 4").test(columns, 3) == [True]*3
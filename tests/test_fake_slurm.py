@@ -0,0 +1,95 @@
+"End to end runs of bbar against the fake SLURM in tools/fake_slurm, which executes the batchfiles"
+import time
+
+def test_generate(project, bbar):
+    bbar("generate", "-f")
+    for n in [1, 2]:
+        batchfile = (project / f"t-{n}.batch").read_text()
+        assert "#SBATCH --job-name=t" in batchfile
+        assert f"#SBATCH -n {n}" in batchfile
+        assert "bbar_exit 1" in batchfile
+    assert "Status: generated" in bbar("status")
+
+def test_run_to_completion(project, bbar):
+    (project / "fixed").touch()
+    bbar("run", "-f")
+    output = bbar.wait_for("completed")
+    assert "COMPLETED" in output
+    assert "BBAR_STEP 1 exit_code=0" in (project / "t-2.out").read_text()
+    assert "runtime" in bbar("analyze")
+
+def test_resume(project, bbar):
+    bbar("run", "-f")
+    output = bbar.wait_for("partial")
+    assert "Commands: 2 completed, 2 failed, 0 missing" in output
+    (project / "fixed").touch()
+    bbar("run", "--resume", "-f")
+    output = bbar.wait_for("completed")
+    #Only the failed command is resubmitted, in batchfiles and outputs of their own
+    retry = (project / "t-retry1-1.batch").read_text()
+    assert "BBAR_COMMAND 0" in retry and "BBAR_COMMAND 1" not in retry
+    assert (project / "t-retry1-1.out").is_file()
+    assert "exit_code=1" in (project / "t-1.out").read_text()
+
+def test_resume_needs_partial(project, bbar):
+    bbar("generate", "-f")
+    assert "only resubmits the commands of a partially completed project" in bbar("run", "--resume", "-f")
+
+def test_pump(project, bbar):
+    (project / "fixed").touch()
+    throttle = ("-p", "submission.max_in_flight = 1")
+    bbar("run", "-f", *throttle)
+    output = bbar("status", *throttle)
+    assert "t-2.batch" in output and "queued by bbar" in output
+    deadline = time.time() + 30
+    while "queued by bbar" in bbar("status", *throttle):
+        assert time.time() < deadline, "pump didn't submit the queued batchfile"
+        bbar("pump", *throttle)
+        time.sleep(0.2)
+    bbar.wait_for("completed", *throttle)
+
+def test_scancel(project, bbar):
+    script = project / "sleep.batch"
+    script.write_text("#!/bin/bash\n#SBATCH --job-name=sleep\n#SBATCH --output=sleep.out\nsleep 30\n")
+    assert bbar.slurm("sbatch", str(script)).stdout.strip() == "Submitted batch job 1000"
+    bbar.slurm("scancel", "1000")
+    #The killed script still ends, but the job stays cancelled
+    time.sleep(0.5)
+    assert bbar.slurm("sacct", "--parsable2", "--noheader", "-j", "1000").stdout.split("|")[1] == "CANCELLED"
+
+def test_cancelled_state():
+    import importlib.util
+    from conftest import fake_slurm
+    spec = importlib.util.spec_from_file_location("fake_slurm", f"{fake_slurm}/fake_slurm.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    job = {"execute": True, "submit": 0, "codes": {"None": 0}}
+    #A script that exits after being cancelled, e.g. when scancel came before its pid was recorded
+    assert module.task_state(dict(job, cancelled=5, end=6), None, 0, 10)[0] == "CANCELLED"
+    assert module.task_state(dict(job, cancelled=7, end=6), None, 0, 10)[0] == "COMPLETED"
+    assert module.task_state(dict(job, cancelled=5), None, 0, 10)[0] == "CANCELLED"
+    assert module.task_state(job, None, 0, 10)[0] == "RUNNING"
+
+def slow(project):
+    "Makes the benchmark run long enough to be cancelled, executed jobs start right away"
+    (project / "bench.sh").write_text("#!/bin/bash\nsleep 30\n")
+
+def test_cancel(project, bbar):
+    slow(project)
+    bbar("run", "-f")
+    assert "RUNNING" in bbar("status")
+    bbar("cancel", "-f")
+    assert "Status: generated" in bbar("status")
+    states = bbar.slurm("sacct", "--parsable2", "--noheader", "-j", "1000,1001").stdout
+    assert [line.split("|")[1] for line in states.splitlines()] == ["CANCELLED", "CANCELLED"]
+    #The cancelled project runs again
+    (project / "bench.sh").write_text("#!/bin/bash\n")
+    bbar("run", "-f")
+    bbar.wait_for("completed")
+
+def test_purge_cancels(project, bbar):
+    slow(project)
+    bbar("run", "-f")
+    bbar("purge", "-f")
+    assert "Status: init" in bbar("status")
+    assert bbar.slurm("sacct", "--parsable2", "--noheader", "-j", "1000").stdout.split("|")[1] == "CANCELLED"
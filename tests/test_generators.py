@@ -0,0 +1,42 @@
+"Parameter sweeps of [benchmarks] blocks"
+import pytest
+
+from bbar.util.generators import sweep_settings
+
+def test_zip():
+    axes = {"n": {"start": 1, "step": 2}, "mode": ["a", "b", "c"], "size": {"start": 10, "stop": 30}, "fixed": 7}
+    assert sweep_settings(axes, num_settings=3) == [
+        {"n": 1, "mode": "a", "size": 10, "fixed": 7},
+        {"n": 3, "mode": "b", "size": 20, "fixed": 7},
+        {"n": 5, "mode": "c", "size": 30, "fixed": 7},
+    ]
+
+@pytest.mark.parametrize("axis, message", [
+    ([1, 2], "Too few items in list provided for a, needed 4, length was 2"),
+    ({"values": [1, 2]}, "Too few items in list provided for a, needed 4, length was 2"),
+    ({"start": 1, "stop": 4, "num_steps": 2}, "Too few steps in range provided for a, needed 4, num_steps was 2"),
+    ({"min": 1, "max": 4}, "a = .* is continuous"),
+])
+def test_zip_errors(axis, message):
+    with pytest.raises(Exception, match=message):
+        sweep_settings({"a": axis}, num_settings=4)
+
+def test_product():
+    axes = {"a": [1, 2], "b": {"start": 1, "step_factor": 10, "num_steps": 3}}
+    assert sweep_settings(axes, "product", num_settings=2) == [
+        {"a": a, "b": b} for a in [1, 2] for b in [1, 10, 100]
+    ]
+
+def test_lhs_covers_every_stratum():
+    settings = sweep_settings({"x": {"min": 0.0, "max": 1.0}, "n": [1, 2, 3, 4]}, "lhs", samples=4, seed=3)
+    assert sorted(int(s["x"]*4) for s in settings) == [0, 1, 2, 3]
+    assert sorted(s["n"] for s in settings) == [1, 2, 3, 4]
+    assert settings == sweep_settings({"x": {"min": 0.0, "max": 1.0}, "n": [1, 2, 3, 4]}, "lhs", samples=4, seed=3)
+
+def test_random_integers():
+    settings = sweep_settings({"n": {"min": 1, "max": 3}}, "random", samples=50)
+    assert {s["n"] for s in settings} == {1, 2, 3}
+
+def test_sampled_sweeps_need_samples():
+    with pytest.raises(Exception, match="needs samples"):
+        sweep_settings({"n": [1, 2]}, "lhs")
@@ -0,0 +1,80 @@
+"The runtime history, which predicts the --time of SLURM batchfiles"
+from types import SimpleNamespace
+
+import pytest
+
+from bbar.bbar.history import parse_slurm_time, format_slurm_time, command_times, Runtime_History
+
+config = {"path": ".bbar_history", "samples": 3, "margin": 1.0, "overhead": 0, "max_time": ""}
+
+@pytest.mark.parametrize("text, seconds", [
+    ("10", 600), ("10:30", 630), ("01:02:03", 3723), ("1-02", 93600), ("1-02:03:04", 93784), ("soon", None),
+])
+def test_parse_slurm_time(text, seconds):
+    assert parse_slurm_time(text) == seconds
+
+def test_format_slurm_time():
+    assert format_slurm_time(1) == "00:01:00"
+    assert format_slurm_time(3661) == "01:02:00"
+    assert format_slurm_time(90000) == "1-01:00:00"
+
+def test_command_times(tmp_path):
+    output = tmp_path / "out"
+    output.write_text("BBAR_TIME 100.0\nBBAR_COMMAND 0\nBBAR_TIME 102.5\nBBAR_COMMAND 1\nsome output\nBBAR_TIME 110.0\n")
+    assert command_times(str(output), 3) == [2.5, 7.5, None]
+
+def test_packed_command_times(tmp_path):
+    "Packed steps print their own start and end times around their output"
+    output = tmp_path / "out"
+    output.write_text("BBAR_TIME 100.0\nBBAR_COMMAND 0\nBBAR_STEP 0 exit_code=0\nBBAR_TIME 103.0\n"
+                      "BBAR_TIME 100.5\nBBAR_COMMAND 1\nBBAR_STEP 1 exit_code=1\nBBAR_TIME 101.0\n")
+    assert command_times(str(output), 2) == [3.0, 0.5]
+
+def command(i):
+    return SimpleNamespace(command="bench", env_vars=SimpleNamespace(var_dict={}), arguments=[i])
+
+def batchfile(num_commands, step_ranks=0, max_steps=1):
+    commands = SimpleNamespace(commands=[command(i) for i in range(num_commands)], step_ranks=step_ranks, max_steps=max_steps)
+    return SimpleNamespace(commands=commands, n_procs=8)
+
+@pytest.fixture
+def history(tmp_path):
+    return Runtime_History(dict(config, path=str(tmp_path / "history")))
+
+def test_record_elapsed(history):
+    "Without timestamps, the elapsed time of a completed job is split over its commands"
+    history.record(batchfile(4), {"state": "COMPLETED", "elapsed": "00:04:00"}, None, ["completed"]*4)
+    assert [history.estimate(8, command(i)) for i in range(4)] == [60]*4
+
+def test_record_elapsed_packed(history):
+    "8 packed commands of an hour each, 8 at a time, take an hour each, not 1/8 of it"
+    packed = batchfile(8, step_ranks=1, max_steps=8)
+    history.record(packed, {"state": "COMPLETED", "elapsed": "01:00:00"}, None, ["completed"]*8)
+    estimates = [history.estimate(8, command(i)) for i in range(8)]
+    assert estimates == [3600]*8
+    assert history.predict(estimates, parallel=8) == 3600
+
+def test_record_completed_commands_only(history, tmp_path):
+    output = tmp_path / "out"
+    output.write_text("BBAR_TIME 0\nBBAR_COMMAND 0\nBBAR_TIME 5\nBBAR_COMMAND 1\nBBAR_TIME 6\n")
+    history.record(batchfile(2), {"state": "FAILED", "elapsed": "00:00:06"}, str(output), ["completed", "failed"])
+    assert history.estimate(8, command(0)) == 5
+    assert history.estimate(8, command(1)) is None
+    #Failed jobs without timestamps aren't recorded
+    history.record(batchfile(2), {"state": "FAILED", "elapsed": "00:00:06"}, None, ["completed", "failed"])
+    assert history.runtimes[history.key(8, command(0))] == [5]
+
+def test_samples_and_persistence(history):
+    for seconds in [60, 120, 180, 240]:
+        history.record(batchfile(1), {"state": "COMPLETED", "elapsed": f"00:{seconds//60:02}:00"}, None, ["completed"])
+    history.save()
+    reloaded = Runtime_History(dict(config, path=history.path))
+    assert reloaded.runtimes[reloaded.key(8, command(0))] == [120, 180, 240]
+    assert reloaded.estimate(8, command(0)) == 240
+
+def test_shards(history):
+    history.max_time = 100
+    assert history.shards([40, 40, 40, 40]) == [(0, 2), (2, 4)]
+    assert history.shards([40, 40], parallel=2) == [(0, 2)]
+    #A command that doesn't fit by itself still gets a shard
+    assert history.shards([150, 10]) == [(0, 1), (1, 2)]
@@ -0,0 +1,60 @@
+"The LOCAL scheduler, which runs batchfiles concurrently on this machine"
+import re
+
+import pytest
+
+from conftest import Bbar
+
+local_bbarfile = """
+scheduler = "LOCAL"
+[sbatch_params]
+job-name = "l"
+[scaleup]
+start = 1
+step = 1
+num_steps = {num_steps}
+[benchmarks]
+workdir = "work_{{SBATCH_n}}"
+command = "bench.sh"
+[local]
+max_jobs = 2
+"""
+
+#Exits with 1 in the workdirs of the scale points listed in the file "fail" of the project directory
+bench_script = """#!/bin/bash
+! grep -qx "${{PWD##*_}}" {project}/fail
+"""
+
+def local_project(path, num_steps, fail=()):
+    path.mkdir(exist_ok=True)
+    (path / "bbarfile").write_text(local_bbarfile.format(num_steps=num_steps))
+    script = path / "bench.sh"
+    script.write_text(bench_script.format(project=path))
+    script.chmod(0o755)
+    (path / "fail").write_text("".join(f"{n}\n" for n in fail))
+    return Bbar(str(path))
+
+def test_run(tmp_path):
+    bbar = local_project(tmp_path, 3)
+    bbar("run", "-f")
+    assert "Status: completed" in bbar("status")
+
+def test_failed_run(tmp_path):
+    bbar = local_project(tmp_path, 3, fail=[2])
+    output = bbar("run", "-f", check=False)
+    assert "1 batchfile(s) exited with a nonzero exit code: l-2.batch" in output
+    assert "Status: generated" in bbar("status")
+    with pytest.raises(AssertionError, match="exited with 1"):
+        bbar("run", "-f")
+
+@pytest.mark.parametrize("backend", ["toml", "sqlite"])
+def test_results_are_stored_at_once(tmp_path, backend):
+    "The store is flushed as often for a run of 2 batchfiles as for one of 8"
+    flushes = []
+    for num_steps in [2, 8]:
+        bbar = local_project(tmp_path / str(num_steps), num_steps)
+        override = ("-p", f"persistence.backend = '{backend}'")
+        bbar("generate", "-f", *override)
+        output = bbar("run", "-f", "--profile", *override)
+        flushes.append(int(re.search(r"store flushes\s+(\d+)", output).group(1)))
+    assert flushes[0] == flushes[1]
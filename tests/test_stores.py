@@ -0,0 +1,136 @@
+"The TOML, journaled TOML and SQLite stores behave the same"
+import pytest
+
+from bbar.logging import profiling
+
+from bbar.persistence import BBAR_Store, BBAR_SQLite_Store, BBAR_Read_Only_Store, open_store
+
+backends = {
+    "toml": lambda path: BBAR_Store(str(path / "state")),
+    "journal": lambda path: BBAR_Store(str(path / "state"), journal=True),
+    "sqlite": lambda path: BBAR_SQLite_Store(str(path / "state.db")),
+}
+
+@pytest.fixture(params=list(backends))
+def open_backend(request, tmp_path):
+    return lambda: backends[request.param](tmp_path)
+
+def test_scalars_and_maps(open_backend):
+    store = open_backend()
+    assert store.get("missing") is None
+    store.store_value("status", "generated")
+    store.set_map_item("jobids", "a.batch", "1000")
+    store.set_map_item("jobids", "b.batch", "1001")
+    store.del_map_item("jobids", "a.batch")
+    store.store()
+    store = open_backend()
+    assert store.get("status") == "generated"
+    assert store.get_map("jobids") == {"b.batch": "1001"}
+    assert store.has_map_item("jobids", "b.batch") and not store.has_map_item("jobids", "a.batch")
+    assert store.get_map_item("jobids", "a.batch", "none") == "none"
+
+def test_empty_maps(open_backend):
+    store = open_backend()
+    store.set("m", {})
+    store.clear_map("cleared")
+    store.set_map_item("emptied", "x", 1)
+    store.del_map_item("emptied", "x")
+    store.store()
+    store = open_backend()
+    assert store.get("m") == {}
+    assert store.get("cleared") == {}
+    assert store.get("emptied") == {}
+
+def test_scalar_replaces_map(open_backend):
+    store = open_backend()
+    store.set("key", {"a": 1})
+    store.set("key", 5)
+    store.store()
+    store = open_backend()
+    assert store.get("key") == 5
+    assert store.get_state()["key"] == 5
+
+def test_transaction_defers_writes(open_backend):
+    store = open_backend()
+    with store.transaction():
+        for i in range(10):
+            store.set_jobid(f"{i}.batch", str(1000 + i))
+    assert open_backend().get_jobids() == {f"{i}.batch": str(1000 + i) for i in range(10)}
+
+def test_clear_generated_files(open_backend):
+    store = open_backend()
+    store.add_generated_batchfile("a.batch")
+    store.set_jobid("a.batch", "1000")
+    store.set_resumes([{"a.batch": [1]}])
+    store.clear_generated_files()
+    store = open_backend()
+    assert store.get_generated_batchfiles() == {}
+    assert store.get_jobids() == {}
+    assert store.get_resumes() == []
+
+def test_clear_generated_files_keeps_value_types(open_backend):
+    "Lists and scalars are reset to their own empty values, not to empty maps"
+    store = open_backend()
+    store.set_adaptive({"round": 1})
+    store.set_history_plan({"a.batch": {"time": 60}})
+    store.set_submission_queue(["b.batch"])
+    store.clear_generated_files()
+    store = open_backend()
+    assert store.get("adaptive") is None
+    assert store.get("history_plan") == {}
+    assert store.get("resumes") == []
+    assert store.get("submission_queue") == []
+
+def test_delete(open_backend):
+    store = open_backend()
+    store.set("scalar", 5)
+    store.set_map_item("map", "a", 1)
+    store.store()
+    store.delete("scalar")
+    store.delete("map")
+    store.store()
+    store = open_backend()
+    assert store.get("scalar") is None and store.get("map") is None
+
+def test_rollback_ends_the_transaction(open_backend):
+    store = open_backend()
+    with store.transaction():
+        store.set("discarded", 1)
+        store.rollback()
+    with store.transaction():
+        store.set("kept", 2)
+    store = open_backend()
+    assert store.get("discarded") is None
+    assert store.get("kept") == 2
+
+def test_records_flush_once_per_transaction(open_backend, monkeypatch):
+    monkeypatch.setattr(profiling, "enabled", True)
+    monkeypatch.setattr(profiling, "counters", {})
+    store = open_backend()
+    with store.transaction():
+        for i in range(10):
+            store.set_scan_entry(f"{i}.out", {"size": i, "mtime": i})
+            store.set_job_result(f"{i}.batch", {"exit_code": 0, "wall_time": 1.0, "cpus": "0"})
+            store.set_job_status(str(1000 + i), {"state": "COMPLETED"})
+            store.add_recorded_job(str(1000 + i))
+    assert profiling.counters["store flushes"] == 1
+    store = open_backend()
+    assert len(store.get_job_results()) == 10 and store.get_scan_entry("9.out") == {"size": 9, "mtime": 9}
+
+@pytest.mark.parametrize("backend", ["toml", "sqlite"])
+def test_read_only_store(backend, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = open_store({"backend": backend})
+    store.set_jobid("a.batch", "1000")
+    before = sorted(p.name for p in tmp_path.iterdir())
+    read_only = open_store({"backend": backend}, read_only=True)
+    assert isinstance(read_only, BBAR_Read_Only_Store)
+    assert read_only.get_jobid("a.batch") == "1000"
+    read_only.set_jobid("b.batch", "1001")
+    assert sorted(p.name for p in tmp_path.iterdir()) == before
+    assert open_store({"backend": backend}).get_jobids() == {"a.batch": "1000"}
+
+def test_read_only_store_creates_nothing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert open_store({"backend": "sqlite"}, read_only=True).get_jobids() == {}
+    assert list(tmp_path.iterdir()) == []
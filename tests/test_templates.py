@@ -0,0 +1,30 @@
+"Compiled templates render like str.format"
+import pytest
+
+from bbar.util.templates import render, render_all
+
+params = {"SBATCH_n": 4, "arguments": [256, "x"], "name": "bench"}
+
+@pytest.mark.parametrize("text", [
+    "plain text",
+    "echo ${{HOME}}",
+    "{{}}",
+    "{name}-{SBATCH_n}.out",
+    "for i in {{1..{SBATCH_n}}}; do echo ${{i}}; done",
+    "{arguments[0]:>6}{arguments[1]!r}",
+])
+def test_render_like_format(text):
+    assert render(text, params) == text.format(**params)
+
+def test_non_strings():
+    assert render(5, params) == 5
+
+def test_render_all_in_dependency_order():
+    rendered = render_all({"output": "{SBATCH_job-name}-{SBATCH_n}.out", "job-name": "{name}", "n": 2}, {"name": "bench"}, prefix="SBATCH_")
+    assert rendered == {"output": "bench-2.out", "job-name": "bench", "n": 2}
+
+def test_render_all_errors():
+    with pytest.raises(ValueError, match="Circular reference"):
+        render_all({"a": "{SBATCH_b}", "b": "{SBATCH_a}"}, {}, prefix="SBATCH_")
+    with pytest.raises(ValueError, match="Unknown parameter"):
+        render_all({"a": "{missing}"}, {}, prefix="SBATCH_")
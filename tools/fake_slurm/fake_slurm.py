@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+A stand-in for the SLURM commands that bbar calls, for running bbar's SLURM code paths off-cluster.
+
+    PATH=$PWD/tools/fake_slurm:$PATH bbar run
+
+sbatch, squeue, sacct, scancel and srun are symlinks to this script, which acts according to the name it is called by.
+Jobs are kept as one JSON file each in a state directory, and their state is computed from the clock when queried:
+a job is PENDING for its queue delay, RUNNING for its runtime, and then COMPLETED, FAILED, or TIMEOUT if its runtime
+exceeds its --time. Array jobs (--array=<range>[%<limit>]) run their tasks in waves of at most <limit>.
+Configured by environment variables:
+    FAKE_SLURM_DIR          state directory (default .fake_slurm in the working directory)
+    FAKE_SLURM_QUEUE_DELAY  seconds a job is pending, a number or a uniform range "<min>-<max>" (default 0)
+    FAKE_SLURM_RUNTIME      seconds a job runs, a number or a range (default 0)
+    FAKE_SLURM_FAIL_RATE    probability that a job fails (default 0)
+    FAKE_SLURM_EXECUTE      1 to actually run batch scripts in the background, writing their --output files.
+                            Jobs are then RUNNING until the script exits, and its exit code decides their state.
+Random draws are seeded by the job id, so a state directory always replays the same way.
+"""
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import random
+import signal
+import subprocess
+
+state_dir = os.environ.get("FAKE_SLURM_DIR", ".fake_slurm")
+jobs_dir = os.path.join(state_dir, "jobs")
+first_jobid = 1000
+
+sbatch_regex = re.compile(r"^#SBATCH\s+(--?[\w-]+)(?:[= ]\s*(.*?))?\s*$")
+array_regex = re.compile(r"^([\d,-]+)(?:%(\d+))?$")
+filename_regex = re.compile(r"%(\d*)([%AaJjx])")
+slurm_time_regex = re.compile(r"^(?:(\d+)-)?(\d+)(?::(\d+))?(?::(\d+))?$")
+
+def seconds_setting(name, rng):
+    value = os.environ.get(name, "0")
+    low, _, high = value.partition("-")
+    return rng.uniform(float(low), float(high)) if high else float(low)
+
+def parse_time(text):
+    m = slurm_time_regex.match(text.strip())
+    if not m:
+        return None
+    days, a, b, c = m.groups()
+    if days is not None:
+        return int(days)*86400 + int(a)*3600 + int(b or 0)*60 + int(c or 0)
+    if c is not None:
+        return int(a)*3600 + int(b)*60 + int(c)
+    return int(a)*60 + int(b or 0) if b is not None else int(a)*60
+
+def format_elapsed(seconds):
+    seconds = int(max(0, seconds))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{days}-{hours:02}:{minutes:02}:{seconds:02}" if days else f"{hours:02}:{minutes:02}:{seconds:02}"
+
+def parse_range(spec):
+    tasks = []
+    for part in spec.split(","):
+        first, _, last = part.partition("-")
+        tasks += list(range(int(first), int(last or first)+1))
+    return tasks
+
+def job_path(jobid):
+    return os.path.join(jobs_dir, f"{jobid}.json")
+
+def read_job(jobid):
+    try:
+        with open(job_path(jobid)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_job(job):
+    tmp_path = f"{job_path(job['id'])}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp_path, job_path(job["id"]))
+
+def next_jobid():
+    "Allocates a job id, under a lock so that concurrent sbatch calls get distinct ids"
+    os.makedirs(jobs_dir, exist_ok=True)
+    with open(os.path.join(state_dir, "next_jobid"), "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        jobid = int(f.read() or first_jobid)
+        f.seek(0)
+        f.truncate()
+        f.write(str(jobid + 1))
+    return jobid
+
+def sbatch_options(script):
+    options = {}
+    with open(script) as f:
+        for line in f:
+            m = sbatch_regex.match(line)
+            if m:
+                options[m.group(1).lstrip("-")] = m.group(2) or ""
+    return options
+
+def resolve_filename(pattern, jobid, task, jobname):
+    fields = {"A": jobid, "a": task, "j": f"{jobid}_{task}" if task is not None else jobid, "x": jobname}
+    fields["J"] = fields["j"]
+    def replace(m):
+        width, field = m.groups()
+        if field == "%":
+            return "%"
+        value = "" if fields[field] is None else str(fields[field])
+        return value.zfill(int(width)) if width else value
+    return filename_regex.sub(replace, pattern)
+
+def sbatch(args):
+    script = args[-1]
+    options = sbatch_options(script)
+    jobid = next_jobid()
+    rng = random.Random(jobid)
+    array, limit = None, None
+    if "array" in options:
+        m = array_regex.match(options["array"])
+        if not m:
+            print(f"sbatch: error: invalid --array specification {options['array']}", file=sys.stderr)
+            sys.exit(1)
+        array = parse_range(m.group(1))
+        limit = int(m.group(2)) if m.group(2) else None
+    job = {
+        "id": jobid,
+        "script": os.path.abspath(script),
+        "cwd": os.getcwd(),
+        "name": options.get("job-name", os.path.basename(script)),
+        "output": options.get("output", "slurm-%A_%a.out" if array is not None else "slurm-%j.out"),
+        "time_limit": parse_time(options["time"]) if "time" in options else None,
+        "submit": time.time(),
+        "delay": seconds_setting("FAKE_SLURM_QUEUE_DELAY", rng),
+        "runtime": seconds_setting("FAKE_SLURM_RUNTIME", rng),
+        "fails": rng.random() < float(os.environ.get("FAKE_SLURM_FAIL_RATE", 0)),
+        "array": array,
+        "limit": limit,
+        "execute": os.environ.get("FAKE_SLURM_EXECUTE", "0") == "1",
+    }
+    write_job(job)
+    if job["execute"]:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--execute", str(jobid)],
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   start_new_session=True, env=dict(os.environ, FAKE_SLURM_DIR=os.path.abspath(state_dir)))
+        job["pid"] = process.pid
+        write_job(job)
+    print(f"Submitted batch job {jobid}")
+
+def execute(jobid):
+    "Runs the script of a job, each array task in turn, and records the exit codes"
+    job = read_job(jobid)
+    codes = {}
+    for task in job["array"] if job["array"] is not None else [None]:
+        env = dict(os.environ, SLURM_JOB_ID=str(jobid), SLURM_JOB_NAME=job["name"])
+        if task is not None:
+            env.update(SLURM_ARRAY_JOB_ID=str(jobid), SLURM_ARRAY_TASK_ID=str(task))
+        output = os.path.join(job["cwd"], resolve_filename(job["output"], jobid, task, job["name"]))
+        with open(output, "w") as f:
+            codes[str(task)] = subprocess.run(["bash", job["script"]], cwd=job["cwd"], env=env, stdout=f, stderr=subprocess.STDOUT).returncode
+    job = read_job(jobid)
+    job.update(end=time.time(), codes=codes)
+    write_job(job)
+
+def task_state(job, task, index, now):
+    "Returns (state, exit code, elapsed seconds) of the job, or of one of its array tasks"
+    cancelled = job.get("cancelled")
+    if job["execute"]:
+        start = job["submit"]
+        #A cancelled script is killed, and its exit code doesn't matter. Cancelling a job that has ended does nothing
+        if cancelled and ("end" not in job or cancelled < job["end"]):
+            return "CANCELLED", "0:15", cancelled - start
+        if "end" not in job:
+            return "RUNNING", "0:0", now - start
+        code = job["codes"].get(str(task), 1)
+        return ("COMPLETED" if code == 0 else "FAILED", f"{code}:0", job["end"] - start)
+    wave = index // job["limit"] if job["limit"] else 0
+    start = job["submit"] + job["delay"] + wave*job["runtime"]
+    runtime = job["runtime"]
+    if job["time_limit"] is not None:
+        runtime = min(runtime, job["time_limit"])
+    end = start + runtime
+    if cancelled and cancelled < end:
+        return "CANCELLED", "0:15", max(0, cancelled - start)
+    if now < start:
+        return "PENDING", "0:0", 0
+    if now < end:
+        return "RUNNING", "0:0", now - start
+    if job["time_limit"] is not None and job["runtime"] > job["time_limit"]:
+        return "TIMEOUT", "0:1", runtime
+    if job["fails"]:
+        return "FAILED", "1:0", runtime
+    return "COMPLETED", "0:0", runtime
+
+def job_rows(jobids, now):
+    "Yields (job id, state, exit code, elapsed) rows, pending array tasks folded into one <id>_[<tasks>] row as SLURM does"
+    for jobid in jobids:
+        array_id = jobid.split("_")[0]
+        job = read_job(array_id)
+        if job is None:
+            continue
+        if job["array"] is None:
+            yield (str(job["id"]), *task_state(job, None, 0, now))
+            continue
+        pending = []
+        for index, task in enumerate(job["array"]):
+            if "_" in jobid and jobid != f"{array_id}_{task}":
+                continue
+            state = task_state(job, task, index, now)
+            if state[0] == "PENDING":
+                pending.append(str(task))
+            else:
+                yield (f"{array_id}_{task}", *state)
+        if pending:
+            limit = f"%{job['limit']}" if job["limit"] else ""
+            yield (f"{array_id}_[{','.join(pending)}{limit}]", "PENDING", "0:0", 0)
+
+def option_value(args, name):
+    for i, arg in enumerate(args):
+        if arg.startswith(f"{name}="):
+            return arg.split("=", 1)[1]
+        if arg == name and i + 1 < len(args):
+            return args[i+1]
+    return None
+
+def requested_jobids(args):
+    jobids = option_value(args, "-j") or option_value(args, "--jobs")
+    if jobids is not None:
+        return [j for j in jobids.split(",") if j]
+    if not os.path.isdir(jobs_dir):
+        return []
+    return sorted(name[:-len(".json")] for name in os.listdir(jobs_dir) if name.endswith(".json"))
+
+#sacct --format field names and the element of a job row they print
+sacct_fields = {"jobid": 0, "state": 1, "exitcode": 2, "elapsed": 3}
+
+def sacct(args):
+    fields = (option_value(args, "--format") or "JobID,State,ExitCode,Elapsed").split(",")
+    unknown = [f for f in fields if f.lower() not in sacct_fields]
+    if unknown:
+        print(f"sacct: error: Invalid field requested: \"{unknown[0]}\"", file=sys.stderr)
+        sys.exit(1)
+    lines = ["|".join(fields)] if "--noheader" not in args and "-n" not in args else []
+    for row in job_rows(requested_jobids(args), time.time()):
+        row = (row[0], row[1], row[2], format_elapsed(row[3]))
+        lines.append("|".join(row[sacct_fields[f.lower()]] for f in fields))
+    print("\n".join(lines))
+
+def squeue(args):
+    "Lists pending and running jobs only, like squeue. Only the %i (job id) and %T (state) fields are supported"
+    fmt = option_value(args, "--format") or option_value(args, "-o") or "%i %T"
+    lines = [] if "--noheader" in args or "-h" in args else [fmt.replace("%i", "JOBID").replace("%T", "STATE")]
+    for jobid, state, _, _ in job_rows(requested_jobids(args), time.time()):
+        if state in ["PENDING", "RUNNING"]:
+            lines.append(fmt.replace("%i", jobid).replace("%T", state))
+    print("\n".join(lines))
+
+def scancel(args):
+    for jobid in [a for a in args if not a.startswith("-")]:
+        job = read_job(jobid.split("_")[0])
+        if job is None:
+            print(f"scancel: error: Invalid job id {jobid}", file=sys.stderr)
+            sys.exit(1)
+        job.setdefault("cancelled", time.time())
+        write_job(job)
+        if job.get("pid") and "end" not in job:
+            try:
+                os.killpg(job["pid"], signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+#srun options that take a separate value
+srun_value_options = {"-n", "-N", "-c", "-t", "-p", "-w", "-J", "-o", "-e"}
+
+def srun(args):
+    "Runs the command of a job step directly, ignoring its options"
+    i = 0
+    while i < len(args) and args[i].startswith("-"):
+        i += 2 if args[i] in srun_value_options else 1
+    if i == len(args):
+        print("srun: error: no command given", file=sys.stderr)
+        sys.exit(1)
+    os.execvp(args[i], args[i:])
+
+commands = {"sbatch": sbatch, "sacct": sacct, "squeue": squeue, "scancel": scancel, "srun": srun}
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--execute":
+        return execute(sys.argv[2])
+    name = os.path.basename(sys.argv[0])
+    if name not in commands:
+        print(f"Call this script as one of {', '.join(commands)}, e.g. through the symlinks next to it", file=sys.stderr)
+        sys.exit(2)
+    commands[name](sys.argv[1:])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Drives bbar through a whole project of many SLURM jobs against the fake SLURM in tools/fake_slurm, and reports
+the latency of each command.
+
+    python3 tools/load_test.py [--jobs 10000] [--settings 1] [--mode separate] [--max-in-flight 0] [--json out.json]
+
+Phases: generate, run (submitting every job), status while jobs are queued (from the snapshot and expanded),
+pump until nothing is queued (with --max-in-flight), status once all jobs have finished (which queries sacct for
+every job and reads the per-command results), status of the completed project, and purge.
+With --baseline <json written by an earlier --json>, exits with 1 if any phase got slower by more than --tolerance
+(and --min-delta seconds).
+With --traces <dir>, each phase also writes bbar's own profile as a Chrome trace, see bbar --profile-trace.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+fake_slurm = os.path.join(repo, "tools", "fake_slurm")
+
+bbarfile_template = """
+scheduler = "SLURM"
+max_procs_per_node = 128
+[sbatch_params]
+job-name = "load"
+time = "00:10:00"
+[scaleup]
+start = 1
+step = 1
+num_steps = {jobs}
+[benchmarks]
+workdir = "work"
+command = "true"
+num_settings = {settings}
+arguments = [{{start = 0, step = 1}}]
+[submission]
+mode = "{mode}"
+workers = {workers}
+max_in_flight = {max_in_flight}
+[persistence]
+backend = "{backend}"
+[status]
+ttl = 0
+"""
+
+def bbar(*args):
+    return [sys.executable, "-c", f"import sys; sys.path.insert(0, {repo!r}); sys.argv = ['bbar', *sys.argv[1:]]; from bbar.cmd import main; main()", *args]
+
+class Phases:
+    def __init__(self, traces):
+        self.times = {}
+        self.traces = traces
+
+    def run(self, name, *args):
+        "Runs a bbar command as phase name, returns its output"
+        if self.traces:
+            calls = len(self.times.get(name, []))
+            args += ("--profile-trace", os.path.join(self.traces, f"{name.replace(' ', '_')}-{calls}.json"))
+        start = time.perf_counter()
+        result = subprocess.run(bbar(*args), check=True, capture_output=True, text=True)
+        self.times.setdefault(name, []).append(time.perf_counter() - start)
+        return result.stdout
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the latency of bbar commands on a large SLURM project, against a fake SLURM")
+    parser.add_argument("--jobs", type=int, default=10000, help="batchfiles (scale points) in the generated project")
+    parser.add_argument("--settings", type=int, default=1, help="commands per batchfile")
+    parser.add_argument("--mode", choices=["separate", "array"], default="separate", help="[submission] mode")
+    parser.add_argument("--workers", type=int, default=8, help="[submission] workers")
+    parser.add_argument("--max-in-flight", type=int, default=0, help="[submission] max_in_flight, 0 submits everything at once")
+    parser.add_argument("--backend", choices=["toml", "sqlite"], default="toml", help="[persistence] backend")
+    parser.add_argument("--queue-delay", type=float, default=1, help="seconds each fake job is pending")
+    parser.add_argument("--runtime", type=float, default=1, help="seconds each fake job runs")
+    parser.add_argument("--json", help="write the phase times to this file")
+    parser.add_argument("--baseline", help="phase times written by an earlier --json, to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown of a phase over the baseline")
+    parser.add_argument("--min-delta", type=float, default=0.1, help="seconds a phase may get slower regardless of --tolerance, for timer noise")
+    parser.add_argument("--traces", help="directory to write a Chrome trace of each phase to")
+    args = parser.parse_args()
+    #The project runs in a temporary directory
+    for name in ["json", "baseline", "traces"]:
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    if args.traces:
+        os.makedirs(args.traces, exist_ok=True)
+
+    phases = Phases(args.traces)
+    with tempfile.TemporaryDirectory() as project:
+        os.chdir(project)
+        os.environ["PATH"] = f"{fake_slurm}{os.pathsep}{os.environ['PATH']}"
+        os.environ.update(FAKE_SLURM_DIR=os.path.join(project, ".fake_slurm"), FAKE_SLURM_EXECUTE="0",
+                          FAKE_SLURM_QUEUE_DELAY=str(args.queue_delay), FAKE_SLURM_RUNTIME=str(args.runtime))
+        with open("bbarfile", "w") as f:
+            f.write(bbarfile_template.format(jobs=args.jobs, settings=args.settings, mode=args.mode, workers=args.workers,
+                                             max_in_flight=args.max_in_flight, backend=args.backend))
+
+        phases.run("generate", "generate", "-f")
+        phases.run("run", "run", "-f")
+        phases.run("status (queued, snapshot)", "status")
+        os.remove(".bbar_snapshot")
+        phases.run("status (queued, expanded)", "status")
+        while "queued by bbar" in phases.run("pump", "pump") + phases.run("status (pumping)", "status"):
+            time.sleep(args.runtime)
+        time.sleep(args.queue_delay + args.runtime)
+        status = phases.run("status (completing)", "status")
+        if "Status: completed" not in status:
+            print(f"WARNING: the project didn't complete:\n{status}")
+        phases.run("status (completed)", "status")
+        phases.run("purge", "purge", "-f")
+
+    mode = f"{args.mode}, max_in_flight = {args.max_in_flight}" if args.max_in_flight else args.mode
+    print(f"{args.jobs} jobs x {args.settings} commands ({mode}, {args.backend} store)")
+    print(f"  {'phase':<28} {'calls':>5} {'median s':>10} {'max s':>10}")
+    for name, times in phases.times.items():
+        print(f"  {name:<28} {len(times):>5} {statistics.median(times):>10.3f} {max(times):>10.3f}")
+    medians = {name:statistics.median(times) for name, times in phases.times.items()}
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"jobs": args.jobs, "settings": args.settings, "mode": args.mode, "phases": medians}, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["phases"]
+        slower = [(name, baseline[name], t) for name, t in medians.items() if name in baseline
+                  and t > baseline[name]*(1 + args.tolerance) and t - baseline[name] > args.min_delta]
+        for name, before, after in slower:
+            print(f"FAIL: {name} took {after:.3f} s, {after/before - 1:+.0%} over the baseline's {before:.3f} s")
+        if slower:
+            sys.exit(1)
+        print(f"OK: no phase is more than {args.tolerance:.0%} slower than the baseline")
+
+if __name__ == "__main__":
+    main()
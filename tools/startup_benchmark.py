@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Measures the startup time of bbar commands on a generated project with a large sweep.
+
+    python3 tools/startup_benchmark.py [--steps 10] [--settings 200] [--repeat 10] [--max-overhead-ms 100]
+
+Reports the median wall time of the bare interpreter, of importing bbar.cmd, of "bbar status" served from the
+project snapshot, and of "bbar status" expanding the full configuration. Exits with 1 if the snapshot path
+takes longer than --max-overhead-ms on top of the bare interpreter, so that slow imports or an expansion
+sneaking back into read-only commands are caught.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+bbarfile_template = """
+scheduler = "LOCAL"
+[sbatch_params]
+job-name = "startup"
+[scaleup]
+start = 1
+step_factor = 2
+num_steps = {steps}
+[benchmarks]
+workdir = "work"
+command = "true"
+num_settings = {settings}
+arguments = [{{start = 0, step = 1}}]
+"""
+
+def bbar(*args):
+    return [sys.executable, "-c", f"import sys; sys.path.insert(0, {repo!r}); sys.argv = ['bbar', *sys.argv[1:]]; from bbar.cmd import main; main()", *args]
+
+def median_time(argv, repeat, before=None):
+    times = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        subprocess.run(argv, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures bbar startup time")
+    parser.add_argument("--steps", type=int, default=10, help="scale points in the generated project")
+    parser.add_argument("--settings", type=int, default=200, help="commands per batchfile in the generated project")
+    parser.add_argument("--repeat", type=int, default=10, help="runs per measurement")
+    parser.add_argument("--max-overhead-ms", type=float, default=100, help="limit for snapshot status time minus bare interpreter time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as project:
+        os.chdir(project)
+        with open("bbarfile", "w") as f:
+            f.write(bbarfile_template.format(steps=args.steps, settings=args.settings))
+        subprocess.run(bbar("generate", "-f"), check=True, stdout=subprocess.DEVNULL)
+        remove_snapshot = lambda: os.path.exists(".bbar_snapshot") and os.remove(".bbar_snapshot")
+
+        bare = median_time([sys.executable, "-c", "pass"], args.repeat)
+        imports = median_time([sys.executable, "-c", f"import sys; sys.path.insert(0, {repo!r}); import bbar.cmd"], args.repeat)
+        full = median_time(bbar("status"), args.repeat, before=remove_snapshot)
+        snapshot = median_time(bbar("status"), args.repeat)
+
+    print(f"{args.steps} batchfiles x {args.settings} commands, median of {args.repeat} runs")
+    print(f"  python -c pass           {bare:8.1f} ms")
+    print(f"  import bbar.cmd          {imports:8.1f} ms")
+    print(f"  bbar status (expanded)   {full:8.1f} ms")
+    print(f"  bbar status (snapshot)   {snapshot:8.1f} ms")
+    overhead = snapshot - bare
+    if overhead > args.max_overhead_ms:
+        print(f"FAIL: bbar status takes {overhead:.1f} ms over interpreter startup, limit is {args.max_overhead_ms:g} ms")
+        sys.exit(1)
+    print(f"OK: bbar status takes {overhead:.1f} ms over interpreter startup")
+
+if __name__ == "__main__":
+    main()